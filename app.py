@@ -2,7 +2,9 @@ import os
 import json
 import signal
 import sys
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import time
+import concurrent.futures
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
@@ -10,6 +12,16 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import logging
 
+from think_parser import ThinkStreamParser, split_thinking, THINKING
+from token_budget import token_counter, select_history, history_tokens, reply_tokens
+from prompt_builder import prompt_builder, without_time_of_day
+from response_cache import response_cache
+from single_flight import chat_flights, session_locks, FlightAbandoned
+from session_store import create_session_store, assign_sequence, SEQ_KEY
+from session_cache import SessionCache
+from write_behind import WriteBehindQueue
+from session_transfer import SessionImporter, export_lines, gzip_chunks, read_lines
+
 # Load environment variables from .env file
 try:
     from dotenv import load_dotenv
@@ -24,6 +36,9 @@ except Exception as e:
 try:
     from rag_service import rag_service
     from file_handler import file_handler
+    from semantic_cache import semantic_cache
+    from bulk_ingest import BulkIngestError, collect_directory, extract_archive
+    from ingestion_jobs import IngestionJobQueue
     RAG_AVAILABLE = True
     print(f"RAG service initialized: {'Available' if rag_service.is_available() else 'Not available'}")
 except ImportError as e:
@@ -68,7 +83,7 @@ CORS(app, resources={
     r"/*": {
         "origins": "*",
         "methods": ["GET", "POST", "DELETE"],
-        "allow_headers": ["Content-Type"]
+        "allow_headers": ["Content-Type", "Idempotency-Key"]
     }
 })
 
@@ -89,31 +104,36 @@ CEREBRAS_MODELS = {
             "name": "Llama 4 Scout",
             "id": "llama-4-scout-17b-16e-instruct",
             "parameters": "109 billion",
-            "speed": "~2600"
+            "speed": "~2600",
+            "context_window": 32768
         },
         {
             "name": "Llama 3.1 8B",
             "id": "llama3.1-8b",
             "parameters": "8 billion",
-            "speed": "~2200"
+            "speed": "~2200",
+            "context_window": 32768
         },
         {
             "name": "Llama 3.3 70B",
             "id": "llama-3.3-70b",
             "parameters": "70 billion",
-            "speed": "~2100"
+            "speed": "~2100",
+            "context_window": 65536
         },
         {
             "name": "OpenAI GPT OSS",
             "id": "gpt-oss-120b",
             "parameters": "120 billion",
-            "speed": "~3000"
+            "speed": "~3000",
+            "context_window": 65536
         },
         {
             "name": "Qwen 3 32B",
             "id": "qwen-3-32b",
             "parameters": "32 billion",
-            "speed": "~2600"
+            "speed": "~2600",
+            "context_window": 65536
         }
     ],
     "preview": [
@@ -121,25 +141,29 @@ CEREBRAS_MODELS = {
             "name": "Llama 4 Maverick",
             "id": "llama-4-maverick-17b-128e-instruct",
             "parameters": "400 billion",
-            "speed": "~2400"
+            "speed": "~2400",
+            "context_window": 32768
         },
         {
             "name": "Qwen 3 235B Instruct",
             "id": "qwen-3-235b-a22b-instruct-2507",
             "parameters": "235 billion",
-            "speed": "~1400"
+            "speed": "~1400",
+            "context_window": 65536
         },
         {
             "name": "Qwen 3 235B Thinking",
             "id": "qwen-3-235b-a22b-thinking-2507",
             "parameters": "235 billion",
-            "speed": "~1700"
+            "speed": "~1700",
+            "context_window": 65536
         },
         {
             "name": "Qwen 3 480B Coder",
             "id": "qwen-3-coder-480b",
             "parameters": "480 billion",
-            "speed": "~2000"
+            "speed": "~2000",
+            "context_window": 65536
         }
     ]
 }
@@ -252,6 +276,9 @@ def save_settings(settings):
 # Initialize settings
 current_settings = load_settings()
 
+# Precompile the static system prompt prefixes for the configured base prompt
+prompt_builder.compile(current_settings["system_prompt"])
+
 # Try to initialize the Cerebras client, but handle the case where it's not available or API key is missing
 cerebras_available = False
 client = None
@@ -267,77 +294,111 @@ try:
 except ImportError:
     print("Cerebras SDK not available. Running in mock mode.")
 
+def session_version(history):
+    """Sequence number of the newest message (0 for an empty session)"""
+    return history[-1][SEQ_KEY] if history else 0
+
+def append_message(history, message):
+    """Append a message with the next sequence number"""
+    message[SEQ_KEY] = session_version(history) + 1
+    history.append(message)
+    return message
+
+def messages_since(history, since):
+    """Messages with a sequence number above `since`, oldest first"""
+    start = len(history)
+    while start > 0 and history[start - 1][SEQ_KEY] > since:
+        start -= 1
+    return history[start:]
+
 # Chat history storage functions
 def load_chat_history(session_id):
     try:
-        history_file = os.path.join(CHAT_HISTORY_DIR, f'chat_history_{session_id}.json')
-        with open(history_file, 'r') as f:
-            return json.load(f)
-    except:
+        return assign_sequence(session_store.load(session_id))
+    except Exception as e:
+        logging.error(f"Failed to load session {session_id}: {e}")
         return []
 
-def save_chat_history(session_id, history):
-    history_file = os.path.join(CHAT_HISTORY_DIR, f'chat_history_{session_id}.json')
-    with open(history_file, 'w') as f:
-        json.dump(history, f, indent=2)
+def save_chat_history(session_id, history, replace=False):
+    """Persist a session; replace=True when the history no longer extends the stored one (a clear)"""
+    if session_writer.enabled:
+        # Persisted by the background writer within SESSION_WRITE_BEHIND_WINDOW
+        active_conversations.put(session_id, history, dirty=True, replace=replace)
+        session_writer.submit(session_id, history, replace=replace)
+        return
 
-def list_chat_sessions():
-    import glob
-    sessions = []
-    pattern = os.path.join(CHAT_HISTORY_DIR, 'chat_history_*.json')
-    for file in glob.glob(pattern):
-        session_id = os.path.basename(file).replace('chat_history_', '').replace('.json', '')
-        try:
-            # Load chat history
-            with open(file, 'r') as f:
-                history = json.load(f)
-
-            # Check for custom title in metadata file
-            metadata_file = os.path.join(CHAT_HISTORY_DIR, f'chat_metadata_{session_id}.json')
-            custom_title = None
-            if os.path.exists(metadata_file):
-                try:
-                    with open(metadata_file, 'r') as f:
-                        metadata = json.load(f)
-                        custom_title = metadata.get('title')
-                except:
-                    pass
-
-            # Use custom title if available, otherwise use first message
-            if custom_title:
-                title = custom_title
-            else:
-                first_msg = next((msg for msg in history if msg['role'] == 'user'), None)
-                title = first_msg['content'][:50] + '...' if first_msg else 'New Chat'
-
-            # Extract all message content for search indexing
-            # Combine all user and assistant messages (exclude system messages)
-            searchable_content = []
-            for msg in history:
-                if msg['role'] in ['user', 'assistant']:
-                    content = msg.get('content', '')
-                    if content:
-                        searchable_content.append(content)
-
-            # Join all content with spaces for searching
-            full_content = ' '.join(searchable_content)
-
-            sessions.append({
-                'id': session_id,
-                'timestamp': session_id.split('_')[0],
-                'title': title,
-                'message_count': len(history),
-                'content': full_content  # Add full content for searching
-            })
-        except:
-            continue
-    return sorted(sessions, key=lambda x: x['timestamp'], reverse=True)
-
-# In-memory storage for active conversations
-active_conversations = {}
+    try:
+        session_store.save(session_id, history, replace=replace)
+    except Exception:
+        # Kept in memory and written back before the session is evicted
+        active_conversations.put(session_id, history, dirty=True, replace=replace)
+        raise
+    active_conversations.mark_clean(session_id, history)
+
+def write_back_session(session_id, history, replace=False):
+    """Persist a dirty session immediately (before it leaves the cache)"""
+    if session_writer.enabled:
+        session_writer.write_now(session_id, history, replace=replace)
+    else:
+        session_store.save(session_id, history, replace=replace)
+
+def flush_sessions():
+    """Persist everything still held in memory (called on shutdown)"""
+    if session_store is None:
+        return  # start_services() never ran
+    if ingestion_jobs is not None:
+        ingestion_jobs.close()  # Interrupted jobs are requeued on the next start
+    session_writer.close()
+    active_conversations.flush()
+    session_store.close()
 
-# Limit conversation history to prevent overly long contexts
-MAX_HISTORY_LENGTH = int(os.environ.get('MAX_HISTORY_LENGTH', 20))  # Configurable from environment
+def list_chat_sessions():
+    return session_store.list_sessions()
+
+# Created by start_services(): importing this module must not open stores or start
+# threads, since bulk ingestion's parser processes re-import the main script
+session_store = None  # SESSION_STORE=json or sqlite; settings.json stays a file
+active_conversations = None  # Bounded LRU of active conversations, see SESSION_CACHE_*
+session_writer = None  # Optional background persistence, see SESSION_WRITE_BEHIND_*
+ingestion_jobs = None  # Background document ingestion, see INGESTION_*
+
+def start_services():
+    """Open the session store and start the background writer and ingestion workers"""
+    global session_store, active_conversations, session_writer, ingestion_jobs
+    if session_store is not None:
+        return
+    session_store = create_session_store(CHAT_HISTORY_DIR)
+    active_conversations = SessionCache(writer=write_back_session)
+    session_writer = WriteBehindQueue(session_store.save_many, on_written=active_conversations.mark_clean)
+    # Uploads return a job id to poll
+    if RAG_AVAILABLE and rag_service.is_available():
+        ingestion_jobs = IngestionJobQueue(rag_service)
+
+# Optional hard cap on the number of history messages sent to the model (0 = no cap)
+MAX_HISTORY_LENGTH = int(os.environ.get('MAX_HISTORY_LENGTH', 0))  # Configurable from environment
+
+# History is otherwise selected by token budget: the model's context window minus
+# the system prompt (including retrieved context), the reply reserve (max_tokens,
+# at most half the window) and a safety margin
+DEFAULT_CONTEXT_WINDOW = int(os.environ.get('DEFAULT_CONTEXT_WINDOW', 8192))
+TOKEN_BUDGET_MARGIN = int(os.environ.get('TOKEN_BUDGET_MARGIN', 256))
+
+def get_context_window(model_id):
+    """Context window (in tokens) for a model id"""
+    for models in CEREBRAS_MODELS.values():
+        for model in models:
+            if model["id"] == model_id:
+                return model.get("context_window", DEFAULT_CONTEXT_WINDOW)
+    return DEFAULT_CONTEXT_WINDOW
+
+# Retrieval stages (RAG and web search) run concurrently with per-stage timeouts
+RETRIEVAL_MAX_WORKERS = int(os.environ.get('RETRIEVAL_MAX_WORKERS', 8))
+RAG_TIMEOUT = float(os.environ.get('RAG_TIMEOUT', 5))  # Seconds
+WEB_SEARCH_TIMEOUT = float(os.environ.get('WEB_SEARCH_TIMEOUT', 8))  # Seconds
+retrieval_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=RETRIEVAL_MAX_WORKERS,
+    thread_name_prefix='retrieval'
+)
 
 @app.route('/models', methods=['GET'])
 def get_models():
@@ -347,6 +408,20 @@ def get_models():
 def index():
     return render_template('index.html')
 
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Runtime statistics for prompt assembly and caches"""
+    return jsonify({
+        "prompt": prompt_builder.stats(),
+        "response_cache": response_cache.stats(),
+        "single_flight": chat_flights.stats(),
+        "session_cache": active_conversations.stats(),
+        "write_behind": session_writer.stats(),
+        "semantic_cache": semantic_cache.stats() if RAG_AVAILABLE else None,
+        "embedding_cache": rag_service.embedding_cache.stats() if RAG_AVAILABLE and rag_service.embedding_cache else None,
+        "ingestion_jobs": ingestion_jobs.stats() if ingestion_jobs is not None else None
+    })
+
 @app.route('/settings', methods=['GET'])
 def get_settings():
     return jsonify(current_settings)
@@ -365,6 +440,8 @@ def update_settings():
     # Update settings
     current_settings.update(new_settings)
     save_settings(current_settings)
+    prompt_builder.compile(current_settings["system_prompt"])
+    clear_semantic_cache()
     return jsonify(current_settings)
 
 @app.route('/settings/reset', methods=['POST'])
@@ -372,52 +449,75 @@ def reset_settings():
     global current_settings
     current_settings = DEFAULT_SETTINGS.copy()
     save_settings(current_settings)
+    prompt_builder.compile(current_settings["system_prompt"])
+    clear_semantic_cache()
     return jsonify(current_settings)
 
-@app.route('/chat', methods=['POST'])
-@limiter.limit(os.environ.get('RATE_LIMIT_CHAT', '30 per minute'))  # Configurable chat rate limit
-def chat():
-    global client, cerebras_available
-    logging.info(f"Chat request received from {request.remote_addr}")
-    
-    if not request.json or 'message' not in request.json or 'session_id' not in request.json:
-        return jsonify({"error": "Invalid request format"}), 400
-    
-    session_id = request.json['session_id']
-    if session_id not in active_conversations:
-        active_conversations[session_id] = load_chat_history(session_id)
-    
-    user_message = request.json['message']
-    conversation_history = active_conversations[session_id]
-    kb_name = request.json.get('kb_name', None)  # Optional knowledge base for RAG
-    use_rag = request.json.get('use_rag', False)  # Enable/disable RAG
-    use_web_search = request.json.get('use_web_search', False)  # Enable/disable web search
-    web_search_query = request.json.get('web_search_query', user_message)  # Custom search query or use message
+# ============================================================================
+# Chat Pipeline Helpers
+# ============================================================================
 
-    # Add user message to conversation history
-    conversation_history.append({
-        "role": "user",
-        "content": user_message
-    })
+# Canned replies used when the Cerebras API is not configured
+MOCK_RESPONSES = [
+    "I'm running in mock mode because the Cerebras API key is not set. In a real implementation, I would connect to the Cerebras model to generate a response.",
+    "This is a mock response. To use the actual Cerebras models, please set the CEREBRAS_API_KEY environment variable.",
+    "Mock mode: I would normally use the Cerebras API to answer your question, but I'm providing a mock response instead."
+]
+
+def retrieve_rag_context(kb_name, user_message):
+    """Search the knowledge base and format the hits as prompt context"""
+    context = {"rag_context": "", "rag_sources": []}
+    logging.info(f"RAG enabled: Searching knowledge base '{kb_name}' for query: '{user_message}'")
+    try:
+        search_results = rag_service.search(kb_name, user_message)
+        if search_results:
+            context["rag_sources"] = search_results
+            context_parts = [f"[Source: {r['file_name']}]\n{r['text']}" for r in search_results]
+            context["rag_context"] = "\n\n".join(context_parts)
+            logging.info(f"✓ RAG: Retrieved {len(search_results)} relevant chunks from '{kb_name}'")
+            logging.info(f"✓ RAG: Context length: {len(context['rag_context'])} characters")
+            logging.info(f"✓ RAG: Sources: {', '.join(set(r['file_name'] for r in search_results))}")
+        else:
+            logging.warning(f"⚠ RAG: No results found in knowledge base '{kb_name}' for query")
+    except Exception as e:
+        logging.error(f"✗ RAG retrieval failed: {e}")
+    return context
+
+def retrieve_web_context(web_search_query):
+    """Run a web search and format the results as prompt context"""
+    context = {"web_search_context": "", "web_search_results": []}
+    try:
+        search_results = web_search_service.search(web_search_query)
+        if search_results:
+            context["web_search_results"] = search_results
+            context["web_search_context"] = web_search_service.format_search_context(search_results)
+            logging.info(f"Retrieved {len(search_results)} web search results")
+    except Exception as e:
+        logging.error(f"Web search failed: {e}")
+    return context
+
+def retrieve_context(user_message, kb_name, use_rag, use_web_search, web_search_query):
+    """
+    Run RAG retrieval and web search for a chat turn
+
+    Both stages run concurrently on the retrieval executor, each with its own
+    timeout budget. A stage that misses its budget is left to finish in the
+    background and the turn goes ahead without its context; the stage is
+    recorded in context["retrieval_skipped"].
+    """
+    context = {
+        "rag_context": "",
+        "rag_sources": [],
+        "web_search_context": "",
+        "web_search_results": [],
+        "retrieval_skipped": []
+    }
+
+    stages = []
 
     # RAG: Retrieve relevant context if enabled
-    rag_context = ""
-    rag_sources = []
     if use_rag and kb_name and RAG_AVAILABLE and rag_service.is_available():
-        logging.info(f"RAG enabled: Searching knowledge base '{kb_name}' for query: '{user_message}'")
-        try:
-            search_results = rag_service.search(kb_name, user_message)
-            if search_results:
-                rag_sources = search_results
-                context_parts = [f"[Source: {r['file_name']}]\n{r['text']}" for r in search_results]
-                rag_context = "\n\n".join(context_parts)
-                logging.info(f"✓ RAG: Retrieved {len(search_results)} relevant chunks from '{kb_name}'")
-                logging.info(f"✓ RAG: Context length: {len(rag_context)} characters")
-                logging.info(f"✓ RAG: Sources: {', '.join(set(r['file_name'] for r in search_results))}")
-            else:
-                logging.warning(f"⚠ RAG: No results found in knowledge base '{kb_name}' for query")
-        except Exception as e:
-            logging.error(f"✗ RAG retrieval failed: {e}")
+        stages.append(("rag", RAG_TIMEOUT, retrieval_executor.submit(retrieve_rag_context, kb_name, user_message)))
     elif use_rag:
         if not kb_name:
             logging.warning("⚠ RAG enabled but no knowledge base selected")
@@ -427,258 +527,625 @@ def chat():
             logging.warning("⚠ RAG enabled but RAG service not initialized")
 
     # Web Search: Retrieve web content if enabled
-    web_search_context = ""
-    web_search_results = []
     if use_web_search and WEB_SEARCH_AVAILABLE and web_search_service.is_available():
+        stages.append(("web_search", WEB_SEARCH_TIMEOUT, retrieval_executor.submit(retrieve_web_context, web_search_query)))
+
+    started = time.monotonic()
+    for stage, timeout, future in stages:
+        remaining = max(0.0, started + timeout - time.monotonic())
         try:
-            search_results = web_search_service.search(web_search_query)
-            if search_results:
-                web_search_results = search_results
-                web_search_context = web_search_service.format_search_context(search_results)
-                logging.info(f"Retrieved {len(search_results)} web search results")
+            context.update(future.result(timeout=remaining))
+            logging.info(f"Retrieval stage '{stage}' finished in {time.monotonic() - started:.2f}s")
+        except concurrent.futures.TimeoutError:
+            logging.warning(f"⚠ Retrieval stage '{stage}' exceeded its {timeout:.1f}s budget; continuing without it")
+            context["retrieval_skipped"].append({"stage": stage, "reason": "timeout", "timeout": timeout})
         except Exception as e:
-            logging.error(f"Web search failed: {e}")
+            logging.error(f"✗ Retrieval stage '{stage}' failed: {e}")
+            context["retrieval_skipped"].append({"stage": stage, "reason": "error", "error": str(e)})
+
+    return context
+
+def build_system_prompt(rag_context, web_search_context):
+    """Assemble the system prompt: static instructions first, date and retrieved context last"""
+    system_prompt = prompt_builder.build(current_settings["system_prompt"], rag_context, web_search_context)
+    stats = prompt_builder.stats()
+    logging.debug(
+        f"System prompt: {stats['last_prompt_bytes']} bytes, "
+        f"{stats['last_stable_prefix_bytes']} bytes unchanged from previous request"
+    )
+    return system_prompt
+
+def history_budget(system_prompt):
+    """Tokens left for conversation history once the system prompt and reply are reserved"""
+    return history_tokens(
+        get_context_window(current_settings["model"]),
+        token_counter.count(system_prompt),
+        int(current_settings["max_tokens"]),
+        TOKEN_BUDGET_MARGIN
+    )
+
+def build_messages(conversation_history, context):
+    """Build the message list sent to the model for a chat turn"""
+    system_prompt = build_system_prompt(context["rag_context"], context["web_search_context"])
 
-    # Limit conversation history length and remove any old system messages
     # System messages should not be in conversation history - we add them fresh each time
-    conversation_history = [msg for msg in conversation_history if msg['role'] != 'system']
+    history = [msg for msg in conversation_history if msg['role'] != 'system']
+    window = select_history(history, history_budget(system_prompt), token_counter, MAX_HISTORY_LENGTH)
 
-    if len(conversation_history) > MAX_HISTORY_LENGTH:
-        # Keep only the most recent messages
-        conversation_history = conversation_history[-MAX_HISTORY_LENGTH:]
+    # Prepare messages with system prompt; only role/content go to the API
+    messages = [{"role": "system", "content": system_prompt}] + [
+        {"role": msg["role"], "content": msg["content"]} for msg in window
+    ]
 
-    if cerebras_available and client:
-        try:
-            # Prepare system prompt - start with base prompt
-            system_prompt = current_settings["system_prompt"]
-
-            # Add current date/time information for context
-            from datetime import datetime
-            current_date = datetime.now().strftime("%B %d, %Y")
-            current_time = datetime.now().strftime("%I:%M %p")
-            current_datetime_full = datetime.now().strftime("%A, %B %d, %Y at %I:%M %p %Z")
-
-            # Prepend date information to system prompt
-            system_prompt = f"""CURRENT DATE AND TIME INFORMATION:
-Today's date: {current_date}
-Current time: {current_time}
-Full date/time: {current_datetime_full}
-
-IMPORTANT: When searching the web or providing information about current events, news, or time-sensitive topics, use this date as reference. This helps you provide the most up-to-date and relevant information.
-
-{system_prompt}
-"""
-
-            # CRITICAL: Add RAG context if available
-            if rag_context:
-                # Override with RAG-specific instructions
-                system_prompt += f"""
-
-{'='*80}
-🔴 CRITICAL - KNOWLEDGE BASE CONTEXT PROVIDED 🔴
-{'='*80}
-
-You have been provided with KNOWLEDGE BASE CONTEXT below. This is MANDATORY reading.
-
-ABSOLUTE REQUIREMENTS:
-1. READ the entire knowledge base context below carefully
-2. Your PRIMARY obligation is to answer based on this knowledge base
-3. You MUST cite source files: "According to [filename]..." or "Based on [filename]..."
-4. You MUST quote directly when appropriate: "The document states: '...'"
-5. If the KB answers the question: Use ONLY KB content (do not add external knowledge)
-6. If the KB partially answers: Use KB first, then supplement with general knowledge (clearly labeled)
-7. If the KB doesn't answer: State "The knowledge base does not contain information about this topic" then provide general knowledge
-
-RESPONSE FORMAT WHEN USING KB:
-- Start with: "Based on the knowledge base..." or "According to [filename]..."
-- Cite every piece of information: "As stated in [filename]..."
-- Quote key passages: "The document states: '...'"
-- End with: "Source: [list of files used]"
-
-{'='*80}
-📚 KNOWLEDGE BASE CONTEXT - READ THIS CAREFULLY:
-{'='*80}
-
-{rag_context}
-
-{'='*80}
-END OF KNOWLEDGE BASE CONTEXT
-{'='*80}
-
-REMINDER: The above knowledge base context is your PRIMARY source. Use it first and foremost.
-"""
-
-            # Add web search context if available
-            if web_search_context:
-                system_prompt += f"""
-
-{'='*80}
-🌐 WEB SEARCH RESULTS PROVIDED 🌐
-{'='*80}
-
-You have been provided with CURRENT WEB SEARCH RESULTS below.
-
-REQUIREMENTS FOR WEB SEARCH:
-1. INCORPORATE up-to-date information from these results
-2. CITE every source with URL: "According to [Source] ([URL])..."
-3. PRIORITIZE recent and authoritative sources
-4. CROSS-REFERENCE when multiple sources agree
-5. NOTE when sources disagree or provide different perspectives
-6. SYNTHESIZE information from multiple sources for comprehensive answers
-7. Include publication dates when available
+    # Log what we're sending to the model
+    logging.info(f"Sending to model: {len(messages)} messages (1 system + {len(window)} history)")
+    if context["rag_context"]:
+        logging.info(f"✓ System prompt includes RAG context ({len(context['rag_context'])} chars)")
+    if context["web_search_context"]:
+        logging.info(f"✓ System prompt includes web search context ({len(context['web_search_context'])} chars)")
 
-RESPONSE FORMAT WHEN USING WEB SEARCH:
-- Cite with URLs: "According to TechCrunch (https://...)..."
-- Note source types: "According to research from MIT..." vs "According to news from BBC..."
-- Synthesize: "Multiple sources (Source1, Source2, Source3) confirm that..."
-- End with: "Sources: [list with URLs]"
+    return messages
 
-{'='*80}
-🔍 WEB SEARCH RESULTS - READ THIS CAREFULLY:
-{'='*80}
+def model_starts_in_thinking(model_id):
+    """Thinking models open the <think> block in their prompt template and only emit the closing tag"""
+    return 'thinking' in model_id
 
-{web_search_context}
+def extract_thinking(full_content):
+    """Split a completed response into (thinking_content, bot_response)"""
+    thinking_content, bot_response = split_thinking(
+        full_content or '',
+        start_in_thinking=model_starts_in_thinking(current_settings["model"])
+    )
 
-{'='*80}
-END OF WEB SEARCH RESULTS
-{'='*80}
+    if thinking_content:
+        logging.info(f"✓ Thinking content extracted from <think> tags ({len(thinking_content)} chars)")
+    else:
+        logging.info("No <think> tags found in response")
 
-REMINDER: Use these web search results to provide current, comprehensive information.
-"""
+    return thinking_content or None, bot_response
 
-            # If both RAG and Web Search are provided
-            if rag_context and web_search_context:
-                system_prompt += f"""
+def start_chat_turn(session_id, user_message):
+    """Record the user message and return the session history"""
+    conversation_history = active_conversations.get_or_load(session_id, load_chat_history)
 
-{'='*80}
-⚡ BOTH KNOWLEDGE BASE AND WEB SEARCH PROVIDED ⚡
-{'='*80}
+    # A retry of a turn that never got a reply reuses the pending user message
+    last = conversation_history[-1] if conversation_history else None
+    if last and last.get("role") == "user" and last.get("content") == user_message:
+        return conversation_history
 
-You have BOTH internal knowledge base AND external web search results.
+    # Add user message to conversation history
+    user_entry = {
+        "role": "user",
+        "content": user_message
+    }
+    append_message(conversation_history, user_entry)
 
-SYNTHESIS REQUIREMENTS:
-1. START with knowledge base (internal, authoritative for your organization)
-2. SUPPLEMENT with web search (external, current, broader context)
-3. CLEARLY distinguish sources:
-   - "According to our internal documentation [filename]..."
-   - "According to external sources [Source Name] ([URL])..."
-4. SYNTHESIZE for comprehensive answers
-5. RESOLVE conflicts by presenting both perspectives
-6. CITE ALL sources (both KB files and web URLs)
+    return conversation_history
 
-RESPONSE STRUCTURE:
-1. Internal Knowledge: "Based on our knowledge base [filename]..."
-2. External Context: "According to external sources [URL]..."
-3. Synthesis: "Combining internal documentation with current information..."
-4. Sources: "Internal: [files], External: [URLs]"
-
-{'='*80}
-"""
-
-            # Prepare messages with system prompt (no system messages in conversation_history)
-            messages = [{"role": "system", "content": system_prompt}] + conversation_history
-
-            # Log what we're sending to the model
-            logging.info(f"Sending to model: {len(messages)} messages (1 system + {len(conversation_history)} history)")
-            if rag_context:
-                logging.info(f"✓ System prompt includes RAG context ({len(rag_context)} chars)")
-            if web_search_context:
-                logging.info(f"✓ System prompt includes web search context ({len(web_search_context)} chars)")
-
-            # Call the Cerebras API with the conversation history and settings
-            chat_completion = client.chat.completions.create(
-                messages=messages,
-                model=current_settings["model"],
-                temperature=current_settings["temperature"],
-                max_tokens=current_settings["max_tokens"]
-            )
+def finish_chat_turn(session_id, conversation_history, bot_response):
+    """Append the assistant reply and persist the session"""
+    # Add bot response to conversation history
+    assistant_entry = {
+        "role": "assistant",
+        "content": bot_response
+    }
+    append_message(conversation_history, assistant_entry)
+
+    # Save updated conversation history
+    active_conversations[session_id] = conversation_history
+    save_chat_history(session_id, conversation_history)
+
+def mock_response_for(conversation_history):
+    """Pick a canned reply for mock mode"""
+    return MOCK_RESPONSES[len(conversation_history) % len(MOCK_RESPONSES)]
+
+def sse_event(event, data):
+    """Format a single Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def wants_stream(data):
+    """Check whether the client asked for a streamed /chat response"""
+    if data.get('stream') is True:
+        return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+def parse_chat_request(data, idempotency_header=None):
+    """Validate a /chat payload and normalise its options, or return None if invalid"""
+    if not data or 'message' not in data or 'session_id' not in data:
+        return None
+
+    user_message = data['message']
+    return {
+        "session_id": data['session_id'],
+        "user_message": user_message,
+        "kb_name": data.get('kb_name', None),  # Optional knowledge base for RAG
+        "use_rag": data.get('use_rag', False),  # Enable/disable RAG
+        "use_web_search": data.get('use_web_search', False),  # Enable/disable web search
+        "web_search_query": data.get('web_search_query', user_message),  # Custom search query or use message
+        "cache": data.get('cache') if isinstance(data.get('cache'), bool) else None,  # Force (true) or bypass (false) the response cache
+        "semantic_cache": data.get('semantic_cache', True) is not False,  # Opt out of the semantic cache for this turn
+        "include_history": data.get('include_history') is True,  # Legacy clients: echo the full history
+        "idempotency_key": data.get('idempotency_key') or idempotency_header  # Retries with the same key share one result
+    }
 
-            # Extract the response content and thinking process
-            message = chat_completion.choices[0].message
-            full_content = message.content
-
-            # Extract thinking content from <think> tags if present
-            thinking_content = None
-            bot_response = full_content
-
-            # Check if content contains <think> tags
-            import re
-            think_pattern = r'<think>(.*?)</think>'
-            think_match = re.search(think_pattern, full_content, re.DOTALL)
-
-            if think_match:
-                # Extract thinking content
-                thinking_content = think_match.group(1).strip()
-                # Remove <think> tags from the response
-                bot_response = re.sub(think_pattern, '', full_content, flags=re.DOTALL).strip()
-                logging.info(f"✓ Thinking content extracted from <think> tags ({len(thinking_content)} chars)")
-                print(f"\n✓ Thinking content extracted: {len(thinking_content)} chars\n")
-            else:
-                logging.info("No <think> tags found in response")
-
-            # Add bot response to conversation history
-            conversation_history.append({
-                "role": "assistant",
-                "content": bot_response
-            })
+def completion_params():
+    """Model parameters for the Cerebras chat completions call"""
+    params = {
+        "model": current_settings["model"],
+        "temperature": current_settings["temperature"],
+        # The reply reserve the history was budgeted with, so the request fits the window
+        "max_tokens": reply_tokens(get_context_window(current_settings["model"]), int(current_settings["max_tokens"]))
+    }
+    # A fixed seed makes sampling repeatable (and therefore cacheable)
+    if current_settings.get("seed") is not None:
+        params["seed"] = current_settings["seed"]
+    return params
+
+def cached_completion(messages, cache_mode):
+    """
+    Look up the response cache for a request
+
+    Returns (cache_key, content): cache_key is None when the request bypasses
+    the cache, content is None on a miss.
+    """
+    params = completion_params()
+    if not response_cache.should_cache(params, cache_mode):
+        return None, None
+    # The time of day in the system prompt would make every minute a different request
+    key_messages = [
+        {**msg, "content": without_time_of_day(msg["content"])} if msg["role"] == "system" else msg
+        for msg in messages
+    ]
+    cache_key = response_cache.make_key(key_messages, params)
+    entry = response_cache.get(cache_key)
+    if entry:
+        logging.info(f"✓ Response cache hit ({cache_key[:12]})")
+        return cache_key, entry["content"]
+    return cache_key, None
+
+def semantic_cache_lookup(turn, conversation_history):
+    """
+    Look up the semantic cache for an opening question
+
+    Returns (probe, hit): probe is None when the turn is not eligible, hit is
+    None on a miss. Only the first turn of a session is eligible, since later
+    answers depend on the conversation so far, and web search turns are
+    skipped because their answers depend on live results.
+    """
+    if not (RAG_AVAILABLE and semantic_cache.is_available()) or not turn["semantic_cache"]:
+        return None, None
+    if turn["use_web_search"] or len(conversation_history) > 1:
+        return None, None
+
+    vector = semantic_cache.embed(turn["user_message"])
+    if vector is None:
+        return None, None
+
+    probe = {
+        "vector": vector,
+        "query": turn["user_message"],
+        "model": current_settings["model"],
+        "kb_name": turn["kb_name"] if turn["use_rag"] else None
+    }
+    return probe, semantic_cache.lookup(vector, probe["model"], probe["kb_name"])
+
+def remember_semantic(probe, bot_response, thinking_content, context):
+    """Store a fresh answer in the semantic cache if the turn was eligible"""
+    # Answers produced with a retrieval stage missing are not worth reusing
+    if probe is None or context["retrieval_skipped"]:
+        return
+    semantic_cache.store(probe["vector"], probe["model"], probe["kb_name"], probe["query"], {
+        "response": bot_response,
+        "thinking": thinking_content,
+        "rag_sources": context["rag_sources"]
+    })
+
+def semantic_hit_context(hit):
+    """Turn context for an answer served from the semantic cache (no retrieval is run)"""
+    return {
+        "rag_context": "",
+        "rag_sources": hit.get("rag_sources") or [],
+        "web_search_context": "",
+        "web_search_results": [],
+        "retrieval_skipped": []
+    }
 
-            # Save updated conversation history
-            active_conversations[session_id] = conversation_history
-            save_chat_history(session_id, conversation_history)
+def semantic_match(hit):
+    """Report which earlier question a semantic cache hit came from"""
+    return {"query": hit["query"], "similarity": round(hit["similarity"], 4)}
+
+def clear_semantic_cache():
+    """Cached answers depend on the system prompt and model settings"""
+    if RAG_AVAILABLE:
+        semantic_cache.clear()
+
+def chat_response_data(bot_response, thinking_content, conversation_history, context, cached=False):
+    """Build the JSON body returned by /chat"""
+    response_data = {
+        "response": bot_response,
+        # Only the user message and reply added by this turn; clients that fall behind
+        # catch up with GET /sessions/<id>?since=<version>
+        "messages": conversation_history[-2:],
+        "version": session_version(conversation_history)
+    }
 
-            # Return the response as JSON
-            response_data = {
-                "response": bot_response,
-                "history": conversation_history
-            }
+    # Flag responses served from the response cache
+    if cached:
+        response_data["cached"] = True
+
+    # Include thinking content if available
+    if thinking_content:
+        response_data["thinking"] = thinking_content
+
+    # Include RAG sources if available
+    if context["rag_sources"]:
+        response_data["rag_sources"] = context["rag_sources"]
+        response_data["rag_enabled"] = True
+
+    # Include web search results if available
+    if context["web_search_results"]:
+        response_data["web_search_results"] = context["web_search_results"]
+        response_data["web_search_enabled"] = True
+
+    # Report retrieval stages that were dropped for this turn
+    if context["retrieval_skipped"]:
+        response_data["retrieval_skipped"] = context["retrieval_skipped"]
+
+    return response_data
+
+def context_events(context):
+    """SSE events for retrieved context, sent before the first token"""
+    events = []
+    if context["rag_sources"]:
+        events.append(sse_event("rag_sources", {"rag_sources": context["rag_sources"], "rag_enabled": True}))
+    if context["web_search_results"]:
+        events.append(sse_event("web_search_results", {
+            "web_search_results": context["web_search_results"],
+            "web_search_enabled": True
+        }))
+    if context["retrieval_skipped"]:
+        events.append(sse_event("retrieval_skipped", {"retrieval_skipped": context["retrieval_skipped"]}))
+    return events
+
+def channel_events(segments):
+    """SSE events for (channel, text) segments from the think parser"""
+    return [sse_event("thinking" if channel == THINKING else "token", {"content": text}) for channel, text in segments]
+
+def done_event(bot_response, thinking_content, conversation_history, cached=False):
+    """Final SSE event for a completed turn"""
+    done_data = {
+        "response": bot_response,
+        "messages": conversation_history[-2:],
+        "version": session_version(conversation_history)
+    }
+    if thinking_content:
+        done_data["thinking"] = thinking_content
+    if cached:
+        done_data["cached"] = True
+    return sse_event("done", done_data)
+
+def new_think_parser():
+    """Think-tag parser configured for the current model"""
+    return ThinkStreamParser(start_in_thinking=model_starts_in_thinking(current_settings["model"]))
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # Disable proxy buffering (nginx)
+}
+
+def replay_chat_turn(session_id, conversation_history, context, hit, outcome):
+    """Generate SSE events for an answer served from the semantic cache"""
+    yield from context_events(context)
+    if hit.get("thinking"):
+        yield sse_event("thinking", {"content": hit["thinking"]})
+    yield sse_event("token", {"content": hit["response"]})
+    finish_chat_turn(session_id, conversation_history, hit["response"])
+    outcome["result"] = (semantic_response_data(hit, conversation_history, context), 200)
+    yield done_event(hit["response"], hit.get("thinking"), conversation_history, cached=True)
+
+def stream_chat_turn(session_id, conversation_history, context, cache_mode, semantic_probe, outcome):
+    """
+    Generate SSE events for a chat turn
+
+    Events, in order:
+        rag_sources / web_search_results - retrieved context, sent before the first token
+        retrieval_skipped - retrieval stages dropped because they timed out or failed
+        thinking - incremental <think> reasoning text, split out as it streams
+        token - incremental response text as it arrives from the model
+        done - final response (and thinking content) once the turn is persisted
+        error - the model call failed; nothing is persisted
+
+    The finished turn's (response_data, status) is stored in outcome["result"].
+    """
+    yield from context_events(context)
+
+    if not (cerebras_available and client):
+        # Mock mode: stream the canned reply word by word
+        mock_response = mock_response_for(conversation_history)
+        for word in mock_response.split(' '):
+            yield sse_event("token", {"content": word + ' '})
+        finish_chat_turn(session_id, conversation_history, mock_response)
+        outcome["result"] = (chat_response_data(mock_response, None, conversation_history, context), 200)
+        yield done_event(mock_response, None, conversation_history)
+        return
+
+    messages = build_messages(conversation_history, context)
+    parser = new_think_parser()
+
+    cache_key, cached_content = cached_completion(messages, cache_mode)
+    if cached_content is not None:
+        # Replay the cached response as a single chunk
+        yield from channel_events(parser.feed(cached_content) + parser.flush())
+        finish_chat_turn(session_id, conversation_history, parser.answer)
+        outcome["result"] = (chat_response_data(
+            parser.answer, parser.thinking or None, conversation_history, context, cached=True
+        ), 200)
+        yield done_event(parser.answer, parser.thinking or None, conversation_history, cached=True)
+        return
+
+    raw_parts = []
+    stream = None
+    try:
+        # Call the Cerebras API in streaming mode
+        stream = client.chat.completions.create(messages=messages, stream=True, **completion_params())
+
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                raw_parts.append(delta)
+                yield from channel_events(parser.feed(delta))
+
+        yield from channel_events(parser.flush())
+    except GeneratorExit:
+        # Client disconnected mid-stream; the partial answer is not persisted
+        logging.warning(f"Client disconnected from stream for session {session_id}")
+        raise
+    except Exception as e:
+        logging.error(f"Streaming chat failed: {e}")
+        error_message = f"Error: {str(e)}"
+        outcome["result"] = ({"response": error_message}, 500)
+        yield sse_event("error", {"error": error_message})
+        return
+    finally:
+        if stream is not None and hasattr(stream, 'close'):
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    if cache_key:
+        response_cache.put(cache_key, ''.join(raw_parts))
+
+    thinking_content, bot_response = parser.thinking or None, parser.answer
+    if thinking_content:
+        logging.info(f"✓ Thinking content streamed from <think> tags ({len(thinking_content)} chars)")
+    remember_semantic(semantic_probe, bot_response, thinking_content, context)
+    finish_chat_turn(session_id, conversation_history, bot_response)
+    outcome["result"] = (chat_response_data(bot_response, thinking_content, conversation_history, context), 200)
+    yield done_event(bot_response, thinking_content, conversation_history)
+
+def semantic_response_data(hit, conversation_history, context):
+    """JSON body for an answer served from the semantic cache"""
+    response_data = chat_response_data(
+        hit["response"], hit.get("thinking"), conversation_history, context, cached=True
+    )
+    response_data["semantic_match"] = semantic_match(hit)
+    return response_data
+
+def stream_turn(turn, outcome):
+    """Generate SSE events for a whole chat turn, from recording the user message to the done event"""
+    session_id = turn["session_id"]
+    conversation_history = start_chat_turn(session_id, turn["user_message"])
+
+    # A paraphrase of an earlier opening question is answered without retrieval or an LLM call
+    semantic_probe, semantic_hit = semantic_cache_lookup(turn, conversation_history)
+    if semantic_hit:
+        context = semantic_hit_context(semantic_hit)
+        yield from replay_chat_turn(session_id, conversation_history, context, semantic_hit, outcome)
+        return
+
+    context = retrieve_context(
+        turn["user_message"], turn["kb_name"], turn["use_rag"], turn["use_web_search"], turn["web_search_query"]
+    )
+    yield from stream_chat_turn(session_id, conversation_history, context, turn["cache"], semantic_probe, outcome)
+
+def run_chat_turn(turn):
+    """Run a non-streamed chat turn and return (response_data, status)"""
+    session_id = turn["session_id"]
+    conversation_history = start_chat_turn(session_id, turn["user_message"])
+
+    # A paraphrase of an earlier opening question is answered without retrieval or an LLM call
+    semantic_probe, semantic_hit = semantic_cache_lookup(turn, conversation_history)
+    if semantic_hit:
+        context = semantic_hit_context(semantic_hit)
+        finish_chat_turn(session_id, conversation_history, semantic_hit["response"])
+        return semantic_response_data(semantic_hit, conversation_history, context), 200
+
+    context = retrieve_context(
+        turn["user_message"], turn["kb_name"], turn["use_rag"], turn["use_web_search"], turn["web_search_query"]
+    )
+
+    if cerebras_available and client:
+        try:
+            messages = build_messages(conversation_history, context)
 
-            # Include thinking content if available
-            if thinking_content:
-                response_data["thinking"] = thinking_content
+            # Serve identical deterministic requests from the response cache
+            cache_key, full_content = cached_completion(messages, turn["cache"])
+            cached = full_content is not None
 
-            # Include RAG sources if available
-            if rag_sources:
-                response_data["rag_sources"] = rag_sources
-                response_data["rag_enabled"] = True
+            if not cached:
+                # Call the Cerebras API with the conversation history and settings
+                chat_completion = client.chat.completions.create(messages=messages, **completion_params())
+                full_content = chat_completion.choices[0].message.content
+                if cache_key:
+                    response_cache.put(cache_key, full_content)
 
-            # Include web search results if available
-            if web_search_results:
-                response_data["web_search_results"] = web_search_results
-                response_data["web_search_enabled"] = True
+            # Extract the response content and thinking process
+            thinking_content, bot_response = extract_thinking(full_content)
+            if not cached:
+                remember_semantic(semantic_probe, bot_response, thinking_content, context)
 
-            return jsonify(response_data)
+            finish_chat_turn(session_id, conversation_history, bot_response)
+            return chat_response_data(bot_response, thinking_content, conversation_history, context, cached), 200
         except Exception as e:
             # Handle any errors that occur during the API call
             error_message = f"Error: {str(e)}"
-            return jsonify({"response": error_message}), 500
+            return {"response": error_message}, 500
     else:
         # Mock response when Cerebras is not available
-        mock_responses = [
-            "I'm running in mock mode because the Cerebras API key is not set. In a real implementation, I would connect to the Cerebras model to generate a response.",
-            "This is a mock response. To use the actual Cerebras models, please set the CEREBRAS_API_KEY environment variable.",
-            "Mock mode: I would normally use the Cerebras API to answer your question, but I'm providing a mock response instead."
-        ]
-        
-        # Add a mock response to conversation history
-        mock_response = mock_responses[len(conversation_history) % len(mock_responses)]
-        conversation_history.append({
-            "role": "assistant",
-            "content": mock_response
-        })
-        
-        # Save updated conversation history
-        active_conversations[session_id] = conversation_history
-        save_chat_history(session_id, conversation_history)
-        
-        # Return the mock response as JSON
-        return jsonify({
-            "response": mock_response,
-            "history": conversation_history
-        })
+        mock_response = mock_response_for(conversation_history)
+        finish_chat_turn(session_id, conversation_history, mock_response)
+        return chat_response_data(mock_response, None, conversation_history, context), 200
+
+# ============================================================================
+# Request Coalescing
+# ============================================================================
+
+def flight_key(turn):
+    """Single-flight key: same session, same message, same idempotency key"""
+    return chat_flights.make_key(turn["session_id"], turn["user_message"], turn["idempotency_key"])
+
+def with_history(response_data, turn):
+    """Add the full session history for legacy clients that asked for it"""
+    if not turn["include_history"]:
+        return response_data
+    history = active_conversations.get(turn["session_id"], [])
+    return {**response_data, "history": history}
+
+def shared_result(response_data):
+    """Mark a result that was shared from an identical in-flight request"""
+    return {**response_data, "coalesced": True}
+
+def result_events(response_data, status):
+    """SSE events replaying a finished turn's result for a coalesced streaming request"""
+    if status != 200:
+        return [sse_event("error", {"error": response_data.get("response") or response_data.get("error")})]
+
+    events = context_events({
+        "rag_sources": response_data.get("rag_sources", []),
+        "web_search_results": response_data.get("web_search_results", []),
+        "retrieval_skipped": response_data.get("retrieval_skipped", [])
+    })
+    if response_data.get("thinking"):
+        events.append(sse_event("thinking", {"content": response_data["thinking"]}))
+    events.append(sse_event("token", {"content": response_data["response"]}))
+    done_keys = ("response", "messages", "version", "thinking", "cached", "coalesced")
+    events.append(sse_event("done", {key: response_data[key] for key in done_keys if key in response_data}))
+    return events
+
+FLIGHT_TIMEOUT_RESULT = ({"error": "Timed out waiting for an identical request in progress"}, 504)
+
+def coalesced_chat_turn(turn):
+    """Run a non-streamed turn, or share the result of an identical request already in flight"""
+    key = flight_key(turn)
+    while True:
+        flight, leader = chat_flights.join(key)
+        if leader:
+            break
+        logging.info(f"Coalescing duplicate chat request for session {turn['session_id']}")
+        try:
+            response_data, status = flight.wait(chat_flights.wait_timeout)
+            return shared_result(response_data), status
+        except FlightAbandoned:
+            continue  # The first request went away; retry, possibly as the leader
+        except TimeoutError:
+            return FLIGHT_TIMEOUT_RESULT
+
+    try:
+        # Turns for one session run one at a time
+        with session_locks.hold(turn["session_id"]):
+            result = run_chat_turn(turn)
+    except BaseException:
+        chat_flights.abandon(key, flight)
+        raise
+    chat_flights.complete(key, flight, result, keep=bool(turn["idempotency_key"]))
+    return result
+
+def coalesced_stream_turn(turn):
+    """Stream a turn, or replay the result of an identical request already in flight"""
+    key = flight_key(turn)
+    while True:
+        flight, leader = chat_flights.join(key)
+        if leader:
+            break
+        logging.info(f"Coalescing duplicate streaming chat request for session {turn['session_id']}")
+        try:
+            response_data, status = flight.wait(chat_flights.wait_timeout)
+        except FlightAbandoned:
+            continue
+        except TimeoutError:
+            response_data, status = FLIGHT_TIMEOUT_RESULT
+        yield from result_events(shared_result(response_data), status)
+        return
+
+    outcome = {}
+    try:
+        with session_locks.hold(turn["session_id"]):
+            yield from stream_turn(turn, outcome)
+    finally:
+        if "result" in outcome:
+            chat_flights.complete(key, flight, outcome["result"], keep=bool(turn["idempotency_key"]))
+        else:
+            chat_flights.abandon(key, flight)
+
+@app.route('/chat', methods=['POST'])
+@limiter.limit(os.environ.get('RATE_LIMIT_CHAT', '30 per minute'))  # Configurable chat rate limit
+def chat():
+    logging.info(f"Chat request received from {request.remote_addr}")
+
+    turn = parse_chat_request(request.json, request.headers.get('Idempotency-Key'))
+    if turn is None:
+        return jsonify({"error": "Invalid request format"}), 400
+
+    if wants_stream(request.json):
+        return Response(
+            stream_with_context(coalesced_stream_turn(turn)),
+            mimetype='text/event-stream',
+            headers=SSE_HEADERS
+        )
+
+    response_data, status = coalesced_chat_turn(turn)
+    return jsonify(with_history(response_data, turn)), status
+
+# Page sizes for GET /sessions?limit= and GET /sessions/<id>?limit=
+SESSION_PAGE_MAX = 500
+MESSAGE_PAGE_DEFAULT = 50
+MESSAGE_PAGE_MAX = 500
 
 @app.route('/sessions', methods=['GET'])
 def get_sessions():
-    return jsonify(list_chat_sessions())
+    # Without limit/cursor the full list is returned, as before pagination existed
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        return jsonify(list_chat_sessions())
+
+    limit = min(max(request.args.get('limit', 50, type=int), 1), SESSION_PAGE_MAX)
+    sessions, next_cursor = session_store.list_sessions_page(limit, request.args.get('cursor') or None)
+    return jsonify({"sessions": sessions, "next_cursor": next_cursor})
+
+@app.route('/sessions/search', methods=['GET'])
+def search_sessions():
+    """Full-text search over session messages, ranked, with highlighted snippets"""
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    if not query:
+        return jsonify({"query": query, "results": []})
+
+    try:
+        results = session_store.search(query, limit)
+    except Exception as e:
+        logging.error(f"Error searching sessions: {e}")
+        return jsonify({"error": "Search failed"}), 500
+
+    # Titles come from the session index, not the search index
+    sessions = {session['id']: session for session in list_chat_sessions()}
+    for result in results:
+        session = sessions.get(result['id'], {})
+        result['title'] = session.get('title', 'New Chat')
+        result['timestamp'] = session.get('timestamp', result['id'].split('_')[0])
+        result['message_count'] = session.get('message_count', 0)
+    return jsonify({"query": query, "results": results})
 
 @app.route('/sessions', methods=['POST'])
 def create_session():
@@ -689,24 +1156,47 @@ def create_session():
 
 @app.route('/sessions/<session_id>', methods=['GET'])
 def get_session(session_id):
-    if session_id not in active_conversations:
-        active_conversations[session_id] = load_chat_history(session_id)
-    return jsonify(active_conversations[session_id])
+    if 'before' in request.args or 'limit' in request.args:
+        return jsonify(session_messages_page(session_id))
+
+    history = active_conversations.get_or_load(session_id, load_chat_history)
+
+    # ?since=<version> returns only the messages the client is missing
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify(history)
+
+    version = session_version(history)
+    if since > version:
+        # The session was cleared or replaced; the client must start over
+        return jsonify({"version": version, "messages": history, "reset": True})
+    return jsonify({"version": version, "messages": messages_since(history, since)})
+
+def session_messages_page(session_id):
+    """?before=<seq>&limit=<n>: the n messages preceding seq (the newest n without before)"""
+    limit = min(max(request.args.get('limit', MESSAGE_PAGE_DEFAULT, type=int), 1), MESSAGE_PAGE_MAX)
+    before = request.args.get('before', type=int)
+
+    history = active_conversations.get(session_id)
+    if history is not None:
+        older = [m for m in history if before is None or m.get(SEQ_KEY, 0) < before]
+        messages = older[-(limit + 1):]
+        version = session_version(history)
+    else:
+        # Read straight from the store without caching the whole session
+        messages = session_store.load_tail(session_id, limit + 1, before)
+        version = session_version(messages if before is None else session_store.load_tail(session_id, 1))
+
+    # One extra message was read to tell whether there is an earlier page
+    return {"version": version, "messages": messages[-limit:], "has_more": len(messages) > limit}
 
 @app.route('/sessions/<session_id>', methods=['DELETE'])
 def delete_session(session_id):
-    if session_id in active_conversations:
-        del active_conversations[session_id]
+    active_conversations.discard(session_id)
+    session_writer.discard(session_id)
     try:
-        # Delete chat history file
-        history_file = os.path.join(CHAT_HISTORY_DIR, f'chat_history_{session_id}.json')
-        if os.path.exists(history_file):
-            os.remove(history_file)
-
-        # Delete metadata file if exists
-        metadata_file = os.path.join(CHAT_HISTORY_DIR, f'chat_metadata_{session_id}.json')
-        if os.path.exists(metadata_file):
-            os.remove(metadata_file)
+        # Delete chat history and metadata
+        session_store.delete(session_id)
     except Exception as e:
         logging.error(f"Error deleting session files: {e}")
     return jsonify({"status": "success"})
@@ -722,18 +1212,9 @@ def rename_session(session_id):
     if not new_title:
         return jsonify({"error": "Title cannot be empty"}), 400
 
-    # Load the session history
-    if session_id in active_conversations:
-        history = active_conversations[session_id]
-    else:
-        history = load_chat_history(session_id)
-
     # Save with updated metadata (the title will be used when listing sessions)
-    # We'll store the custom title in a separate metadata file
     try:
-        metadata_file = os.path.join(CHAT_HISTORY_DIR, f'chat_metadata_{session_id}.json')
-        with open(metadata_file, 'w') as f:
-            json.dump({"title": new_title}, f, indent=2)
+        session_store.set_metadata(session_id, title=new_title)
         return jsonify({"status": "success", "title": new_title})
     except Exception as e:
         logging.error(f"Error renaming session: {e}")
@@ -741,9 +1222,8 @@ def rename_session(session_id):
 
 @app.route('/sessions/<session_id>/export', methods=['GET'])
 def export_session(session_id):
-    if session_id in active_conversations:
-        history = active_conversations[session_id]
-    else:
+    history = active_conversations.get(session_id)
+    if history is None:
         history = load_chat_history(session_id)
     
     return jsonify({
@@ -760,20 +1240,69 @@ def import_session():
     
     from datetime import datetime
     session_id = datetime.now().strftime('%Y%m%d_%H%M%S')
-    active_conversations[session_id] = data['history']
-    save_chat_history(session_id, data['history'])
+    history = assign_sequence(data['history'])
+    active_conversations[session_id] = history
+    save_chat_history(session_id, history)
     
     if 'settings' in data:
         update_settings(data['settings'])
     
     return jsonify({"session_id": session_id})
 
+@app.route('/sessions/export-all', methods=['GET'])
+def export_all_sessions():
+    """Stream every session as NDJSON (?compression=gzip to gzip it), loading one session at a time"""
+    compression = request.args.get('compression', '').lower()
+    if compression not in ('', 'gzip'):
+        return jsonify({"error": "compression must be gzip"}), 400
+
+    # Include saves the write-behind writer has not persisted yet
+    session_writer.flush()
+
+    def load(session_id):
+        history = active_conversations.peek(session_id)
+        return history if history is not None else session_store.load(session_id)
+
+    from datetime import datetime
+    filename = f"chat_sessions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+    body = export_lines(session_store, load)
+    if compression == 'gzip':
+        body = gzip_chunks(body)
+        filename += '.gz'
+    return Response(
+        stream_with_context(body),
+        mimetype='application/gzip' if compression else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/sessions/import-all', methods=['POST'])
+def import_all_sessions():
+    """
+    Import an NDJSON export (plain or gzipped) streamed as the request body
+
+    Sessions that already exist are skipped unless ?replace=true. The response
+    is NDJSON too: a progress line after each batch, then a summary with errors.
+    """
+    replace = request.args.get('replace', 'false').lower() == 'true'
+
+    def forget_cached(session_id):
+        # The imported history supersedes anything held in memory
+        active_conversations.discard(session_id)
+        session_writer.discard(session_id)
+
+    importer = SessionImporter(session_store, replace=replace, on_write=forget_cached)
+    reports = importer.run(read_lines(request.stream))
+    return Response(
+        stream_with_context(json.dumps(report) + '\n' for report in reports),
+        mimetype='application/x-ndjson'
+    )
+
 @app.route('/clear', methods=['POST'])
 def clear():
     session_id = request.json.get('session_id')
     if session_id:
         active_conversations[session_id] = []
-        save_chat_history(session_id, [])
+        save_chat_history(session_id, [], replace=True)
     return jsonify({"response": "Conversation history cleared"})
 
 # ============================================================================
@@ -928,29 +1457,126 @@ def upload_file(kb_name):
     if file.filename == '':
         return jsonify({"error": "No file selected"}), 400
 
-    # Save file
+    # Save file (a re-upload replaces the earlier version)
+    is_new = not file_handler.file_path(file.filename, kb_name).exists()
     file_path = file_handler.save_file(file, kb_name)
     if not file_path:
         return jsonify({"error": "Failed to save file"}), 500
 
-    # Add to knowledge base
+    # Index it in the background; the job removes a new file if processing fails
     metadata = {
         'uploaded_by': request.form.get('uploaded_by', 'unknown'),
         'description': request.form.get('description', '')
     }
+    document_name = os.path.basename(file_path)
+    job_id = ingestion_jobs.submit('file', kb_name, {
+        'file_path': file_path,
+        'document_name': document_name,
+        'metadata': metadata,
+        'is_new': is_new
+    }, document=document_name)
 
-    success = rag_service.add_document(kb_name, file_path, metadata)
+    return jsonify({
+        "message": "File uploaded, processing in the background",
+        "file_name": file.filename,
+        "kb_name": kb_name,
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}"
+    }), 202
+
+@app.route('/knowledge-bases/<kb_name>/bulk-upload', methods=['POST'])
+@limiter.limit("10 per minute")
+def bulk_upload(kb_name):
+    """
+    Ingest a zip/tar archive (multipart field 'archive') or a server directory
+    (JSON {"directory": ...} under BULK_INGEST_ROOT) into a knowledge base
+
+    The files are ingested by a background job; the response (202) carries
+    its id, and GET /jobs/<id> reports progress and the files that failed.
+    """
+    if not RAG_AVAILABLE or not rag_service.is_available():
+        return jsonify({"error": "RAG service not available"}), 503
 
-    if success:
-        return jsonify({
-            "message": "File uploaded and processed successfully",
-            "file_name": file.filename,
-            "kb_name": kb_name
-        })
-    else:
-        # Clean up file if processing failed
-        file_handler.delete_file(file_path)
-        return jsonify({"error": "Failed to process file"}), 500
+    # Checked before anything is written: the archive is unpacked into this folder
+    kb_folder = file_handler.knowledge_base_folder(kb_name)
+    if kb_folder is None:
+        return jsonify({"error": "Invalid knowledge base name"}), 400
+    if not rag_service.knowledge_base_exists(kb_name):
+        return jsonify({"error": f"Knowledge base '{kb_name}' not found"}), 404
+
+    allowed, max_size = file_handler.allowed_file, file_handler.max_file_size
+    archive = request.files.get('archive')
+    try:
+        if archive and archive.filename:
+            # Unpacked beside single uploads, so the files stay available like any upload
+            archive_path = file_handler.upload_folder / f".bulk-{os.getpid()}-{time.time_ns()}.tmp"
+            archive.save(str(archive_path))
+            try:
+                files, skipped = extract_archive(str(archive_path), kb_folder, allowed, max_size)
+            finally:
+                archive_path.unlink(missing_ok=True)
+            metadata = {
+                'uploaded_by': request.form.get('uploaded_by', 'unknown'),
+                'description': request.form.get('description', '')
+            }
+        else:
+            data = request.get_json(silent=True) or {}
+            if not data.get('directory'):
+                return jsonify({"error": "Provide an archive file or a directory"}), 400
+            files, skipped = collect_directory(str(data['directory']), allowed, max_size)
+            metadata = {
+                'uploaded_by': data.get('uploaded_by', 'unknown'),
+                'description': data.get('description', '')
+            }
+    except (BulkIngestError, OSError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not files:
+        return jsonify({"error": "No files to ingest", "skipped": skipped}), 400
+
+    job_id = ingestion_jobs.submit('bulk', kb_name, {'files': files, 'metadata': metadata, 'skipped': skipped})
+    return jsonify({
+        "message": f"{len(files)} files queued for ingestion",
+        "kb_name": kb_name,
+        "files": len(files),
+        "skipped": skipped,
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}"
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of an ingestion job: stage, chunks embedded, throughput and errors"""
+    if ingestion_jobs is None:
+        return jsonify({"error": "RAG service not available"}), 503
+
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Recent ingestion jobs, optionally filtered by ?status= and ?kb_name="""
+    if ingestion_jobs is None:
+        return jsonify({"error": "RAG service not available"}), 503
+
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    jobs = ingestion_jobs.list_jobs(request.args.get('status'), request.args.get('kb_name'), limit)
+    return jsonify({"jobs": jobs, "count": len(jobs)})
+
+@app.route('/knowledge-bases/<kb_name>/documents', methods=['GET'])
+def list_documents(kb_name):
+    """Documents indexed in a knowledge base, with their versions and chunk counts"""
+    if not RAG_AVAILABLE or not rag_service.is_available():
+        return jsonify({"error": "RAG service not available"}), 503
+
+    documents = rag_service.list_documents(kb_name)
+    return jsonify({
+        "kb_name": kb_name,
+        "documents": documents,
+        "count": len(documents)
+    })
 
 @app.route('/knowledge-bases/<kb_name>/search', methods=['POST'])
 def search_knowledge_base(kb_name):
@@ -1004,14 +1630,18 @@ def get_ip_addresses():
     return addresses
 
 def signal_handler(sig, frame):
-    """Handle Ctrl+C gracefully"""
+    """Handle Ctrl+C and SIGTERM gracefully, persisting sessions still in memory"""
     print("\n\n🛑 Shutting down Cerebras Chat Interface...")
+    flush_sessions()
     print("✅ Server stopped successfully")
     sys.exit(0)
 
 if __name__ == '__main__':
+    start_services()
+
     # Register signal handler for graceful shutdown
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
     # Get configuration from environment variables
     host = os.environ.get('HOST', '0.0.0.0')
@@ -1033,4 +1663,5 @@ if __name__ == '__main__':
         app.run(debug=debug, host=host, port=port, threaded=True)
     except KeyboardInterrupt:
         print("\n\n🛑 Shutting down Cerebras Chat Interface...")
+        flush_sessions()
         print("✅ Server stopped successfully")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Archival script that moves old chat sessions into compressed cold storage.
+
+This script:
+1. Finds sessions in chat_sessions/ that have not been written for --days days
+2. Compresses each one (gzip, or zstd if the zstandard package is installed)
+   into chat_sessions/archive/ and removes the uncompressed file
+3. Prints a report of the space reclaimed
+
+Archived sessions are still listed, searched and opened by the app; the next
+message in an archived session moves it back out of the archive. It is safe
+to run while the server is up: a session written during the pass is skipped.
+"""
+
+import os
+import time
+import argparse
+
+from migrate_chat_sessions import Colors, print_header, print_success, print_warning, print_error, print_info
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Move old chat sessions into compressed cold storage")
+    parser.add_argument('--days', type=float, default=30,
+                        help="archive sessions not written for this many days (default: 30)")
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default='gzip',
+                        help="compression format (default: gzip; zstd needs the zstandard package)")
+    parser.add_argument('--dir', default='chat_sessions',
+                        help="session directory (default: chat_sessions)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="only report what would be archived")
+    return parser.parse_args(argv)
+
+
+def format_bytes(size):
+    if size < 1024:
+        return f"{size} B"
+    for unit in ('KB', 'MB'):
+        size /= 1024
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} GB"
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print_header("Chat Sessions Archival")
+
+    if not os.path.isdir(args.dir):
+        print_error(f"Error: {args.dir}/ not found!")
+        print_info("Please run this script from the project root directory.")
+        return 1
+
+    if os.environ.get('SESSION_STORE', 'json').lower() == 'sqlite':
+        print_warning("SESSION_STORE=sqlite: the archive tier only applies to the JSON session files")
+
+    from session_store import JSONFileStore
+
+    store = JSONFileStore(args.dir)
+    print_info(f"Archiving sessions not written for {args.days:g} day(s) with {args.compression}"
+               + (" (dry run)" if args.dry_run else ""))
+
+    started = time.time()
+    try:
+        report = store.archive(args.days * 86400, compression=args.compression, dry_run=args.dry_run)
+    except RuntimeError as e:
+        print_error(str(e))
+        return 1
+    elapsed = time.time() - started
+
+    print_header("Archival Summary")
+    print(f"Sessions scanned:          {report['scanned']}")
+    print(f"Sessions old enough:       {report['eligible']}")
+    if args.dry_run:
+        print(f"{Colors.BOLD}Would archive:             {report['eligible']} "
+              f"({format_bytes(report['bytes_before'])}){Colors.END}")
+        return 0
+
+    print(f"{Colors.BOLD}Sessions archived:         {report['archived']}{Colors.END}")
+    if report['skipped']:
+        print(f"Skipped (written during the pass): {report['skipped']}")
+    if report['archived']:
+        ratio = report['bytes_after'] / report['bytes_before'] if report['bytes_before'] else 0
+        print(f"Size before:               {format_bytes(report['bytes_before'])}")
+        print(f"Size after:                {format_bytes(report['bytes_after'])} ({ratio:.0%})")
+        print(f"Throughput:                {report['archived'] / max(elapsed, 1e-6):.0f} sessions/s "
+              f"in {elapsed:.2f}s")
+
+    if report['errors']:
+        print(f"\n{Colors.RED}Errors encountered:        {report['errors']}{Colors.END}")
+        print_warning(f"{report['errors']} session(s) could not be archived; see the log above")
+        return 1
+
+    if report['archived']:
+        print_success(f"\nArchived {report['archived']} session(s) into {os.path.join(args.dir, 'archive')}/")
+    else:
+        print_info("\nNo sessions needed to be archived")
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        exit(main())
+    except KeyboardInterrupt:
+        print(f"\n\n{Colors.YELLOW}Archival cancelled by user{Colors.END}")
+        exit(1)
+    except Exception as e:
+        print(f"\n{Colors.RED}Unexpected error: {e}{Colors.END}")
+        exit(1)
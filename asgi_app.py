@@ -0,0 +1,483 @@
+"""
+ASGI entry point with native async handlers for the network-bound routes
+
+POST /chat and POST /web-search run on the event loop with async Cerebras,
+Exa and Brave clients, so a slow upstream call no longer pins an OS thread.
+The blocking steps of a chat turn (loading and saving the session, token
+counting, cache lookups) run on worker threads, and waiting for a duplicate
+request or for the session's previous turn suspends the task rather than
+holding a thread. Every other route is served by the existing Flask app mounted underneath,
+so request and response formats are the same as with `python app.py`.
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+or:
+    python asgi_app.py
+"""
+
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route, request_response
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+from limits import parse as parse_rate_limit
+
+import app as flask_module
+from single_flight import chat_flights, async_session_locks, FlightAbandoned
+
+# Async Cerebras client (falls back to mock mode like the Flask app)
+async_client = None
+try:
+    from cerebras.cloud.sdk import AsyncCerebras
+    api_key = os.environ.get("CEREBRAS_API_KEY")
+    if api_key:
+        async_client = AsyncCerebras(api_key=api_key)
+        logging.info("Async Cerebras client initialized")
+except ImportError:
+    logging.info("Cerebras SDK not available for the ASGI app. Running in mock mode.")
+
+CORS_OPTIONS = {
+    "allow_origins": ["*"],
+    "allow_methods": ["GET", "POST", "DELETE"],
+    "allow_headers": ["Content-Type", "Idempotency-Key"]
+}
+
+# Share the Flask-Limiter storage so limits hold across both serving paths
+RATE_LIMIT_CHAT = parse_rate_limit(os.environ.get('RATE_LIMIT_CHAT', '30 per minute'))
+RATE_LIMIT_WEB_SEARCH = parse_rate_limit("20 per minute")
+
+
+def rate_limited(request: Request, limit, scope: str) -> bool:
+    """Record a hit for the client and report whether the limit is exceeded"""
+    client_host = request.client.host if request.client else "unknown"
+    return not flask_module.limiter.limiter.hit(limit, "asgi", scope, client_host)
+
+
+def rate_limit_response():
+    return JSONResponse({"error": "Rate limit exceeded"}, status_code=429)
+
+
+async def read_json(request: Request):
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+
+def use_async_llm():
+    return flask_module.cerebras_available and async_client is not None
+
+
+# ============================================================================
+# Retrieval
+# ============================================================================
+
+async def aretrieve_context(user_message, kb_name, use_rag, use_web_search, web_search_query):
+    """
+    Async counterpart of app.retrieve_context()
+
+    Both stages run concurrently with their own timeout budgets. A late web
+    search is cancelled outright; RAG runs on a worker thread because the
+    embedding step is CPU-bound.
+    """
+    context = {
+        "rag_context": "",
+        "rag_sources": [],
+        "web_search_context": "",
+        "web_search_results": [],
+        "retrieval_skipped": []
+    }
+
+    stages = []
+
+    if use_rag and kb_name and flask_module.RAG_AVAILABLE and flask_module.rag_service.is_available():
+        stages.append(("rag", flask_module.RAG_TIMEOUT,
+                       asyncio.to_thread(flask_module.retrieve_rag_context, kb_name, user_message)))
+    elif use_rag:
+        logging.warning("⚠ RAG enabled but knowledge base or RAG service not available")
+
+    if use_web_search and flask_module.WEB_SEARCH_AVAILABLE and flask_module.web_search_service.is_available():
+        stages.append(("web_search", flask_module.WEB_SEARCH_TIMEOUT, _aretrieve_web_context(web_search_query)))
+
+    if not stages:
+        return context
+
+    results = await asyncio.gather(
+        *(asyncio.wait_for(coro, timeout) for _, timeout, coro in stages),
+        return_exceptions=True
+    )
+
+    for (stage, timeout, _), result in zip(stages, results):
+        if isinstance(result, asyncio.TimeoutError):
+            logging.warning(f"⚠ Retrieval stage '{stage}' exceeded its {timeout:.1f}s budget; continuing without it")
+            context["retrieval_skipped"].append({"stage": stage, "reason": "timeout", "timeout": timeout})
+        elif isinstance(result, Exception):
+            logging.error(f"✗ Retrieval stage '{stage}' failed: {result}")
+            context["retrieval_skipped"].append({"stage": stage, "reason": "error", "error": str(result)})
+        else:
+            context.update(result)
+
+    return context
+
+
+async def _aretrieve_web_context(web_search_query):
+    service = flask_module.web_search_service
+    context = {"web_search_context": "", "web_search_results": []}
+    search_results = await service.async_search(web_search_query)
+    if search_results:
+        context["web_search_results"] = search_results
+        context["web_search_context"] = service.format_search_context(search_results)
+        logging.info(f"Retrieved {len(search_results)} web search results")
+    return context
+
+
+# ============================================================================
+# Chat
+# ============================================================================
+
+async def astream_chat_turn(session_id, conversation_history, context, cache_mode, semantic_probe, outcome):
+    """Async counterpart of app.stream_chat_turn(), with the same SSE events"""
+    for event in flask_module.context_events(context):
+        yield event
+
+    if not use_async_llm():
+        mock_response = flask_module.mock_response_for(conversation_history)
+        for word in mock_response.split(' '):
+            yield flask_module.sse_event("token", {"content": word + ' '})
+        await afinish_chat_turn(session_id, conversation_history, mock_response)
+        outcome["result"] = (flask_module.chat_response_data(mock_response, None, conversation_history, context), 200)
+        yield flask_module.done_event(mock_response, None, conversation_history)
+        return
+
+    messages = await asyncio.to_thread(flask_module.build_messages, conversation_history, context)
+    parser = flask_module.new_think_parser()
+
+    cache_key, cached_content = await asyncio.to_thread(flask_module.cached_completion, messages, cache_mode)
+    if cached_content is not None:
+        for event in flask_module.channel_events(parser.feed(cached_content) + parser.flush()):
+            yield event
+        await afinish_chat_turn(session_id, conversation_history, parser.answer)
+        outcome["result"] = (flask_module.chat_response_data(
+            parser.answer, parser.thinking or None, conversation_history, context, cached=True
+        ), 200)
+        yield flask_module.done_event(parser.answer, parser.thinking or None, conversation_history, cached=True)
+        return
+
+    raw_parts = []
+    stream = None
+    try:
+        stream = await async_client.chat.completions.create(
+            messages=messages, stream=True, **flask_module.completion_params()
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                raw_parts.append(delta)
+                for event in flask_module.channel_events(parser.feed(delta)):
+                    yield event
+
+        for event in flask_module.channel_events(parser.flush()):
+            yield event
+    except (asyncio.CancelledError, GeneratorExit):
+        # Client disconnected mid-stream; the partial answer is not persisted
+        logging.warning(f"Client disconnected from stream for session {session_id}")
+        raise
+    except Exception as e:
+        logging.error(f"Streaming chat failed: {e}")
+        error_message = f"Error: {str(e)}"
+        outcome["result"] = ({"response": error_message}, 500)
+        yield flask_module.sse_event("error", {"error": error_message})
+        return
+    finally:
+        # Releases the upstream connection, also when the client went away
+        if stream is not None and hasattr(stream, 'close'):
+            try:
+                await stream.close()
+            except Exception:
+                pass
+
+    if cache_key:
+        await asyncio.to_thread(flask_module.response_cache.put, cache_key, ''.join(raw_parts))
+
+    thinking_content, bot_response = parser.thinking or None, parser.answer
+    await asyncio.to_thread(flask_module.remember_semantic, semantic_probe, bot_response, thinking_content, context)
+    await afinish_chat_turn(session_id, conversation_history, bot_response)
+    outcome["result"] = (flask_module.chat_response_data(
+        bot_response, thinking_content, conversation_history, context
+    ), 200)
+    yield flask_module.done_event(bot_response, thinking_content, conversation_history)
+
+
+async def astart_chat_turn(session_id, user_message):
+    """app.start_chat_turn() on a worker thread: it may load the session from disk"""
+    return await asyncio.to_thread(flask_module.start_chat_turn, session_id, user_message)
+
+
+async def afinish_chat_turn(session_id, conversation_history, bot_response):
+    """app.finish_chat_turn() on a worker thread: saving the session may fsync or commit"""
+    await asyncio.to_thread(flask_module.finish_chat_turn, session_id, conversation_history, bot_response)
+
+
+async def areplay_chat_turn(session_id, conversation_history, context, hit, outcome):
+    """Async counterpart of app.replay_chat_turn()"""
+    for event in flask_module.context_events(context):
+        yield event
+    if hit.get("thinking"):
+        yield flask_module.sse_event("thinking", {"content": hit["thinking"]})
+    yield flask_module.sse_event("token", {"content": hit["response"]})
+    await afinish_chat_turn(session_id, conversation_history, hit["response"])
+    outcome["result"] = (flask_module.semantic_response_data(hit, conversation_history, context), 200)
+    yield flask_module.done_event(hit["response"], hit.get("thinking"), conversation_history, cached=True)
+
+
+async def astream_turn(turn, outcome):
+    """Async counterpart of app.stream_turn()"""
+    session_id = turn["session_id"]
+    conversation_history = await astart_chat_turn(session_id, turn["user_message"])
+
+    # Embedding is CPU-bound, so the lookup runs on a worker thread
+    semantic_probe, semantic_hit = await asyncio.to_thread(
+        flask_module.semantic_cache_lookup, turn, conversation_history
+    )
+    if semantic_hit:
+        context = flask_module.semantic_hit_context(semantic_hit)
+        async for event in areplay_chat_turn(session_id, conversation_history, context, semantic_hit, outcome):
+            yield event
+        return
+
+    context = await aretrieve_context(
+        turn["user_message"], turn["kb_name"], turn["use_rag"], turn["use_web_search"], turn["web_search_query"]
+    )
+    async for event in astream_chat_turn(
+        session_id, conversation_history, context, turn["cache"], semantic_probe, outcome
+    ):
+        yield event
+
+
+async def arun_chat_turn(turn):
+    """Async counterpart of app.run_chat_turn()"""
+    session_id = turn["session_id"]
+    conversation_history = await astart_chat_turn(session_id, turn["user_message"])
+
+    semantic_probe, semantic_hit = await asyncio.to_thread(
+        flask_module.semantic_cache_lookup, turn, conversation_history
+    )
+    if semantic_hit:
+        context = flask_module.semantic_hit_context(semantic_hit)
+        await afinish_chat_turn(session_id, conversation_history, semantic_hit["response"])
+        return flask_module.semantic_response_data(semantic_hit, conversation_history, context), 200
+
+    context = await aretrieve_context(
+        turn["user_message"], turn["kb_name"], turn["use_rag"], turn["use_web_search"], turn["web_search_query"]
+    )
+
+    if not use_async_llm():
+        mock_response = flask_module.mock_response_for(conversation_history)
+        await afinish_chat_turn(session_id, conversation_history, mock_response)
+        return flask_module.chat_response_data(mock_response, None, conversation_history, context), 200
+
+    try:
+        messages = await asyncio.to_thread(flask_module.build_messages, conversation_history, context)
+
+        cache_key, full_content = await asyncio.to_thread(flask_module.cached_completion, messages, turn["cache"])
+        cached = full_content is not None
+        if not cached:
+            chat_completion = await async_client.chat.completions.create(
+                messages=messages, **flask_module.completion_params()
+            )
+            full_content = chat_completion.choices[0].message.content
+            if cache_key:
+                await asyncio.to_thread(flask_module.response_cache.put, cache_key, full_content)
+
+        thinking_content, bot_response = flask_module.extract_thinking(full_content)
+        if not cached:
+            await asyncio.to_thread(
+                flask_module.remember_semantic, semantic_probe, bot_response, thinking_content, context
+            )
+
+        await afinish_chat_turn(session_id, conversation_history, bot_response)
+        return flask_module.chat_response_data(
+            bot_response, thinking_content, conversation_history, context, cached
+        ), 200
+    except Exception as e:
+        return {"response": f"Error: {str(e)}"}, 500
+
+
+# ============================================================================
+# Request Coalescing
+# ============================================================================
+
+async def join_flight(turn):
+    """
+    Async counterpart of the single-flight join in app.py
+
+    Returns (key, flight, None) when this request leads, or (key, None, result)
+    with the result shared from an identical request.
+    """
+    key = flask_module.flight_key(turn)
+    while True:
+        flight, leader = chat_flights.join(key)
+        if leader:
+            return key, flight, None
+        logging.info(f"Coalescing duplicate chat request for session {turn['session_id']} (async)")
+        try:
+            response_data, status = await flight.wait_async(chat_flights.wait_timeout)
+            return key, None, (flask_module.shared_result(response_data), status)
+        except FlightAbandoned:
+            continue  # The first request went away; retry, possibly as the leader
+        except TimeoutError:
+            return key, None, flask_module.FLIGHT_TIMEOUT_RESULT
+
+
+async def acoalesced_chat_turn(turn):
+    """Async counterpart of app.coalesced_chat_turn()"""
+    key, flight, shared = await join_flight(turn)
+    if shared:
+        return shared
+
+    try:
+        async with async_session_locks.hold(turn["session_id"]):
+            result = await arun_chat_turn(turn)
+    except BaseException:
+        chat_flights.abandon(key, flight)
+        raise
+    chat_flights.complete(key, flight, result, keep=bool(turn["idempotency_key"]))
+    return result
+
+
+async def acoalesced_stream_turn(turn):
+    """Async counterpart of app.coalesced_stream_turn()"""
+    key, flight, shared = await join_flight(turn)
+    if shared:
+        for event in flask_module.result_events(*shared):
+            yield event
+        return
+
+    outcome = {}
+    try:
+        async with async_session_locks.hold(turn["session_id"]):
+            async for event in astream_turn(turn, outcome):
+                yield event
+    finally:
+        if "result" in outcome:
+            chat_flights.complete(key, flight, outcome["result"], keep=bool(turn["idempotency_key"]))
+        else:
+            chat_flights.abandon(key, flight)
+
+
+async def chat(request: Request):
+    if rate_limited(request, RATE_LIMIT_CHAT, "chat"):
+        return rate_limit_response()
+
+    data = await read_json(request)
+    turn = flask_module.parse_chat_request(data, request.headers.get('idempotency-key'))
+    if turn is None:
+        return JSONResponse({"error": "Invalid request format"}, status_code=400)
+
+    logging.info(f"Chat request received from {request.client.host if request.client else 'unknown'} (async)")
+
+    if data.get('stream') is True or 'text/event-stream' in request.headers.get('accept', ''):
+        return StreamingResponse(
+            acoalesced_stream_turn(turn),
+            media_type='text/event-stream',
+            headers=flask_module.SSE_HEADERS
+        )
+
+    response_data, status = await acoalesced_chat_turn(turn)
+    return JSONResponse(flask_module.with_history(response_data, turn), status_code=status)
+
+
+# ============================================================================
+# Web Search
+# ============================================================================
+
+async def web_search(request: Request):
+    """Perform web search"""
+    if rate_limited(request, RATE_LIMIT_WEB_SEARCH, "web-search"):
+        return rate_limit_response()
+
+    service = flask_module.web_search_service
+    if not flask_module.WEB_SEARCH_AVAILABLE or not service.is_available():
+        return JSONResponse({"error": "Web search not available"}, status_code=503)
+
+    data = await read_json(request)
+    if not data or 'query' not in data:
+        return JSONResponse({"error": "Missing query parameter"}, status_code=400)
+
+    query = data['query']
+    num_results = data.get('num_results', None)
+
+    try:
+        results = await service.async_search(query, num_results)
+        return JSONResponse({
+            "query": query,
+            "results": results,
+            "count": len(results)
+        })
+    except Exception as e:
+        logging.error(f"Web search error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+# ============================================================================
+# Application
+# ============================================================================
+
+def native_route(path, endpoint):
+    """Route an async handler with the same CORS policy as the Flask app"""
+    return Route(
+        path,
+        CORSMiddleware(request_response(endpoint), **CORS_OPTIONS),
+        methods=["POST", "OPTIONS"]
+    )
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    flask_module.start_services()
+    yield
+    flask_module.flush_sessions()
+    if flask_module.WEB_SEARCH_AVAILABLE:
+        await flask_module.web_search_service.aclose()
+    if async_client is not None and hasattr(async_client, 'close'):
+        await async_client.close()
+
+
+app = Starlette(
+    routes=[
+        native_route('/chat', chat),
+        native_route('/web-search', web_search),
+        # Everything else is served by the Flask app
+        Mount('/', app=WSGIMiddleware(flask_module.app)),
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    host = os.environ.get('HOST', '0.0.0.0')
+    port = int(os.environ.get('PORT', 5000))
+
+    print("\nCerebras Chat Interface (ASGI) is now available at:")
+    print("----------------------------------------")
+    for ip in flask_module.get_ip_addresses():
+        print(f"http://{ip}:{port}")
+    print("----------------------------------------")
+    print("Press Ctrl+C to stop the server\n")
+
+    uvicorn.run(app, host=host, port=port)
@@ -0,0 +1,378 @@
+"""
+Bulk ingestion of many documents into a knowledge base
+"""
+
+import os
+import time
+import queue
+import shutil
+import logging
+import tarfile
+import zipfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from werkzeug.utils import secure_filename
+
+from document_parser import MARKITDOWN_AVAILABLE, extract_text, split_text
+
+BULK_INGEST_WORKERS = int(os.environ.get('BULK_INGEST_WORKERS', os.cpu_count() or 1))  # Parser processes
+BULK_INGEST_MAX_FILES = int(os.environ.get('BULK_INGEST_MAX_FILES', 10000))  # Per request
+BULK_INGEST_ROOT = os.environ.get('BULK_INGEST_ROOT', '')  # Server directories allowed for ingestion; empty disables
+BULK_INGEST_MAX_ERRORS = 100  # Failed files listed in the final report
+PROGRESS_INTERVAL = 1.0  # Seconds between progress reports
+WRITE_QUEUE_SIZE = 4  # Embedded batches waiting for Qdrant
+
+# (document name, path on disk)
+IngestFile = Tuple[str, str]
+
+_worker_markitdown = None
+
+
+class BulkIngestError(ValueError):
+    """The archive or directory cannot be ingested at all"""
+
+
+def parser_context() -> multiprocessing.context.BaseContext:
+    """
+    Start method for parser processes: forkserver, or spawn where it is missing
+
+    Never fork: the server is multithreaded, and a forked child inherits
+    whatever locks other threads held at that moment. A fresh process
+    re-imports the parent's main script before running a parser, so the
+    server scripts keep their side effects behind start_services().
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def init_worker():
+    """Parser process initializer: one MarkItDown instance per process"""
+    global _worker_markitdown
+    if MARKITDOWN_AVAILABLE:
+        from markitdown import MarkItDown
+        _worker_markitdown = MarkItDown()
+
+
+def parse_document(file_path: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """Extract and chunk one file in a parser process"""
+    text = extract_text(file_path, _worker_markitdown)
+    if not text:
+        raise ValueError("no text could be extracted")
+    return split_text(text, chunk_size, chunk_overlap)
+
+
+def _member_path(name: str) -> Optional[PurePosixPath]:
+    """Relative path of an archive member, or None if it is unsafe or hidden"""
+    path = PurePosixPath(name.replace('\\', '/'))
+    if path.is_absolute() or '..' in path.parts or not path.parts:
+        return None
+    if any(part.startswith('.') or part == '__MACOSX' for part in path.parts):
+        return None
+    parts = [secure_filename(part) for part in path.parts]
+    return PurePosixPath(*parts) if all(parts) else None
+
+
+def extract_archive(archive_path: str, destination: Path, allowed: Callable[[str], bool],
+                    max_file_size: int, max_files: int = BULK_INGEST_MAX_FILES) -> Tuple[List[IngestFile], int]:
+    """
+    Unpack the allowed files of a zip or tar archive under destination
+
+    Member paths are sanitized: absolute paths, '..', links and device
+    entries are never written. Returns ([(relative path, path on disk)],
+    number of members skipped); raises BulkIngestError if the archive is
+    unreadable or holds more than max_files allowed files.
+    """
+    try:
+        if zipfile.is_zipfile(archive_path):
+            archive = zipfile.ZipFile(archive_path)
+            members = [(info.filename, info.file_size, info) for info in archive.infolist() if not info.is_dir()]
+            open_member = archive.open
+        elif tarfile.is_tarfile(archive_path):
+            archive = tarfile.open(archive_path, 'r:*')
+            members = [(info.name, info.size if info.isfile() else -1, info) for info in archive.getmembers()
+                       if not info.isdir()]
+            open_member = archive.extractfile
+        else:
+            raise BulkIngestError("file is not a zip or tar archive")
+        with archive:
+            return _extract_members(members, open_member, destination, allowed, max_file_size, max_files)
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise BulkIngestError(f"corrupt archive: {e}")
+
+
+def _extract_members(members, open_member, destination: Path, allowed: Callable[[str], bool],
+                     max_file_size: int, max_files: int) -> Tuple[List[IngestFile], int]:
+    selected, skipped = [], 0
+    for name, size, info in members:
+        relative = _member_path(name)
+        if relative is None or size < 0 or size > max_file_size or not allowed(relative.name):
+            skipped += 1
+            continue
+        selected.append((relative, info))
+    if len(selected) > max_files:
+        raise BulkIngestError(f"archive holds {len(selected)} files, the limit is {max_files}")
+
+    files, seen = [], set()
+    for relative, info in selected:
+        if relative in seen:
+            skipped += 1
+            continue
+        seen.add(relative)
+        target = destination.joinpath(*relative.parts)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Replaced atomically, like a single upload of a new version
+        tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        with open_member(info) as source, open(tmp_path, 'wb') as out:
+            shutil.copyfileobj(source, out)
+        os.replace(tmp_path, target)
+        files.append((str(relative), str(target)))
+    return files, skipped
+
+
+def collect_directory(directory: str, allowed: Callable[[str], bool], max_file_size: int,
+                      root: str = BULK_INGEST_ROOT,
+                      max_files: int = BULK_INGEST_MAX_FILES) -> Tuple[List[IngestFile], int]:
+    """
+    The allowed files under a server directory, which must lie inside root
+
+    Files are indexed in place; their paths relative to the directory are
+    the document names. Symlinked directories are not followed.
+    """
+    if not root:
+        raise BulkIngestError("directory ingestion is disabled (BULK_INGEST_ROOT is not set)")
+    root = os.path.realpath(root)
+    base = os.path.realpath(os.path.join(root, directory))
+    if os.path.commonpath([root, base]) != root:
+        raise BulkIngestError("directory is outside BULK_INGEST_ROOT")
+    if not os.path.isdir(base):
+        raise BulkIngestError("directory not found")
+
+    files, skipped = [], 0
+    for dirpath, dirnames, filenames in os.walk(base):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if (name.startswith('.') or os.path.islink(path) or not allowed(name)
+                    or os.path.getsize(path) > max_file_size):
+                skipped += 1
+                continue
+            files.append((Path(os.path.relpath(path, base)).as_posix(), path))
+            if len(files) > max_files:
+                raise BulkIngestError(f"directory holds more than {max_files} files")
+    return files, skipped
+
+
+class BulkIngestor:
+    """
+    Pipelined ingestion of many files into one knowledge base
+
+    Three stages run concurrently: a process pool parses and chunks files,
+    the calling thread embeds the new chunks of all documents in shared
+    batches of QDRANT_UPSERT_BATCH, and a writer thread upserts each batch
+    and then records every document whose chunks are all written. Files
+    whose content is already indexed are skipped before parsing. A file
+    that fails at any stage is reported and leaves its indexed version
+    untouched; the others carry on.
+    """
+
+    def __init__(self, rag, kb_name: str, files: List[IngestFile], metadata: Optional[Dict] = None,
+                 workers: int = BULK_INGEST_WORKERS, skipped: int = 0):
+        self.rag = rag
+        self.kb_name = kb_name
+        self.files = files
+        self.metadata = metadata or {}
+        self.workers = max(workers, 1)
+        self.batch_size = max(rag.upsert_batch_size, 1)
+        self.counts = {
+            "files": len(files), "parsed": 0, "added": 0, "updated": 0, "unchanged": 0,
+            "failed": 0, "skipped": skipped, "chunks_embedded": 0, "chunks_deleted": 0, "batches": 0
+        }
+        self.errors: List[Dict[str, Any]] = []
+        self._failed = set()  # Document ids with a failed batch, never committed
+        self._lock = threading.Lock()
+
+    def run(self) -> Iterator[Dict[str, Any]]:
+        """Ingest the files, yielding a progress report about once a second and a final summary"""
+        started = last_report = time.time()
+        if not self.rag.create_knowledge_base(self.kb_name):
+            self._fail(None, "knowledge base could not be created")
+            yield self._final(started)
+            return
+
+        writes = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        writer = threading.Thread(target=self._write_loop, args=(writes,), daemon=True)
+
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=parser_context(), initializer=init_worker)
+        pending = {}  # Parse future -> (document name, path, content hash)
+        remaining = iter(self.files)
+        buffer: List[Tuple[Dict[str, Any], Tuple[str, int]]] = []  # (plan, (chunk hash, index)) to embed
+        waiting = deque()  # (plan, buffered position of its last chunk) not yet committed
+        positions = {"buffered": 0, "flushed": 0}
+        try:
+            self._submit(pool, pending, remaining)
+            writer.start()
+            while pending:
+                done, _ = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, path, content_hash = pending.pop(future)
+                    try:
+                        chunks = future.result()
+                    except Exception as e:
+                        self._fail(name, f"parsing failed: {e}")
+                        continue
+                    with self._lock:
+                        self.counts["parsed"] += 1
+                    plan = self.rag.diff_chunks(self.kb_name, name, content_hash, chunks)
+                    plan['path'] = path
+                    if plan['previous'] is None:
+                        writes.put(('clear', plan))
+                    buffer.extend((plan, item) for item in plan['new_chunks'])
+                    positions["buffered"] += len(plan['new_chunks'])
+                    waiting.append((plan, positions["buffered"]))
+                    while len(buffer) >= self.batch_size:
+                        buffer = self._flush(buffer, writes, waiting, positions)
+                self._submit(pool, pending, remaining)
+                if time.time() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.time()
+                    yield self._report("progress", started)
+
+            while buffer or waiting:
+                buffer = self._flush(buffer, writes, waiting, positions)
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True, cancel_futures=True)
+            if writer.ident is not None:
+                writes.put(None)
+                writer.join()
+
+        if self.counts["added"] or self.counts["updated"]:
+            self.rag.notify_change(self.kb_name)
+        report = self._final(started)
+        logging.info(f"Bulk ingestion into '{self.kb_name}': {self.counts['added']} added, "
+                     f"{self.counts['updated']} updated, {self.counts['unchanged']} unchanged, "
+                     f"{self.counts['failed']} failed in {report['elapsed']}s")
+        yield report
+
+    def _submit(self, pool: ProcessPoolExecutor, pending: Dict, remaining: Iterator[IngestFile]):
+        # A few files per worker in flight keeps the parsers busy without holding every result in memory
+        while len(pending) < self.workers * 2:
+            try:
+                name, path = next(remaining)
+            except StopIteration:
+                return
+            try:
+                content_hash = self.rag.file_hash(path)
+            except OSError as e:
+                self._fail(name, f"unreadable: {e}")
+                continue
+            if self.rag.indexed_version(self.kb_name, name, content_hash):
+                with self._lock:
+                    self.counts["unchanged"] += 1
+                continue
+            future = pool.submit(parse_document, path, self.rag.chunk_size, self.rag.chunk_overlap)
+            pending[future] = (name, path, content_hash)
+
+    def _flush(self, buffer: List, writes: queue.Queue, waiting: deque, positions: Dict[str, int]) -> List:
+        """Embed the next batch of buffered chunks and queue its upsert and the documents it completes"""
+        batch, rest = buffer[:self.batch_size], buffer[self.batch_size:]
+        positions["flushed"] += len(batch)
+        batch = [entry for entry in batch if entry[0]['document_id'] not in self._failed]
+        if batch:
+            vectors = self.rag.embed_texts([plan['chunks'][i] for plan, (_, i) in batch])
+            if vectors is None:
+                for plan in {id(plan): plan for plan, _ in batch}.values():
+                    self._fail_document(plan, "embedding failed")
+            else:
+                # Grouped by document, as points carry their document's payload
+                groups: Dict[str, Tuple[Dict, List, List]] = {}
+                for (plan, item), vector in zip(batch, vectors.tolist()):
+                    group = groups.setdefault(plan['document_id'], (plan, [], []))
+                    group[1].append(item)
+                    group[2].append(vector)
+                writes.put(('upsert', [
+                    (plan, self.rag.chunk_points(plan, items, group_vectors, self.metadata))
+                    for plan, items, group_vectors in groups.values()
+                ]))
+        while waiting and waiting[0][1] <= positions["flushed"]:
+            writes.put(('commit', waiting.popleft()[0]))
+        return rest
+
+    def _write_loop(self, writes: queue.Queue):
+        """Writer thread: Qdrant requests in the order they were queued"""
+        while True:
+            task = writes.get()
+            if task is None:
+                return
+            action, payload = task
+            if action == 'upsert':
+                self._upsert([(plan, points) for plan, points in payload
+                              if plan['document_id'] not in self._failed])
+                continue
+            try:
+                if action == 'clear':
+                    self.rag.clear_unmanaged_points(self.kb_name, payload)
+                elif payload['document_id'] not in self._failed:
+                    summary = self.rag.commit_document(self.kb_name, payload, payload['path'])
+                    with self._lock:
+                        self.counts[summary['status']] += 1
+                        self.counts["chunks_embedded"] += summary['embedded']
+                        self.counts["chunks_deleted"] += summary['deleted']
+            except Exception as e:
+                self._fail_document(payload, f"{action} failed: {e}")
+
+    def _upsert(self, groups: List[Tuple[Dict[str, Any], List]]):
+        """One upsert for the batch; if it fails, one per document, so only the failing documents fail"""
+        if not groups:
+            return
+        try:
+            self.rag.qdrant_client.upsert(
+                collection_name=self.kb_name,
+                points=[point for _, points in groups for point in points]
+            )
+            with self._lock:
+                self.counts["batches"] += 1
+            return
+        except Exception as e:
+            if len(groups) == 1:
+                self._fail_document(groups[0][0], f"upsert failed: {e}")
+                return
+        for group in groups:
+            self._upsert([group])
+
+    def _fail_document(self, plan: Dict[str, Any], reason: str):
+        with self._lock:
+            if plan['document_id'] in self._failed:
+                return
+            self._failed.add(plan['document_id'])
+        self._fail(plan['file_name'], reason)
+
+    def _fail(self, name: Optional[str], reason: str):
+        logging.error(f"Bulk ingestion of '{name}' into '{self.kb_name}' failed: {reason}")
+        with self._lock:
+            self.counts["failed"] += 1
+            if len(self.errors) < BULK_INGEST_MAX_ERRORS:
+                self.errors.append({"file": name, "error": reason})
+
+    def _report(self, event: str, started: float) -> Dict[str, Any]:
+        elapsed = time.time() - started
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "event": event,
+            "kb_name": self.kb_name,
+            **counts,
+            "elapsed": round(elapsed, 3),
+            "chunks_per_second": round(counts["chunks_embedded"] / elapsed, 1) if elapsed > 0 else 0.0
+        }
+
+    def _final(self, started: float) -> Dict[str, Any]:
+        report = self._report("done", started)
+        with self._lock:
+            report["errors"] = list(self.errors)
+        return report
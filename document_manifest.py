@@ -0,0 +1,134 @@
+"""
+Per-knowledge-base manifest of indexed documents and their chunks
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    kb_name TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (kb_name, document_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chunks (
+    kb_name TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    chunk_hash TEXT NOT NULL,
+    PRIMARY KEY (kb_name, document_id, position)
+) WITHOUT ROWID;
+"""
+
+DOCUMENT_COLUMNS = ('document_id', 'file_name', 'content_hash', 'version', 'chunk_count', 'size', 'indexed_at')
+
+
+class DocumentManifest:
+    """
+    What is indexed for each document: content hash, version and chunk hashes
+
+    One SQLite row per document and per distinct chunk, so recording a new
+    version touches only that document's rows. The content hash tells
+    whether an uploaded file changed at all; the ordered chunk hashes tell
+    which chunks a new version adds and which of its points are obsolete.
+    With directory=None (an in-memory Qdrant) the manifest is kept in memory
+    too, so it never outlives the vectors.
+    """
+
+    def __init__(self, directory: Optional[str]):
+        self.directory = directory
+        self._local = threading.local()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.path, self._uri = os.path.join(directory, 'manifest.db'), False
+        else:
+            # A named shared-cache database, so every thread's connection sees the same data
+            self.path, self._uri = f"file:kb_manifest_{id(self)}?mode=memory&cache=shared", True
+        conn = self._connection()
+        if directory:
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(MANIFEST_SCHEMA)
+        self._keepalive = conn  # An in-memory database lives as long as a connection to it
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections are not shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, uri=self._uri)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get(self, kb_name: str, document_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connection()
+        row = conn.execute(
+            f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM documents WHERE kb_name = ? AND document_id = ?",
+            (kb_name, document_id)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(DOCUMENT_COLUMNS, row))
+        entry['chunk_hashes'] = [chunk_hash for (chunk_hash,) in conn.execute(
+            "SELECT chunk_hash FROM chunks WHERE kb_name = ? AND document_id = ? ORDER BY position",
+            (kb_name, document_id)
+        )]
+        return entry
+
+    def put(self, kb_name: str, entry: Dict[str, Any]):
+        """Record a document's indexed version (entry['document_id'] is the key)"""
+        with self._write() as conn:
+            self._put(conn, kb_name, entry)
+
+    def remove(self, kb_name: str, document_id: str):
+        with self._write() as conn:
+            conn.execute("DELETE FROM documents WHERE kb_name = ? AND document_id = ?", (kb_name, document_id))
+            conn.execute("DELETE FROM chunks WHERE kb_name = ? AND document_id = ?", (kb_name, document_id))
+
+    def documents(self, kb_name: str) -> List[Dict[str, Any]]:
+        """Summary of every document, without the chunk hashes"""
+        rows = self._connection().execute(
+            f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM documents WHERE kb_name = ? ORDER BY file_name",
+            (kb_name,)
+        ).fetchall()
+        return [dict(zip(DOCUMENT_COLUMNS, row)) for row in rows]
+
+    def drop(self, kb_name: str):
+        """Forget a knowledge base (it was deleted or recreated)"""
+        with self._write() as conn:
+            conn.execute("DELETE FROM documents WHERE kb_name = ?", (kb_name,))
+            conn.execute("DELETE FROM chunks WHERE kb_name = ?", (kb_name,))
+
+    @staticmethod
+    def _put(conn: sqlite3.Connection, kb_name: str, entry: Dict[str, Any]):
+        conn.execute(
+            f"INSERT OR REPLACE INTO documents (kb_name, {', '.join(DOCUMENT_COLUMNS)}) "
+            f"VALUES (?, {', '.join('?' * len(DOCUMENT_COLUMNS))})",
+            (kb_name, *(entry[column] for column in DOCUMENT_COLUMNS))
+        )
+        conn.execute("DELETE FROM chunks WHERE kb_name = ? AND document_id = ?", (kb_name, entry['document_id']))
+        conn.executemany(
+            "INSERT INTO chunks (kb_name, document_id, position, chunk_hash) VALUES (?, ?, ?, ?)",
+            [(kb_name, entry['document_id'], position, chunk_hash)
+             for position, chunk_hash in enumerate(entry['chunk_hashes'])]
+        )
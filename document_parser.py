@@ -0,0 +1,57 @@
+"""
+Text extraction and chunking, importable by worker processes without the RAG service
+"""
+
+import logging
+from typing import List, Optional
+
+try:
+    from markitdown import MarkItDown
+    MARKITDOWN_AVAILABLE = True
+except ImportError:
+    MARKITDOWN_AVAILABLE = False
+
+
+def extract_text(file_path: str, markitdown=None) -> Optional[str]:
+    """Parse a file and extract text content using MarkItDown"""
+    if not markitdown:
+        logging.warning("MarkItDown not available, attempting basic text extraction")
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except Exception as e:
+            logging.error(f"Failed to read file: {e}")
+            return None
+
+    try:
+        result = markitdown.convert(file_path)
+        return result.text_content
+    except Exception as e:
+        logging.error(f"Failed to parse file with MarkItDown: {e}")
+        return None
+
+
+def split_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """Split text into chunks with overlap"""
+    chunks = []
+    start = 0
+    text_length = len(text)
+
+    while start < text_length:
+        end = start + chunk_size
+        chunk = text[start:end]
+
+        # Try to break at sentence boundary
+        if end < text_length:
+            last_period = chunk.rfind('.')
+            last_newline = chunk.rfind('\n')
+            break_point = max(last_period, last_newline)
+
+            if break_point > chunk_size // 2:
+                chunk = chunk[:break_point + 1]
+                end = start + break_point + 1
+
+        chunks.append(chunk.strip())
+        start = end - chunk_overlap
+
+    return [c for c in chunks if c]  # Filter empty chunks
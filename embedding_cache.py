@@ -0,0 +1,223 @@
+"""
+Content-addressed cache of text embeddings
+"""
+
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+EMBEDDING_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (model, text_hash)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cache_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Keys per SELECT ... IN (...) when reading a batch from disk
+DISK_LOOKUP_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for keys: NFC, whitespace runs collapsed (the tokenizer ignores them)"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by (model name, hash of the normalized text)
+
+    An in-memory LRU sits in front of an SQLite table of float32 vectors, so
+    re-uploaded documents, repeated chunks and repeated questions skip the
+    model and the cache survives restarts. Rows of other models are purged
+    when the configured model changes.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.enabled = os.environ.get('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+        self.max_entries = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 10000))  # In memory
+        self.path = os.environ.get('EMBEDDING_CACHE_PATH', './embedding_cache/embeddings.db') or None
+
+        self._entries: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+
+        if self.enabled and self.path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                conn = self._connection()
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(EMBEDDING_CACHE_SCHEMA)
+                self._invalidate_other_models()
+                logging.info(f"Embedding cache at: {self.path}")
+            except Exception as e:
+                logging.error(f"Failed to open embedding cache, keeping it in memory only: {e}")
+                self.path = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections are not shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _invalidate_other_models(self):
+        row = self._connection().execute("SELECT value FROM cache_state WHERE key = 'model'").fetchone()
+        if row is not None and row[0] == self.model_name:
+            return
+        with self._write() as conn:
+            deleted = conn.execute("DELETE FROM embeddings WHERE model != ?", (self.model_name,)).rowcount
+            conn.execute("INSERT OR REPLACE INTO cache_state (key, value) VALUES ('model', ?)", (self.model_name,))
+        if deleted:
+            logging.info(f"Embedding model changed to {self.model_name}; dropped {deleted} cached embeddings")
+
+    def embed(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Embeddings of texts as a matrix, one row per text
+
+        Cached vectors are reused; the remaining distinct texts are passed
+        to encode() in one call and their vectors are cached.
+        """
+        if not self.enabled or not texts:
+            return encode(texts)
+
+        keys = [text_hash(text) for text in texts]
+        found = self._lookup(keys)
+
+        # Each distinct missing text is encoded once, however often it repeats
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            # Copies, so a cached row does not keep the whole batch matrix alive
+            computed = {key: vector.copy() for key, vector in zip(missing, vectors)}
+            self._store(computed)
+            found.update(computed)
+        return np.stack([found[key] for key in keys])
+
+    def clear(self):
+        """Drop every cached embedding, in memory and on disk"""
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            with self._write() as conn:
+                conn.execute("DELETE FROM embeddings")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and occupancy"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["enabled"] = self.enabled
+        stats["model"] = self.model_name
+        stats["max_entries"] = self.max_entries
+        stats["disk_tier"] = self.path
+        return stats
+
+    def _lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+
+        disk_keys = list(dict.fromkeys(key for key in keys if key not in found))
+        from_disk = self._read_disk(disk_keys) if disk_keys else {}
+        found.update(from_disk)
+
+        with self._lock:
+            for key, vector in from_disk.items():
+                self._insert(key, vector)
+            # Counted per text, so a repeated chunk served from one entry counts each time
+            hits = sum(1 for key in keys if key in found)
+            self._stats["hits"] += hits
+            self._stats["disk_hits"] += sum(1 for key in keys if key in from_disk)
+            self._stats["misses"] += len(keys) - hits
+        return found
+
+    def _store(self, vectors: Dict[str, np.ndarray]):
+        with self._lock:
+            for key, vector in vectors.items():
+                self._insert(key, vector)
+            self._stats["stores"] += len(vectors)
+        if not self.path:
+            return
+        try:
+            with self._write() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                    [(self.model_name, key, vector.tobytes()) for key, vector in vectors.items()]
+                )
+        except Exception as e:
+            logging.warning(f"Failed to write {len(vectors)} embeddings to the cache: {e}")
+
+    def _read_disk(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not self.path:
+            return {}
+        found = {}
+        try:
+            conn = self._connection()
+            for start in range(0, len(keys), DISK_LOOKUP_BATCH):
+                batch = keys[start:start + DISK_LOOKUP_BATCH]
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    [self.model_name, *batch]
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        except Exception as e:
+            logging.warning(f"Failed to read the embedding cache: {e}")
+        return found
+
+    def _insert(self, key: str, vector: np.ndarray):
+        # Caller holds the lock
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
@@ -39,10 +39,24 @@ class FileHandler:
         """Check if file size is within limits"""
         return file_size <= self.max_file_size
     
+    def knowledge_base_folder(self, kb_name: str) -> Optional[Path]:
+        """A knowledge base's upload subfolder, or None if the name would lead outside the upload folder"""
+        root = self.upload_folder.resolve()
+        folder = (root / kb_name).resolve()
+        return folder if kb_name and folder.parent == root else None
+    
+    def file_path(self, filename: str, kb_name: str) -> Path:
+        """Where an uploaded file of this name is stored in a knowledge base"""
+        return self.upload_folder / kb_name / secure_filename(filename)
+    
     def save_file(self, file, kb_name: str) -> Optional[str]:
         """
         Save uploaded file to disk
         
+        A file with the same name replaces the earlier upload: it is a new
+        version of the same document, which the knowledge base re-indexes
+        incrementally.
+        
         Args:
             file: FileStorage object from Flask
             kb_name: Knowledge base name (used as subfolder)
@@ -59,32 +73,20 @@ class FileHandler:
             return None
         
         # Create knowledge base subfolder
-        kb_folder = self.upload_folder / kb_name
-        kb_folder.mkdir(parents=True, exist_ok=True)
-        
-        # Secure filename
-        filename = secure_filename(file.filename)
-        
-        # Handle duplicate filenames
-        file_path = kb_folder / filename
-        if file_path.exists():
-            # Add counter to filename
-            name_parts = filename.rsplit('.', 1)
-            base_name = name_parts[0]
-            extension = name_parts[1] if len(name_parts) > 1 else ''
-            
-            counter = 1
-            while file_path.exists():
-                new_filename = f"{base_name}_{counter}.{extension}" if extension else f"{base_name}_{counter}"
-                file_path = kb_folder / new_filename
-                counter += 1
+        file_path = self.file_path(file.filename, kb_name)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
         
+        # Write beside the target and rename, so a reader never sees a partial file
+        tmp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
         try:
-            file.save(str(file_path))
+            file.save(str(tmp_path))
+            os.replace(tmp_path, file_path)
             logging.info(f"File saved: {file_path}")
             return str(file_path)
         except Exception as e:
             logging.error(f"Failed to save file: {e}")
+            if tmp_path.exists():
+                tmp_path.unlink()
             return None
     
     def delete_file(self, file_path: str) -> bool:
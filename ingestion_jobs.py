@@ -0,0 +1,319 @@
+"""
+Background ingestion jobs, queued in SQLite so they survive a restart
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from bulk_ingest import BulkIngestor
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    kb_name TEXT NOT NULL,
+    document TEXT,
+    status TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    progress TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    errors TEXT NOT NULL DEFAULT '[]',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner TEXT,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at);
+"""
+
+JOB_KINDS = ('file', 'bulk')
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed')
+POLL_INTERVAL = 2.0  # Seconds an idle worker waits before looking for jobs again
+CLAIM_SCAN = 50  # Queued jobs considered per claim when earlier ones must wait
+
+
+class IngestionJobQueue:
+    """
+    Persistent queue of document ingestion jobs with a bounded worker pool
+
+    Uploads are saved to disk and queued here; INGESTION_WORKERS threads
+    run them through RAGService.add_document (one file) or BulkIngestor
+    (an archive or directory), recording the stage, chunk counts and errors
+    as they go. Jobs on the same document, or any job alongside a bulk job
+    on the same knowledge base, run one at a time. Several processes may
+    share the queue: a claimed job records its owner (host, pid and queue
+    instance) and a lease the owner renews every INGESTION_LEASE / 3
+    seconds. A running job whose lease expired - its process died - is
+    queued again by whichever process notices first; re-running one is
+    cheap, as documents already indexed are skipped by content hash.
+    """
+
+    def __init__(self, rag):
+        self.rag = rag
+        self.path = os.environ.get('INGESTION_JOBS_DB', './ingestion_jobs/jobs.db')
+        self.workers = max(int(os.environ.get('INGESTION_WORKERS', 2)), 1)
+        self.max_attempts = int(os.environ.get('INGESTION_MAX_ATTEMPTS', 3))  # Starts before a job is given up
+        self.retention = int(os.environ.get('INGESTION_JOB_RETENTION', 7 * 24 * 3600))  # Seconds
+        self.lease = float(os.environ.get('INGESTION_LEASE', 60))  # Seconds without a heartbeat before a job is taken over
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._local = threading.local()
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(JOBS_SCHEMA)
+        self._recover()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'ingestion-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._heartbeat = threading.Thread(target=self._renew_leases, name='ingestion-heartbeat', daemon=True)
+        self._heartbeat.start()
+        logging.info(f"Ingestion jobs at {self.path} ({self.workers} workers, owner {self.owner})")
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections are not shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _recover(self):
+        """Queue again the jobs whose owners stopped renewing their lease, and drop expired ones"""
+        now = time.time()
+        with self._write() as conn:
+            self._requeue_abandoned(conn, now)
+            expired = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+                (now - self.retention,)
+            ).rowcount
+        if expired:
+            logging.info(f"Dropped {expired} finished ingestion jobs past retention")
+
+    def _requeue_abandoned(self, conn: sqlite3.Connection, now: float):
+        # Caller holds the write transaction; claiming a job sets its heartbeat
+        abandoned = "status = 'running' AND heartbeat_at < ?"
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', stage = 'failed', finished_at = ?, owner = NULL, "
+            "errors = '[\"interrupted too many times\"]' "
+            f"WHERE {abandoned} AND attempts >= ?",
+            (now, now - self.lease, self.max_attempts)
+        )
+        requeued = conn.execute(
+            f"UPDATE jobs SET status = 'queued', stage = 'queued', owner = NULL WHERE {abandoned}",
+            (now - self.lease,)
+        ).rowcount
+        if requeued:
+            logging.info(f"Requeued {requeued} ingestion jobs whose worker stopped renewing its lease")
+
+    def submit(self, kind: str, kb_name: str, payload: Dict[str, Any], document: Optional[str] = None) -> str:
+        """Queue a job and return its id; document names the single file a 'file' job indexes"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        with self._write() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, kb_name, document, status, stage, payload, created_at) "
+                "VALUES (?, ?, ?, ?, 'queued', 'queued', ?, ?)",
+                (job_id, kind, kb_name, document, json.dumps(payload), time.time())
+            )
+        with self._wake:
+            self._wake.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A job's status, stage, progress, throughput and errors"""
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._describe(row) if row else None
+
+    def list_jobs(self, status: Optional[str] = None, kb_name: Optional[str] = None,
+                  limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent jobs first"""
+        query, params = "SELECT * FROM jobs WHERE 1 = 1", []
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        if kb_name:
+            query += " AND kb_name = ?"
+            params.append(kb_name)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [self._describe(row) for row in self._connection().execute(query, params)]
+
+    def stats(self) -> Dict[str, Any]:
+        counts = dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            **{status: counts.get(status, 0) for status in JOB_STATUSES},
+            "workers": self.workers
+        }
+
+    def close(self):
+        """Stop claiming jobs; a job that is running finishes, or is requeued once its lease expires"""
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+
+    def _describe(self, row: sqlite3.Row) -> Dict[str, Any]:
+        job = {key: row[key] for key in ('id', 'kind', 'kb_name', 'document', 'status', 'stage', 'attempts',
+                                         'created_at', 'started_at', 'finished_at', 'owner', 'heartbeat_at')}
+        job['progress'] = json.loads(row['progress'])
+        job['result'] = json.loads(row['result']) if row['result'] else None
+        job['errors'] = json.loads(row['errors'])
+
+        elapsed = None
+        if row['started_at']:
+            elapsed = (row['finished_at'] or time.time()) - row['started_at']
+        job['elapsed'] = round(elapsed, 3) if elapsed is not None else None
+        embedded = job['progress'].get('chunks_embedded', 0)
+        job['chunks_per_second'] = round(embedded / elapsed, 1) if elapsed else 0.0
+        if row['status'] == 'queued':
+            job['queue_position'] = self._connection().execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (row['created_at'],)
+            ).fetchone()[0]
+        return job
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logging.error(f"Failed to claim an ingestion job: {e}")
+                job = None
+            if job is None:
+                with self._wake:
+                    self._wake.wait(POLL_INTERVAL)
+                continue
+            self._execute(job)
+
+    def _renew_leases(self):
+        # Runs until close() and the last job this queue was running has finished
+        while not self._stop.is_set() or any(thread.is_alive() for thread in self._threads):
+            time.sleep(self.lease / 3)
+            try:
+                with self._write() as conn:
+                    conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = 'running'",
+                                 (time.time(), self.owner))
+            except sqlite3.Error as e:
+                logging.warning(f"Failed to renew ingestion job leases: {e}")
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Mark the oldest queued job that conflicts with no running job as running"""
+        with self._write() as conn:
+            now = time.time()
+            self._requeue_abandoned(conn, now)
+            running = conn.execute("SELECT kind, kb_name, document FROM jobs WHERE status = 'running'").fetchall()
+            candidates = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT ?", (CLAIM_SCAN,)
+            ).fetchall()
+            for job in candidates:
+                if any(self._conflicts(job, other) for other in running):
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', stage = 'starting', started_at = ?, "
+                    "attempts = attempts + 1, owner = ?, heartbeat_at = ? WHERE id = ?",
+                    (now, self.owner, now, job['id'])
+                )
+                return job
+        return None
+
+    @staticmethod
+    def _conflicts(job: sqlite3.Row, other: sqlite3.Row) -> bool:
+        if job['kb_name'] != other['kb_name']:
+            return False
+        return job['kind'] == 'bulk' or other['kind'] == 'bulk' or job['document'] == other['document']
+
+    def _execute(self, job: sqlite3.Row):
+        job_id = job['id']
+        payload = json.loads(job['payload'])
+        logging.info(f"Running {job['kind']} ingestion job {job_id} for '{job['kb_name']}'")
+        try:
+            if job['kind'] == 'file':
+                result, errors = self._run_file(job_id, job['kb_name'], payload), []
+            else:
+                result, errors = self._run_bulk(job_id, job['kb_name'], payload)
+        except Exception as e:
+            logging.error(f"Ingestion job {job_id} failed: {e}")
+            self._finish(job_id, 'failed', None, [str(e)])
+            return
+        self._finish(job_id, 'succeeded', result, errors)
+
+    def _run_file(self, job_id: str, kb_name: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        def progress(stage: str, counts: Dict[str, Any]):
+            self._update(job_id, stage, counts)
+
+        document = self.rag.add_document(kb_name, payload['file_path'], payload.get('metadata'),
+                                         document_name=payload.get('document_name'), progress=progress)
+        if document is None:
+            # A replaced version stays on disk; uploading it again retries
+            if payload.get('is_new'):
+                try:
+                    os.remove(payload['file_path'])
+                except OSError:
+                    pass
+            raise RuntimeError("Failed to process file")
+        self._update(job_id, 'done', {'chunks': document['chunk_count'], 'chunks_embedded': document['embedded']})
+        return document
+
+    def _run_bulk(self, job_id: str, kb_name: str, payload: Dict[str, Any]):
+        ingestor = BulkIngestor(self.rag, kb_name, [tuple(entry) for entry in payload['files']],
+                                payload.get('metadata'), skipped=payload.get('skipped', 0))
+        report, errors = {}, None
+        for report in ingestor.run():
+            errors = report.pop('errors', None)
+            self._update(job_id, 'ingesting' if report['event'] == 'progress' else 'done', report)
+        return report, errors or []
+
+    def _update(self, job_id: str, stage: str, progress: Dict[str, Any]):
+        try:
+            with self._write() as conn:
+                conn.execute("UPDATE jobs SET stage = ?, progress = ? WHERE id = ? AND owner = ?",
+                             (stage, json.dumps(progress), job_id, self.owner))
+        except sqlite3.Error as e:
+            # Progress is informational; the job carries on
+            logging.warning(f"Failed to record progress of ingestion job {job_id}: {e}")
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]], errors: List[Any]):
+        with self._write() as conn:
+            # A job whose lease lapsed may already be running elsewhere; that run reports it
+            finished = conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, result = ?, errors = ?, finished_at = ?, owner = NULL "
+                "WHERE id = ? AND owner = ?",
+                (status, 'done' if status == 'succeeded' else 'failed',
+                 json.dumps(result) if result is not None else None, json.dumps(errors), time.time(),
+                 job_id, self.owner)
+            ).rowcount
+        if not finished:
+            logging.warning(f"Ingestion job {job_id} was taken over after its lease expired; not recording this run")
+        with self._wake:
+            # A job waiting on this one may be able to start
+            self._wake.notify_all()
@@ -7,12 +7,22 @@ This script:
 2. Moves all chat_history_*.json files to chat_sessions/
 3. Moves all chat_metadata_*.json files to chat_sessions/
 4. Moves settings.json to chat_sessions/
-5. Provides a summary of the migration
+5. Optionally converts the sessions into another storage format (--to):
+   JSONL logs or the SQLite session store, in parallel worker processes,
+   verifying the message count and content hash of every session and
+   checkpointing progress so an interrupted run resumes where it stopped
+6. Provides a summary of the migration
 """
 
 import os
+import sys
+import json
+import time
 import shutil
 import glob
+import hashlib
+import argparse
+import concurrent.futures
 from pathlib import Path
 
 # Colors for terminal output
@@ -41,7 +51,290 @@ def print_error(text):
 def print_info(text):
     print(f"{Colors.BLUE}ℹ {text}{Colors.END}")
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate chat sessions into chat_sessions/")
+    parser.add_argument('--to', choices=['jsonl', 'sqlite'],
+                        help="convert the sessions into JSONL logs (the json store's format) "
+                             "or the SQLite session store")
+    parser.add_argument('--from', dest='source', choices=['json', 'sqlite'], default='json',
+                        help="format to convert from (default: json, the files in chat_sessions/)")
+    parser.add_argument('--db', default='chat_sessions/sessions.db',
+                        help="SQLite database to convert to or from (default: chat_sessions/sessions.db)")
+    parser.add_argument('--target-dir', default='chat_sessions',
+                        help="directory for JSONL logs (default: chat_sessions, converting in place)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument('--batch-size', type=int, default=200,
+                        help="sessions per worker task and per SQLite transaction (default: 200)")
+    parser.add_argument('--fresh', action='store_true',
+                        help="ignore the checkpoint of an interrupted run and start over")
+    parser.add_argument('--to-sqlite', nargs='?', const='chat_sessions/sessions.db', metavar='DB_PATH',
+                        help="shorthand for --to sqlite --db DB_PATH")
+    args = parser.parse_args(argv)
+    if args.to_sqlite:
+        args.to, args.db = 'sqlite', args.to_sqlite
+    return args
+
+# Store each worker process converts from and to (set by init_worker)
+_worker_stores = None
+
+def open_store(spec):
+    """Session store for a ('json', directory) or ('sqlite', path) spec"""
+    from session_store import JSONFileStore, SQLiteSessionStore
+
+    kind, location = spec
+    return SQLiteSessionStore(location) if kind == 'sqlite' else JSONFileStore(location)
+
+def init_worker(source_spec, target_spec):
+    global _worker_stores
+    _worker_stores = (open_store(source_spec), open_store(target_spec))
+
+def session_digest(history):
+    """(sha256, size) of a history's canonical JSON, to compare source and target"""
+    data = json.dumps(history, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(data).hexdigest(), len(data)
+
+def read_source(store, session_id):
+    """History and metadata of a session, failing loudly on unreadable files"""
+    from session_store import JSONFileStore, assign_sequence
+
+    legacy_path = store.history_path(session_id) if isinstance(store, JSONFileStore) else None
+    if legacy_path and os.path.exists(legacy_path):
+        # Until a converted log is verified the legacy file is the session (a log next
+        # to it is from an interrupted run); load() would also read a corrupt legacy
+        # file as an empty session, which would then replace it
+        with open(legacy_path, 'r') as f:
+            history = json.load(f)
+        if not isinstance(history, list):
+            raise ValueError("not a list of messages")
+    else:
+        history = store.load(session_id)
+    return assign_sequence(history), store.get_metadata(session_id)
+
+def write_target(store, sessions):
+    """Write (session_id, history, metadata) triples to the target store"""
+    from session_store import JSONFileStore
+
+    if isinstance(store, JSONFileStore):
+        for session_id, history, metadata in sessions:
+            store.write_session(session_id, history, metadata)
+        return
+    store.save_many([(session_id, history) for session_id, history, _ in sessions])
+    for session_id, _, metadata in sessions:
+        if metadata:
+            store.set_metadata(session_id, **metadata)
+
+def settle_target(store, session_id, verified):
+    """
+    After a session was read back from a JSONL target: drop the legacy copy
+    it replaces once verified, or the unverified log while the legacy copy
+    is still there to convert again
+    """
+    from session_store import JSONFileStore
+
+    if not isinstance(store, JSONFileStore):
+        return
+    if verified:
+        store.discard_superseded(session_id)
+    elif os.path.exists(store.history_path(session_id)):
+        try:
+            os.remove(store.log_path(session_id))
+        except FileNotFoundError:
+            pass
+
+def migrate_batch(session_ids):
+    """Convert a batch of sessions in a worker; returns one result dict per session"""
+    from session_store import assign_sequence
+
+    source, target = _worker_stores
+    results, loaded = [], []
+    for session_id in session_ids:
+        try:
+            history, metadata = read_source(source, session_id)
+            loaded.append((session_id, history, metadata))
+        except Exception as e:
+            results.append({'id': session_id, 'ok': False, 'error': f"read failed: {e}"})
+
+    try:
+        write_target(target, loaded)
+    except Exception as e:
+        return results + [{'id': session_id, 'ok': False, 'error': f"write failed: {e}"}
+                          for session_id, _, _ in loaded]
+
+    # Verify by reading every session back from the target
+    for session_id, history, _ in loaded:
+        expected, size = session_digest(history)
+        try:
+            written = assign_sequence(target.load(session_id))
+        except Exception as e:
+            settle_target(target, session_id, verified=False)
+            results.append({'id': session_id, 'ok': False, 'error': f"read-back failed: {e}"})
+            continue
+        actual, _ = session_digest(written)
+        if len(written) != len(history) or actual != expected:
+            settle_target(target, session_id, verified=False)
+            results.append({'id': session_id, 'ok': False,
+                            'error': f"verification failed: {len(history)} messages written, "
+                                     f"{len(written)} read back, hashes {'match' if actual == expected else 'differ'}"})
+            continue
+        try:
+            settle_target(target, session_id, verified=True)
+        except OSError as e:
+            results.append({'id': session_id, 'ok': False, 'error': f"removing the legacy file failed: {e}"})
+            continue
+        results.append({'id': session_id, 'ok': True, 'messages': len(history), 'bytes': size, 'sha256': expected})
+    return results
+
+def read_checkpoint(path):
+    """Ids of sessions a previous run already converted and verified"""
+    done = set()
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)['id'])
+                except (ValueError, KeyError):
+                    continue  # Torn last line of an interrupted run
+    except FileNotFoundError:
+        pass
+    return done
+
+def migration_candidates(source, source_spec, target_spec):
+    """Session ids to convert; in-place JSONL conversion only needs the legacy files"""
+    session_ids = source.session_ids()
+    if source_spec[0] == 'json' and target_spec[0] == 'json' and \
+            os.path.abspath(source_spec[1]) == os.path.abspath(target_spec[1]):
+        session_ids = [session_id for session_id in session_ids if os.path.exists(source.history_path(session_id))]
+    return session_ids
+
+def print_progress(stats, total, started):
+    elapsed = max(time.time() - started, 1e-6)
+    done = stats['migrated'] + stats['failed']
+    rate = stats['migrated'] / elapsed
+    eta = (total - done) / rate if rate else 0
+    sys.stdout.write(f"\r  {done}/{total} sessions  {rate:,.0f} sessions/s  "
+                     f"{stats['messages'] / elapsed:,.0f} messages/s  "
+                     f"{stats['bytes'] / elapsed / 1e6:.1f} MB/s  ETA {eta:.0f}s   ")
+    sys.stdout.flush()
+
+def convert_sessions(source_spec, target_spec, checkpoint_path, workers=1, batch_size=200, fresh=False):
+    """
+    Convert every session from one store to another and verify it
+
+    Work is spread over a process pool in batches. Each verified session is
+    appended to a checkpoint file, so an interrupted run skips them when it
+    is started again; the checkpoint is removed once everything succeeded.
+    """
+    source = open_store(source_spec)
+    if fresh and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    done = read_checkpoint(checkpoint_path)
+    pending = [session_id for session_id in migration_candidates(source, source_spec, target_spec)
+               if session_id not in done]
+    stats = {'total': len(pending) + len(done), 'resumed': len(done), 'migrated': 0, 'failed': 0,
+             'messages': 0, 'bytes': 0, 'errors': []}
+    if done:
+        print_info(f"Resuming: {len(done)} session(s) already converted by an earlier run")
+    print_info(f"Converting {len(pending)} session(s) with {workers} worker(s)")
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    started = last_report = time.time()
+    with open(checkpoint_path, 'a') as checkpoint:
+        def record(results):
+            for result in results:
+                if result['ok']:
+                    stats['migrated'] += 1
+                    stats['messages'] += result['messages']
+                    stats['bytes'] += result['bytes']
+                    checkpoint.write(json.dumps({'id': result['id'], 'messages': result['messages'],
+                                                 'sha256': result['sha256']}) + '\n')
+                else:
+                    stats['failed'] += 1
+                    stats['errors'].append((result['id'], result['error']))
+            checkpoint.flush()
+
+        if workers <= 1:
+            init_worker(source_spec, target_spec)
+            results = map(migrate_batch, batches)
+            executor = None
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=init_worker, initargs=(source_spec, target_spec)
+            )
+            # Results arrive in batch order, each batch's sessions read, written and verified by one worker
+            results = executor.map(migrate_batch, batches)
+        try:
+            for batch_results in results:
+                record(batch_results)
+                if time.time() - last_report >= 1:
+                    print_progress(stats, len(pending), started)
+                    last_report = time.time()
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+    if pending:
+        print_progress(stats, len(pending), started)
+        print()
+
+    stats['elapsed'] = time.time() - started
+    if not stats['failed']:
+        os.remove(checkpoint_path)
+    return stats
+
+def convert_storage(args, chat_sessions_dir):
+    """Run the --to conversion and print its report; returns the number of errors"""
+    source_spec = ('sqlite', args.db) if args.source == 'sqlite' else ('json', chat_sessions_dir)
+    target_spec = ('sqlite', args.db) if args.to == 'sqlite' else ('json', args.target_dir)
+    print_header(f"Converting Sessions: {args.source} -> {args.to}")
+    if source_spec[0] == target_spec[0] == 'sqlite':
+        print_error("Source and target are the same SQLite database")
+        return 1
+
+    if target_spec[0] == 'sqlite':
+        checkpoint_path = f"{args.db}.migration.jsonl"
+    else:
+        os.makedirs(args.target_dir, exist_ok=True)
+        checkpoint_path = os.path.join(args.target_dir, '.migration.jsonl')
+
+    try:
+        result = convert_sessions(source_spec, target_spec, checkpoint_path,
+                                  workers=max(args.workers, 1), batch_size=max(args.batch_size, 1),
+                                  fresh=args.fresh)
+    except Exception as e:
+        print_error(f"Error converting sessions: {e}")
+        print_info("Run the same command again to resume")
+        return 1
+
+    for session_id, error in result['errors'][:20]:
+        print_error(f"{session_id}: {error}")
+    if len(result['errors']) > 20:
+        print_warning(f"... and {len(result['errors']) - 20} more")
+
+    elapsed = max(result['elapsed'], 1e-6)
+    print(f"Sessions to convert:       {result['total']}")
+    if result['resumed']:
+        print(f"Converted by earlier runs: {result['resumed']}")
+    print(f"{Colors.BOLD}Converted and verified:    {result['migrated']}{Colors.END}")
+    print(f"Messages:                  {result['messages']}")
+    print(f"Elapsed:                   {result['elapsed']:.2f}s")
+    print(f"Throughput:                {result['migrated'] / elapsed:,.0f} sessions/s, "
+          f"{result['messages'] / elapsed:,.0f} messages/s, {result['bytes'] / elapsed / 1e6:.1f} MB/s")
+
+    if target_spec[0] == 'json' and result['migrated']:
+        # Workers write logs without touching the indexes; rebuild them once
+        started = time.time()
+        open_store(target_spec).index.rebuild()
+        print_info(f"Rebuilt the session and search indexes in {time.time() - started:.2f}s")
+    if args.to == 'sqlite':
+        print_info("Set SESSION_STORE=sqlite to use it")
+
+    if result['failed']:
+        print_warning(f"{result['failed']} session(s) failed; fix them and run the same command again "
+                      f"to retry only those (checkpoint: {checkpoint_path})")
+    return result['failed']
+
+def main(argv=None):
+    args = parse_args(argv)
     print_header("Chat Sessions Migration Script")
     
     # Configuration
@@ -177,6 +470,10 @@ def main():
     else:
         print_success("\nNo chat-related files remaining in root directory")
     
+    # Convert into another storage format
+    if args.to:
+        stats['errors'] += convert_storage(args, CHAT_SESSIONS_DIR)
+    
     # Final message
     print_header("Migration Complete!")
     
@@ -0,0 +1,278 @@
+"""
+Prefix-stable system prompt assembly
+
+The system prompt is laid out so that everything that rarely changes comes
+first and is byte-identical between requests: the configured base prompt,
+then the fixed RAG / web search / synthesis instruction blocks. Volatile
+parts (current date and time, retrieved knowledge base and web context) are
+appended at the end. Upstream prefix (KV) caching can then reuse the static
+part across requests instead of missing on every minute change.
+"""
+
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+SEPARATOR = '=' * 80
+
+RAG_INSTRUCTIONS = f"""
+
+{SEPARATOR}
+🔴 CRITICAL - KNOWLEDGE BASE CONTEXT PROVIDED 🔴
+{SEPARATOR}
+
+You have been provided with KNOWLEDGE BASE CONTEXT at the end of this prompt. This is MANDATORY reading.
+
+ABSOLUTE REQUIREMENTS:
+1. READ the entire knowledge base context carefully
+2. Your PRIMARY obligation is to answer based on this knowledge base
+3. You MUST cite source files: "According to [filename]..." or "Based on [filename]..."
+4. You MUST quote directly when appropriate: "The document states: '...'"
+5. If the KB answers the question: Use ONLY KB content (do not add external knowledge)
+6. If the KB partially answers: Use KB first, then supplement with general knowledge (clearly labeled)
+7. If the KB doesn't answer: State "The knowledge base does not contain information about this topic" then provide general knowledge
+
+RESPONSE FORMAT WHEN USING KB:
+- Start with: "Based on the knowledge base..." or "According to [filename]..."
+- Cite every piece of information: "As stated in [filename]..."
+- Quote key passages: "The document states: '...'"
+- End with: "Source: [list of files used]"
+"""
+
+WEB_SEARCH_INSTRUCTIONS = f"""
+
+{SEPARATOR}
+🌐 WEB SEARCH RESULTS PROVIDED 🌐
+{SEPARATOR}
+
+You have been provided with CURRENT WEB SEARCH RESULTS at the end of this prompt.
+
+REQUIREMENTS FOR WEB SEARCH:
+1. INCORPORATE up-to-date information from these results
+2. CITE every source with URL: "According to [Source] ([URL])..."
+3. PRIORITIZE recent and authoritative sources
+4. CROSS-REFERENCE when multiple sources agree
+5. NOTE when sources disagree or provide different perspectives
+6. SYNTHESIZE information from multiple sources for comprehensive answers
+7. Include publication dates when available
+
+RESPONSE FORMAT WHEN USING WEB SEARCH:
+- Cite with URLs: "According to TechCrunch (https://...)..."
+- Note source types: "According to research from MIT..." vs "According to news from BBC..."
+- Synthesize: "Multiple sources (Source1, Source2, Source3) confirm that..."
+- End with: "Sources: [list with URLs]"
+"""
+
+SYNTHESIS_INSTRUCTIONS = f"""
+
+{SEPARATOR}
+⚡ BOTH KNOWLEDGE BASE AND WEB SEARCH PROVIDED ⚡
+{SEPARATOR}
+
+You have BOTH internal knowledge base AND external web search results.
+
+SYNTHESIS REQUIREMENTS:
+1. START with knowledge base (internal, authoritative for your organization)
+2. SUPPLEMENT with web search (external, current, broader context)
+3. CLEARLY distinguish sources:
+   - "According to our internal documentation [filename]..."
+   - "According to external sources [Source Name] ([URL])..."
+4. SYNTHESIZE for comprehensive answers
+5. RESOLVE conflicts by presenting both perspectives
+6. CITE ALL sources (both KB files and web URLs)
+
+RESPONSE STRUCTURE:
+1. Internal Knowledge: "Based on our knowledge base [filename]..."
+2. External Context: "According to external sources [URL]..."
+3. Synthesis: "Combining internal documentation with current information..."
+4. Sources: "Internal: [files], External: [URLs]"
+"""
+
+DATE_TEMPLATE = f"""
+
+{SEPARATOR}
+CURRENT DATE AND TIME INFORMATION:
+{SEPARATOR}
+Today's date: {{current_date}}
+Current time: {{current_time}}
+Full date/time: {{current_datetime_full}}
+
+IMPORTANT: When searching the web or providing information about current events, news, or time-sensitive topics, use this date as reference. This helps you provide the most up-to-date and relevant information.
+"""
+
+# Date-only variant: the prompt then changes once a day instead of every minute
+DATE_ONLY_TEMPLATE = f"""
+
+{SEPARATOR}
+CURRENT DATE INFORMATION:
+{SEPARATOR}
+Today's date: {{current_date}}
+
+IMPORTANT: When searching the web or providing information about current events, news, or time-sensitive topics, use this date as reference. This helps you provide the most up-to-date and relevant information.
+"""
+
+# The time-of-day lines of DATE_TEMPLATE, located by the header and date line before them
+TIME_LINES = re.compile(
+    r"(CURRENT DATE AND TIME INFORMATION:\n=+\nToday's date: [^\n]*\n)Current time: [^\n]*\nFull date/time: [^\n]*\n"
+)
+
+RAG_CONTEXT_TEMPLATE = f"""
+
+{SEPARATOR}
+📚 KNOWLEDGE BASE CONTEXT - READ THIS CAREFULLY:
+{SEPARATOR}
+
+{{rag_context}}
+
+{SEPARATOR}
+END OF KNOWLEDGE BASE CONTEXT
+{SEPARATOR}
+
+REMINDER: The above knowledge base context is your PRIMARY source. Use it first and foremost.
+"""
+
+WEB_CONTEXT_TEMPLATE = f"""
+
+{SEPARATOR}
+🔍 WEB SEARCH RESULTS - READ THIS CAREFULLY:
+{SEPARATOR}
+
+{{web_search_context}}
+
+{SEPARATOR}
+END OF WEB SEARCH RESULTS
+{SEPARATOR}
+
+REMINDER: Use these web search results to provide current, comprehensive information.
+"""
+
+# Compiled prefixes kept per (base prompt, has_rag, has_web) combination
+MAX_COMPILED_PREFIXES = 16
+
+
+class PromptBuilder:
+    """Builds system prompts with a static, cacheable prefix and a volatile tail"""
+
+    def __init__(self):
+        self.include_time = os.environ.get('PROMPT_INCLUDE_TIME', 'true').lower() == 'true'
+        self._prefixes: Dict[Tuple[str, bool, bool], str] = {}
+        self._lock = threading.Lock()
+        self._last_prompt: Optional[str] = None
+        self._stats = {
+            "requests": 0,
+            "last_prompt_bytes": 0,
+            "last_static_prefix_bytes": 0,
+            "last_stable_prefix_bytes": 0,
+            "total_prompt_bytes": 0,
+            "total_stable_prefix_bytes": 0
+        }
+
+    def compile(self, base_prompt: str):
+        """Precompile every instruction-block combination for a base prompt"""
+        for has_rag in (False, True):
+            for has_web in (False, True):
+                self.static_prefix(base_prompt, has_rag, has_web)
+
+    def static_prefix(self, base_prompt: str, has_rag: bool, has_web: bool) -> str:
+        """The byte-identical leading part of the prompt for a set of enabled features"""
+        key = (base_prompt, has_rag, has_web)
+        prefix = self._prefixes.get(key)
+        if prefix is not None:
+            return prefix
+
+        parts = [base_prompt]
+        if has_rag:
+            parts.append(RAG_INSTRUCTIONS)
+        if has_web:
+            parts.append(WEB_SEARCH_INSTRUCTIONS)
+        if has_rag and has_web:
+            parts.append(SYNTHESIS_INSTRUCTIONS)
+        prefix = ''.join(parts)
+
+        with self._lock:
+            # Drop prefixes for base prompts that are no longer configured
+            if len(self._prefixes) >= MAX_COMPILED_PREFIXES:
+                self._prefixes.clear()
+            self._prefixes[key] = prefix
+        return prefix
+
+    def build(self, base_prompt: str, rag_context: str = '', web_search_context: str = '',
+              now: Optional[datetime] = None) -> str:
+        """Assemble the full system prompt: static prefix first, volatile parts last"""
+        prefix = self.static_prefix(base_prompt, bool(rag_context), bool(web_search_context))
+
+        now = now or datetime.now()
+        if self.include_time:
+            tail = [DATE_TEMPLATE.format(
+                current_date=now.strftime("%B %d, %Y"),
+                current_time=now.strftime("%I:%M %p"),
+                current_datetime_full=now.strftime("%A, %B %d, %Y at %I:%M %p %Z")
+            )]
+        else:
+            tail = [DATE_ONLY_TEMPLATE.format(current_date=now.strftime("%A, %B %d, %Y"))]
+        if rag_context:
+            tail.append(RAG_CONTEXT_TEMPLATE.format(rag_context=rag_context))
+        if web_search_context:
+            tail.append(WEB_CONTEXT_TEMPLATE.format(web_search_context=web_search_context))
+
+        prompt = prefix + ''.join(tail)
+        self._record(prompt, prefix)
+        return prompt
+
+    def _record(self, prompt: str, prefix: str):
+        """Track how much of the prompt prefix stayed identical to the previous request"""
+        with self._lock:
+            previous = self._last_prompt
+            stable_chars = _common_prefix_length(previous, prompt) if previous is not None else 0
+            stable_bytes = len(prompt[:stable_chars].encode('utf-8'))
+            prompt_bytes = len(prompt.encode('utf-8'))
+
+            self._last_prompt = prompt
+            self._stats["requests"] += 1
+            self._stats["last_prompt_bytes"] = prompt_bytes
+            self._stats["last_static_prefix_bytes"] = len(prefix.encode('utf-8'))
+            self._stats["last_stable_prefix_bytes"] = stable_bytes
+            self._stats["total_prompt_bytes"] += prompt_bytes
+            self._stats["total_stable_prefix_bytes"] += stable_bytes
+
+    def stats(self) -> Dict:
+        """Prefix stability statistics"""
+        with self._lock:
+            stats = dict(self._stats)
+        total = stats["total_prompt_bytes"]
+        stats["stable_prefix_ratio"] = round(stats["total_stable_prefix_bytes"] / total, 4) if total else 0.0
+        stats["compiled_prefixes"] = len(self._prefixes)
+        return stats
+
+
+def without_time_of_day(prompt: str) -> str:
+    """
+    A built prompt with the current time removed but the date kept
+
+    With PROMPT_INCLUDE_TIME=true the prompt changes every minute; the
+    response cache keys on this form so repeated requests still match for
+    the rest of the day.
+    """
+    return TIME_LINES.sub(r"\1", prompt, count=1)
+
+
+def _common_prefix_length(a: str, b: str) -> int:
+    """Length of the common prefix of two strings"""
+    limit = min(len(a), len(b))
+    if a[:limit] == b[:limit]:
+        return limit
+    # Binary search on slice equality; comparisons run in C
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+# Global prompt builder instance
+prompt_builder = PromptBuilder()
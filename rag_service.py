@@ -3,8 +3,9 @@ RAG Service for document processing, embedding, and retrieval
 """
 
 import os
+import time
 import logging
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional
 from pathlib import Path
 import hashlib
 import uuid
@@ -12,14 +13,20 @@ import uuid
 # Embedding and vector database
 try:
     from sentence_transformers import SentenceTransformer
+    from embedding_cache import EmbeddingCache
     EMBEDDINGS_AVAILABLE = True
 except ImportError:
     EMBEDDINGS_AVAILABLE = False
     logging.warning("sentence-transformers not installed. RAG features will be disabled.")
 
+from document_manifest import DocumentManifest
+from document_parser import extract_text, split_text
+
 try:
     from qdrant_client import QdrantClient
-    from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
+    from qdrant_client.models import (
+        Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, PointIdsList, FilterSelector
+    )
     QDRANT_AVAILABLE = True
 except ImportError:
     QDRANT_AVAILABLE = False
@@ -39,6 +46,8 @@ class RAGService:
     
     def __init__(self):
         self.enabled = os.environ.get('RAG_ENABLED', 'true').lower() == 'true'
+        self._change_listeners = []
+        self.embedding_cache = None
         
         if not self.enabled:
             logging.info("RAG is disabled via configuration")
@@ -54,6 +63,7 @@ class RAGService:
                 logging.info(f"Loading embedding model: {self.embedding_model_name}")
                 self.embedding_model = SentenceTransformer(self.embedding_model_name)
                 logging.info("Embedding model loaded successfully")
+                self.embedding_cache = EmbeddingCache(self.embedding_model_name)
             except Exception as e:
                 logging.error(f"Failed to load embedding model: {e}")
                 self.enabled = False
@@ -95,11 +105,16 @@ class RAGService:
                 logging.error(f"Failed to initialize Qdrant client: {e}")
                 self.enabled = False
         
+        # What is indexed per document; in memory when the vectors are
+        self.manifest = DocumentManifest(None if self.in_memory else os.environ.get('KB_MANIFEST_DIR', './kb_manifests'))
+        
         # RAG settings
         self.top_k = int(os.environ.get('RAG_TOP_K', 5))
         self.score_threshold = float(os.environ.get('RAG_SCORE_THRESHOLD', 0.7))
         self.chunk_size = int(os.environ.get('CHUNK_SIZE', 500))
         self.chunk_overlap = int(os.environ.get('CHUNK_OVERLAP', 50))
+        self.embedding_batch_size = int(os.environ.get('EMBEDDING_BATCH_SIZE', 32))  # Chunks per forward pass
+        self.upsert_batch_size = int(os.environ.get('QDRANT_UPSERT_BATCH', 256))  # Points per upsert request
         
         # Initialize MarkItDown
         self.markitdown = None
@@ -114,6 +129,17 @@ class RAGService:
         """Check if RAG service is available and enabled"""
         return self.enabled and self.embedding_model is not None and self.qdrant_client is not None
     
+    def add_change_listener(self, callback):
+        """Register a callback(kb_name) invoked whenever a knowledge base's content changes"""
+        self._change_listeners.append(callback)
+    
+    def notify_change(self, kb_name: str):
+        for callback in self._change_listeners:
+            try:
+                callback(kb_name)
+            except Exception as e:
+                logging.error(f"Knowledge base change listener failed: {e}")
+    
     def create_knowledge_base(self, kb_name: str) -> bool:
         """Create a new knowledge base (collection) in Qdrant"""
         if not self.is_available():
@@ -126,7 +152,8 @@ class RAGService:
                 logging.info(f"Knowledge base '{kb_name}' already exists")
                 return True
             
-            # Create new collection
+            # Create new collection (a manifest left from an earlier one is stale)
+            self.manifest.drop(kb_name)
             self.qdrant_client.create_collection(
                 collection_name=kb_name,
                 vectors_config=VectorParams(
@@ -140,6 +167,18 @@ class RAGService:
             logging.error(f"Failed to create knowledge base '{kb_name}': {e}")
             return False
     
+    def knowledge_base_exists(self, kb_name: str) -> bool:
+        """Whether a knowledge base (collection) exists"""
+        if not self.is_available():
+            return False
+        
+        try:
+            collections = self.qdrant_client.get_collections().collections
+            return any(col.name == kb_name for col in collections)
+        except Exception as e:
+            logging.error(f"Failed to look up knowledge base '{kb_name}': {e}")
+            return False
+    
     def list_knowledge_bases(self) -> List[Dict[str, Any]]:
         """List all knowledge bases"""
         if not self.is_available():
@@ -165,7 +204,9 @@ class RAGService:
         
         try:
             self.qdrant_client.delete_collection(kb_name)
+            self.manifest.drop(kb_name)
             logging.info(f"Deleted knowledge base: {kb_name}")
+            self.notify_change(kb_name)
             return True
         except Exception as e:
             logging.error(f"Failed to delete knowledge base '{kb_name}': {e}")
@@ -173,117 +214,259 @@ class RAGService:
     
     def parse_file(self, file_path: str) -> Optional[str]:
         """Parse a file and extract text content using MarkItDown"""
-        if not self.markitdown:
-            logging.warning("MarkItDown not available, attempting basic text extraction")
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except Exception as e:
-                logging.error(f"Failed to read file: {e}")
-                return None
-        
-        try:
-            result = self.markitdown.convert(file_path)
-            return result.text_content
-        except Exception as e:
-            logging.error(f"Failed to parse file with MarkItDown: {e}")
-            return None
+        return extract_text(file_path, self.markitdown)
     
     def chunk_text(self, text: str) -> List[str]:
         """Split text into chunks with overlap"""
-        chunks = []
-        start = 0
-        text_length = len(text)
-        
-        while start < text_length:
-            end = start + self.chunk_size
-            chunk = text[start:end]
-            
-            # Try to break at sentence boundary
-            if end < text_length:
-                last_period = chunk.rfind('.')
-                last_newline = chunk.rfind('\n')
-                break_point = max(last_period, last_newline)
-                
-                if break_point > self.chunk_size // 2:
-                    chunk = chunk[:break_point + 1]
-                    end = start + break_point + 1
-            
-            chunks.append(chunk.strip())
-            start = end - self.chunk_overlap
-        
-        return [c for c in chunks if c]  # Filter empty chunks
+        return split_text(text, self.chunk_size, self.chunk_overlap)
     
     def embed_text(self, text: str) -> Optional[List[float]]:
         """Generate embedding for text"""
         if not self.embedding_model:
             return None
         
+        embeddings = self.embed_texts([text])
+        return embeddings[0].tolist() if embeddings is not None else None
+    
+    def embed_texts(self, texts: List[str]):
+        """Generate embeddings for many texts in batches; returns a NumPy matrix with one row per text"""
+        if not self.embedding_model:
+            return None
+        
+        def encode(batch: List[str]):
+            return self.embedding_model.encode(
+                batch,
+                batch_size=self.embedding_batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        
         try:
-            embedding = self.embedding_model.encode(text, convert_to_numpy=True)
-            return embedding.tolist()
+            # Texts embedded before (by this model) come from the cache
+            return self.embedding_cache.embed(texts, encode) if self.embedding_cache else encode(texts)
         except Exception as e:
-            logging.error(f"Failed to generate embedding: {e}")
+            logging.error(f"Failed to generate embeddings for {len(texts)} texts: {e}")
             return None
     
-    def add_document(self, kb_name: str, file_path: str, metadata: Optional[Dict] = None) -> bool:
-        """Add a document to a knowledge base"""
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        """SHA-256 of a file's bytes: a document's version identity"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def chunk_hash(chunk: str) -> str:
+        return hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:32]
+    
+    @staticmethod
+    def point_id(doc_id: str, chunk_hash: str) -> str:
+        """Deterministic UUID5 from the document ID and chunk content"""
+        return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{doc_id}_{chunk_hash}"))
+    
+    def list_documents(self, kb_name: str) -> List[Dict[str, Any]]:
+        """Indexed documents of a knowledge base with their versions and chunk counts"""
+        return self.manifest.documents(kb_name)
+    
+    def indexed_version(self, kb_name: str, document_name: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        """The manifest entry of a document if this content is already indexed"""
+        entry = self.manifest.get(kb_name, hashlib.md5(document_name.encode()).hexdigest())
+        return entry if entry and entry['content_hash'] == content_hash else None
+    
+    def diff_chunks(self, kb_name: str, document_name: str, content_hash: str, chunks: List[str]) -> Dict[str, Any]:
+        """
+        Plan for indexing a new version of a document
+        
+        Chunks are identified by their text, so chunks the indexed version
+        already has keep their points; 'new_chunks' lists (chunk hash, index)
+        of the ones to embed and 'removed' the hashes whose points go.
+        split_text() cuts at fixed offsets, so text inserted or deleted early
+        in a document changes most chunks after it and they are embedded
+        again; only edits that keep later boundaries in place save work.
+        """
+        doc_id = hashlib.md5(document_name.encode()).hexdigest()
+        previous = self.manifest.get(kb_name, doc_id)
+        chunk_hashes = [self.chunk_hash(chunk) for chunk in chunks]
+        old_hashes = set(previous['chunk_hashes']) if previous else set()
+        new_chunks = {}  # Chunk hash -> index of its first occurrence
+        for i, chunk_hash in enumerate(chunk_hashes):
+            if chunk_hash not in old_hashes and chunk_hash not in new_chunks:
+                new_chunks[chunk_hash] = i
+        return {
+            'document_id': doc_id,
+            'file_name': document_name,
+            'content_hash': content_hash,
+            'previous': previous,
+            'chunks': chunks,
+            'chunk_hashes': chunk_hashes,
+            'new_chunks': list(new_chunks.items()),
+            'removed': sorted(old_hashes - set(chunk_hashes))
+        }
+    
+    def clear_unmanaged_points(self, kb_name: str, plan: Dict[str, Any]):
+        """Before a document's first indexed version: drop points from before the manifest existed"""
+        if plan['previous'] is not None:
+            return
+        self.qdrant_client.delete(
+            collection_name=kb_name,
+            points_selector=FilterSelector(filter=Filter(
+                must=[FieldCondition(key='document_id', match=MatchValue(value=plan['document_id']))]
+            ))
+        )
+    
+    def chunk_points(self, plan: Dict[str, Any], items: List, vectors: List[List[float]],
+                     metadata: Optional[Dict] = None) -> List:
+        """Qdrant points for (chunk hash, index) items of a plan and their vectors"""
+        return [
+            PointStruct(
+                id=self.point_id(plan['document_id'], chunk_hash),
+                vector=vector,
+                payload={
+                    'document_id': plan['document_id'],
+                    'file_name': plan['file_name'],
+                    # Position in the version that introduced the chunk; retained points are
+                    # not rewritten when later versions move them (the manifest has the order)
+                    'chunk_index': i,
+                    'chunk_hash': chunk_hash,
+                    'text': plan['chunks'][i],
+                    **(metadata or {})
+                }
+            )
+            for (chunk_hash, i), vector in zip(items, vectors)
+        ]
+    
+    def commit_document(self, kb_name: str, plan: Dict[str, Any], file_path: str) -> Dict[str, Any]:
+        """After the new chunks are upserted: delete the old version's leftovers and record the version"""
+        # Only now, so searches never miss the document while it is updated
+        removed_ids = [self.point_id(plan['document_id'], chunk_hash) for chunk_hash in plan['removed']]
+        for start in range(0, len(removed_ids), self.upsert_batch_size):
+            self.qdrant_client.delete(
+                collection_name=kb_name,
+                points_selector=PointIdsList(points=removed_ids[start:start + self.upsert_batch_size])
+            )
+        
+        previous = plan['previous']
+        entry = {
+            'document_id': plan['document_id'],
+            'file_name': plan['file_name'],
+            'content_hash': plan['content_hash'],
+            'version': previous['version'] + 1 if previous else 1,
+            'chunk_count': len(set(plan['chunk_hashes'])),
+            'size': os.path.getsize(file_path),
+            'indexed_at': time.time(),
+            'chunk_hashes': list(dict.fromkeys(plan['chunk_hashes']))
+        }
+        self.manifest.put(kb_name, entry)
+        return self.document_summary(entry, 'updated' if previous else 'added',
+                                     embedded=len(plan['new_chunks']), deleted=len(plan['removed']))
+    
+    @staticmethod
+    def document_summary(entry: Dict[str, Any], status: str, embedded: int, deleted: int) -> Dict[str, Any]:
+        summary = {key: value for key, value in entry.items() if key != 'chunk_hashes'}
+        summary.update(status=status, embedded=embedded, deleted=deleted)
+        return summary
+    
+    def add_document(self, kb_name: str, file_path: str, metadata: Optional[Dict] = None,
+                     document_name: Optional[str] = None,
+                     progress: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Add a document to a knowledge base, or update it to a new version
+        
+        A file whose content hash matches the indexed version is skipped.
+        Otherwise only chunks whose text is new are embedded and upserted,
+        and points of chunks the new version no longer has are deleted.
+        Documents are identified by document_name (default: the file name).
+        Returns a summary whose status is 'added', 'updated' or 'unchanged',
+        or None on failure. progress(stage, counts) is called as the document
+        moves through parsing, embedding and upserting.
+        """
+        def report(stage: str, **counts):
+            if progress is not None:
+                progress(stage, counts)
+        
         if not self.is_available():
-            return False
+            return None
         
         # Ensure knowledge base exists
         self.create_knowledge_base(kb_name)
         
+        file_name = document_name or Path(file_path).name
+        try:
+            content_hash = self.file_hash(file_path)
+        except OSError as e:
+            logging.error(f"Failed to read file: {e}")
+            return None
+        
+        unchanged = self.indexed_version(kb_name, file_name, content_hash)
+        if unchanged:
+            logging.info(f"'{file_name}' is unchanged since version {unchanged['version']}, skipping")
+            return self.document_summary(unchanged, 'unchanged', embedded=0, deleted=0)
+        
+        timings = {}
+        
         # Parse file
+        report('parsing')
+        started = time.time()
         text = self.parse_file(file_path)
+        timings['parse'] = time.time() - started
         if not text:
             logging.error(f"Failed to parse file: {file_path}")
-            return False
+            return None
         
         # Chunk text
+        started = time.time()
         chunks = self.chunk_text(text)
+        timings['chunk'] = time.time() - started
         logging.info(f"Split document into {len(chunks)} chunks")
         
-        # Generate document ID
-        file_name = Path(file_path).name
-        doc_id = hashlib.md5(file_name.encode()).hexdigest()
-        
-        # Prepare points for Qdrant
-        points = []
-        for i, chunk in enumerate(chunks):
-            embedding = self.embed_text(chunk)
-            if not embedding:
-                continue
-
-            point_metadata = {
-                'document_id': doc_id,
-                'file_name': file_name,
-                'chunk_index': i,
-                'text': chunk,
-                **(metadata or {})
-            }
-
-            # Generate a valid UUID from the document ID and chunk index
-            # Use UUID5 with a namespace to ensure deterministic IDs
-            point_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{doc_id}_{i}"))
-
-            points.append(PointStruct(
-                id=point_id,
-                vector=embedding,
-                payload=point_metadata
-            ))
-        
-        # Upload to Qdrant
+        plan = self.diff_chunks(kb_name, file_name, content_hash, chunks)
+        new_chunks = plan['new_chunks']
+        embedded = 0
         try:
-            self.qdrant_client.upsert(
-                collection_name=kb_name,
-                points=points
-            )
-            logging.info(f"Added {len(points)} chunks from '{file_name}' to '{kb_name}'")
-            return True
+            started = time.time()
+            self.clear_unmanaged_points(kb_name, plan)
+            timings['delete'] = time.time() - started
+            timings['embed'] = timings['upsert'] = 0.0
+            
+            # Embed and upload the new chunks one bounded batch at a time
+            for start in range(0, len(new_chunks), self.upsert_batch_size):
+                batch = new_chunks[start:start + self.upsert_batch_size]
+                report('embedding', chunks=len(chunks), chunks_new=len(new_chunks), chunks_embedded=embedded)
+                started = time.time()
+                vectors = self.embed_texts([chunks[i] for _, i in batch])
+                timings['embed'] += time.time() - started
+                if vectors is None:
+                    logging.error(f"Failed to embed '{file_name}'")
+                    return None
+                embedded += len(batch)
+                
+                report('upserting', chunks=len(chunks), chunks_new=len(new_chunks), chunks_embedded=embedded)
+                started = time.time()
+                self.qdrant_client.upsert(
+                    collection_name=kb_name,
+                    points=self.chunk_points(plan, batch, vectors.tolist(), metadata)
+                )
+                timings['upsert'] += time.time() - started
+            
+            report('finalizing', chunks=len(chunks), chunks_new=len(new_chunks), chunks_embedded=embedded)
+            started = time.time()
+            summary = self.commit_document(kb_name, plan, file_path)
+            timings['delete'] += time.time() - started
         except Exception as e:
             logging.error(f"Failed to add document to Qdrant: {e}")
-            return False
+            return None
+        finally:
+            logging.info(
+                f"Timings for '{file_name}' ({len(chunks)} chunks, {len(new_chunks)} new): "
+                + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in timings.items())
+            )
+        
+        logging.info(f"Indexed version {summary['version']} of '{file_name}' in '{kb_name}': "
+                     f"{summary['embedded']} chunks embedded, {summary['deleted']} removed")
+        self.notify_change(kb_name)
+        return summary
     
     def search(self, kb_name: str, query: str, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
         """Search for relevant documents in a knowledge base"""
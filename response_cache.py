@@ -0,0 +1,228 @@
+"""
+Exact-match cache for deterministic LLM responses
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of model responses keyed by the exact request
+
+    The key is a hash of the final message list and the generation
+    parameters. Only deterministic requests are cached (temperature 0 or a
+    fixed seed) unless the caller forces it. An optional on-disk tier keeps
+    entries across restarts and processes; once it holds more than
+    RESPONSE_CACHE_DISK_MAX_ENTRIES files, expired entries and then the
+    oldest ones are pruned down to 90% of the cap.
+    """
+
+    def __init__(self):
+        self.enabled = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+        self.max_entries = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 512))
+        self.ttl = float(os.environ.get('RESPONSE_CACHE_TTL', 3600))  # Seconds
+        disk_dir = os.environ.get('RESPONSE_CACHE_DIR', '')
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_entries = int(os.environ.get('RESPONSE_CACHE_DISK_MAX_ENTRIES', 10000))
+
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_entries: Optional[int] = None  # Files in the disk tier, counted on the first write
+        self._prune_lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+            "bypassed": 0,
+            "disk_pruned": 0
+        }
+
+        if self.enabled and self.disk_dir:
+            try:
+                self.disk_dir.mkdir(parents=True, exist_ok=True)
+                logging.info(f"Response cache disk tier at: {self.disk_dir}")
+            except Exception as e:
+                logging.error(f"Failed to create response cache directory: {e}")
+                self.disk_dir = None
+
+    @staticmethod
+    def is_deterministic(params: Dict[str, Any]) -> bool:
+        """A request is repeatable if it samples greedily or uses a fixed seed"""
+        return float(params.get("temperature", 1)) <= 0 or params.get("seed") is not None
+
+    def should_cache(self, params: Dict[str, Any], force: Optional[bool] = None) -> bool:
+        """
+        Decide whether a request goes through the cache
+
+        force=True caches even non-deterministic requests, force=False
+        bypasses the cache, and None applies the automatic rule.
+        """
+        if not self.enabled or force is False:
+            return False
+        if force is True or self.is_deterministic(params):
+            return True
+        with self._lock:
+            self._stats["bypassed"] += 1
+        return False
+
+    @staticmethod
+    def make_key(messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        """Hash of the final messages and generation parameters"""
+        payload = json.dumps({"messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached entry or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry["created"] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+            self._insert(key, entry)
+        return entry
+
+    def put(self, key: str, content: str, metadata: Optional[Dict[str, Any]] = None):
+        """Store a response"""
+        entry = {"content": content, "created": time.time(), **(metadata or {})}
+        with self._lock:
+            self._insert(key, entry)
+            self._stats["stores"] += 1
+        self._write_disk(key, entry)
+
+    def clear(self):
+        """Drop all in-memory entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and occupancy"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["enabled"] = self.enabled
+        stats["max_entries"] = self.max_entries
+        stats["ttl"] = self.ttl
+        stats["disk_tier"] = str(self.disk_dir) if self.disk_dir else None
+        stats["disk_entries"] = self._disk_entries
+        stats["disk_max_entries"] = self.disk_max_entries
+        return stats
+
+    def _insert(self, key: str, entry: Dict[str, Any]):
+        # Caller holds the lock
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _read_disk(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Unreadable response cache entry {path}: {e}")
+            return None
+
+        if now - entry.get("created", 0) > self.ttl:
+            with self._lock:
+                self._stats["expired"] += 1
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"Failed to write response cache entry: {e}")
+            return
+
+        with self._lock:
+            if self._disk_entries is not None:
+                self._disk_entries += 1  # An overwrite over-counts until the next prune recounts
+                over = self._disk_entries > self.disk_max_entries
+            else:
+                over = True  # Count what earlier runs left behind
+        if over:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Drop expired entries, then the oldest, until the disk tier is under its cap"""
+        if not self._prune_lock.acquire(blocking=False):
+            return  # Another thread is already pruning
+        try:
+            files = []
+            for path in self.disk_dir.glob('*/*.json'):
+                try:
+                    files.append((path.stat().st_mtime, path))
+                except FileNotFoundError:
+                    continue
+            files.sort()
+            target = int(self.disk_max_entries * 0.9) if len(files) > self.disk_max_entries else len(files)
+            expired_before = time.time() - self.ttl
+            pruned = 0
+            for mtime, path in files:
+                if len(files) - pruned <= target and mtime >= expired_before:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                pruned += 1
+            with self._lock:
+                self._disk_entries = len(files) - pruned
+                self._stats["disk_pruned"] += pruned
+            if pruned:
+                logging.info(f"Pruned {pruned} response cache entries from {self.disk_dir}")
+        except Exception as e:
+            logging.warning(f"Failed to prune the response cache directory: {e}")
+        finally:
+            self._prune_lock.release()
+
+
+# Global response cache instance
+response_cache = ResponseCache()
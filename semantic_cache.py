@@ -0,0 +1,170 @@
+"""
+Semantic response cache: reuse answers to paraphrased questions
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rag_service import rag_service
+
+
+class _ScopeIndex:
+    """Brute-force cosine index over the cached questions of one (model, KB) scope"""
+
+    def __init__(self, dimension: int):
+        self.vectors = np.empty((0, dimension), dtype=np.float32)
+        self.entries: List[Dict[str, Any]] = []
+
+    def search(self, vector: np.ndarray) -> Tuple[int, float]:
+        """Index and cosine score of the closest entry, or (-1, 0.0) if empty"""
+        if not self.entries:
+            return -1, 0.0
+        scores = self.vectors @ vector
+        best = int(np.argmax(scores))
+        return best, float(scores[best])
+
+    def add(self, vector: np.ndarray, entry: Dict[str, Any]):
+        self.vectors = np.vstack([self.vectors, vector[np.newaxis, :]])
+        self.entries.append(entry)
+
+    def remove(self, indices: List[int]):
+        if not indices:
+            return
+        keep = np.ones(len(self.entries), dtype=bool)
+        keep[indices] = False
+        self.vectors = self.vectors[keep]
+        self.entries = [entry for entry, kept in zip(self.entries, keep) if kept]
+
+
+class SemanticCache:
+    """
+    Opt-in cache that answers a question from an earlier answer to a similar one
+
+    Questions are embedded with the RAG embedding model and compared by
+    cosine similarity within a scope of (model, knowledge base), so answers
+    never cross models or knowledge bases. Each scope is size-bounded with
+    LRU eviction and entries expire after a TTL. A scope is dropped when its
+    knowledge base changes.
+    """
+
+    def __init__(self):
+        self.enabled = os.environ.get('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+        self.threshold = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.92))
+        self.max_entries = int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', 1000))  # Per scope
+        self.ttl = float(os.environ.get('SEMANTIC_CACHE_TTL', 86400))  # Seconds
+
+        self._scopes: Dict[Tuple[str, str], _ScopeIndex] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+            "invalidations": 0
+        }
+
+        if self.enabled:
+            # Answers grounded in a KB go stale when the KB changes
+            rag_service.add_change_listener(self.invalidate_kb)
+            logging.info(f"Semantic cache enabled (threshold: {self.threshold})")
+
+    def is_available(self) -> bool:
+        """Check if the cache is enabled and an embedding model is loaded"""
+        return self.enabled and getattr(rag_service, 'embedding_model', None) is not None
+
+    def embed(self, query: str) -> Optional[np.ndarray]:
+        """Unit-normalised embedding of a question"""
+        embedding = rag_service.embed_text(query)
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, vector: np.ndarray, model: str, kb_name: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Return the cached answer for the closest earlier question above the threshold"""
+        key = (model, kb_name or '')
+        now = time.time()
+        with self._lock:
+            index = self._scopes.get(key)
+            if index is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._expire(index, now)
+            best, score = index.search(vector)
+            if best < 0 or score < self.threshold:
+                self._stats["misses"] += 1
+                return None
+
+            entry = index.entries[best]
+            entry["last_used"] = now
+            self._stats["hits"] += 1
+
+        logging.info(f"✓ Semantic cache hit (similarity {score:.3f}) for '{entry['query'][:60]}'")
+        return {**entry, "similarity": score}
+
+    def store(self, vector: np.ndarray, model: str, kb_name: Optional[str], query: str, payload: Dict[str, Any]):
+        """Remember the answer to a question"""
+        key = (model, kb_name or '')
+        now = time.time()
+        entry = {"query": query, "created": now, "last_used": now, **payload}
+        with self._lock:
+            index = self._scopes.get(key)
+            if index is None:
+                index = self._scopes[key] = _ScopeIndex(vector.shape[0])
+            index.add(vector, entry)
+            self._stats["stores"] += 1
+
+            # LRU eviction within the scope
+            overflow = len(index.entries) - self.max_entries
+            if overflow > 0:
+                order = sorted(range(len(index.entries)), key=lambda i: index.entries[i]["last_used"])
+                index.remove(order[:overflow])
+                self._stats["evictions"] += overflow
+
+    def invalidate_kb(self, kb_name: str):
+        """Drop cached answers for a knowledge base (every model)"""
+        with self._lock:
+            stale = [key for key in self._scopes if key[1] == kb_name]
+            for key in stale:
+                del self._scopes[key]
+            if stale:
+                self._stats["invalidations"] += 1
+        if stale:
+            logging.info(f"Semantic cache invalidated for knowledge base '{kb_name}'")
+
+    def clear(self):
+        """Drop every cached answer"""
+        with self._lock:
+            self._scopes.clear()
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and occupancy"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["scopes"] = len(self._scopes)
+            stats["entries"] = sum(len(index.entries) for index in self._scopes.values())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["enabled"] = self.enabled
+        stats["threshold"] = self.threshold
+        return stats
+
+    def _expire(self, index: _ScopeIndex, now: float):
+        # Caller holds the lock
+        expired = [i for i, entry in enumerate(index.entries) if now - entry["created"] > self.ttl]
+        if expired:
+            index.remove(expired)
+            self._stats["expired"] += len(expired)
+
+
+# Global semantic cache instance
+semantic_cache = SemanticCache()
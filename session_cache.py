@@ -0,0 +1,178 @@
+"""
+Bounded in-memory cache of active conversation histories
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+# Rough per-message cost of the dict, its keys and small values, on top of the text
+MESSAGE_OVERHEAD = 240  # Bytes
+
+
+def history_size(history: List[Dict]) -> int:
+    """Approximate resident size of a session history in bytes"""
+    return sum(
+        MESSAGE_OVERHEAD + sum(len(value) for value in message.values() if isinstance(value, str))
+        for message in history
+    )
+
+
+class SessionCache:
+    """
+    LRU cache of session histories bounded by entry count and approximate bytes
+
+    Entries marked dirty hold changes the session store has not accepted
+    yet; they are written back through `writer(session_id, history,
+    replace=...)` before being evicted, and stay resident if that fails.
+    A dirty entry whose history replaced the stored one (a clear) is
+    written back as a replacement. The most recently used entry is never
+    evicted, so a single session larger than the byte budget still works.
+    """
+
+    def __init__(self, writer: Callable[..., None]):
+        self.writer = writer
+        self.max_entries = int(os.environ.get('SESSION_CACHE_MAX_ENTRIES', 256))  # 0 = unlimited
+        self.max_bytes = int(os.environ.get('SESSION_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 0 = unlimited
+
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._resident_bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "writebacks": 0,
+            "writeback_errors": 0
+        }
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._entries
+
+    def __getitem__(self, session_id: str) -> List[Dict]:
+        history = self.get(session_id)
+        if history is None:
+            raise KeyError(session_id)
+        return history
+
+    def __setitem__(self, session_id: str, history: List[Dict]):
+        self.put(session_id, history)
+
+    def __delitem__(self, session_id: str):
+        self.discard(session_id)
+
+    def get(self, session_id: str, default: Optional[List[Dict]] = None) -> Optional[List[Dict]]:
+        """Cached history (marked most recently used), or default"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            self._entries.move_to_end(session_id)
+            self._stats["hits"] += 1
+            return entry["history"]
+
+    def peek(self, session_id: str) -> Optional[List[Dict]]:
+        """Cached history without counting a lookup or changing its recency"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            return entry["history"] if entry is not None else None
+
+    def get_or_load(self, session_id: str, loader: Callable[[str], List[Dict]]) -> List[Dict]:
+        """Cached history, loading and caching it on a miss"""
+        history = self.get(session_id)
+        if history is not None:
+            return history
+        history = loader(session_id)
+        with self._lock:
+            # Another request may have loaded (and changed) it meanwhile
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                return entry["history"]
+            self._insert(session_id, history, dirty=False, replace=False)
+        return history
+
+    def put(self, session_id: str, history: List[Dict], dirty: bool = False, replace: bool = False):
+        """Cache a history; dirty=True if the store does not have it yet, replace=True if it supersedes the stored one"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            # Only mark_clean() clears a pending write-back
+            pending = bool(entry and entry["dirty"])
+            replace = (dirty and replace) or (pending and entry["replace"])
+            self._insert(session_id, history, dirty or pending, replace)
+
+    def mark_clean(self, session_id: str, history: List[Dict]):
+        """The store now has this history"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry["history"] is history:
+                entry["dirty"] = entry["replace"] = False
+
+    def discard(self, session_id: str):
+        """Drop a session without writing it back (it was deleted)"""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._resident_bytes -= entry["size"]
+
+    def flush(self) -> int:
+        """Write back every dirty session; returns how many were written"""
+        with self._lock:
+            dirty = [session_id for session_id, entry in self._entries.items() if entry["dirty"]]
+            return sum(1 for session_id in dirty if self._write_back(session_id))
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and occupancy"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["dirty"] = sum(1 for entry in self._entries.values() if entry["dirty"])
+            stats["resident_bytes"] = self._resident_bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+    def _insert(self, session_id: str, history: List[Dict], dirty: bool, replace: bool):
+        # Caller holds the lock
+        old = self._entries.pop(session_id, None)
+        if old is not None:
+            self._resident_bytes -= old["size"]
+        size = history_size(history)
+        self._entries[session_id] = {"history": history, "size": size, "dirty": dirty, "replace": replace}
+        self._resident_bytes += size
+        self._evict()
+
+    def _over_budget(self) -> bool:
+        return (
+            (self.max_entries > 0 and len(self._entries) > self.max_entries)
+            or (self.max_bytes > 0 and self._resident_bytes > self.max_bytes)
+        )
+
+    def _evict(self):
+        # Caller holds the lock; least recently used first, never the newest entry
+        for session_id in list(self._entries)[:-1]:
+            if not self._over_budget():
+                break
+            if self._entries[session_id]["dirty"] and not self._write_back(session_id):
+                continue
+            entry = self._entries.pop(session_id)
+            self._resident_bytes -= entry["size"]
+            self._stats["evictions"] += 1
+
+    def _write_back(self, session_id: str) -> bool:
+        # Caller holds the lock
+        entry = self._entries[session_id]
+        try:
+            self.writer(session_id, entry["history"], replace=entry["replace"])
+        except Exception as e:
+            self._stats["writeback_errors"] += 1
+            logging.error(f"Failed to write back session {session_id}: {e}")
+            return False
+        entry["dirty"] = entry["replace"] = False
+        self._stats["writebacks"] += 1
+        return True
@@ -0,0 +1,187 @@
+"""
+Full-text search over chat session messages (SQLite FTS5)
+"""
+
+import os
+import re
+import html
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Collection, Dict, Iterable, List, Optional, Tuple
+
+# Messages are indexed under the same sequence numbers the session stores use
+from session_store import SEQ_KEY
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+    content,
+    session_id UNINDEXED,
+    seq UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS search_progress (
+    session_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Snippet delimiters that cannot occur in chat text; replaced by <mark> after escaping
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+
+class SessionSearchIndex:
+    """
+    Inverted index of user and assistant messages, ranked with BM25
+
+    Each save indexes only the messages above the session's last indexed
+    sequence number, mirroring how the session stores append, and a
+    cleared or replaced session is re-indexed from scratch. Results are
+    one entry per session with a highlighted snippet of its best match.
+    """
+
+    def __init__(self, path: str, busy_timeout: int = 5000):
+        self.path = path
+        self.busy_timeout = busy_timeout  # Milliseconds
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SEARCH_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections are not shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def is_built(self) -> bool:
+        """Whether the index has been populated from the existing sessions"""
+        row = self._connection().execute("SELECT value FROM search_state WHERE key = 'built'").fetchone()
+        return row is not None
+
+    def update(self, session_id: str, history: List[Dict], replace: bool = False):
+        """Index the messages a save added to a session (all of them if it replaced the history)"""
+        self.update_many([(session_id, history)], replace={session_id} if replace else ())
+
+    def update_many(self, sessions: Iterable[Tuple[str, List[Dict]]], replace: Collection[str] = ()):
+        """update() for several sessions in one transaction"""
+        with self._write() as conn:
+            for session_id, history in sessions:
+                version = history[-1].get(SEQ_KEY, len(history)) if history else 0
+                if session_id in replace:
+                    self._drop(conn, session_id)
+                self._index(conn, session_id, history, version)
+
+    def remove(self, session_id: str):
+        with self._write() as conn:
+            self._drop(conn, session_id)
+
+    def rebuild(self, sessions: Iterable[Tuple[str, List[Dict]]]):
+        """Replace the index with the given (session_id, history) pairs"""
+        count = 0
+        with self._write() as conn:
+            conn.execute("DELETE FROM message_search")
+            conn.execute("DELETE FROM search_progress")
+            for session_id, history in sessions:
+                version = history[-1].get(SEQ_KEY, len(history)) if history else 0
+                self._index(conn, session_id, history, version)
+                count += 1
+            conn.execute("INSERT OR REPLACE INTO search_state (key, value) VALUES ('built', '1')")
+        logging.info(f"Rebuilt session search index ({count} sessions)")
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Sessions matching every term of a query, best first"""
+        expression = self.match_expression(query)
+        if expression is None:
+            return []
+
+        # One row per session: its best match (seq is taken from the MIN() row) and how many matched
+        conn = self._connection()
+        rows = conn.execute(
+            """SELECT session_id, seq, MIN(score), COUNT(*)
+               FROM (SELECT session_id, seq, rank AS score
+                     FROM message_search WHERE message_search MATCH ?)
+               GROUP BY session_id
+               ORDER BY MIN(score), session_id
+               LIMIT ?""",
+            (expression, limit)
+        ).fetchall()
+
+        # Snippets only for the sessions returned
+        results = []
+        for session_id, seq, score, matches in rows:
+            snippet = conn.execute(
+                f"""SELECT snippet(message_search, 0, '{_MARK_START}', '{_MARK_END}', '…', 12)
+                    FROM message_search WHERE message_search MATCH ? AND session_id = ? AND seq = ?""",
+                (expression, session_id, seq)
+            ).fetchone()
+            results.append({
+                'id': session_id,
+                'seq': seq,
+                'score': round(-score, 4),
+                'snippet': self._highlight(snippet[0]) if snippet else '',
+                'matches': matches
+            })
+        return results
+
+    @staticmethod
+    def match_expression(query: str) -> Optional[str]:
+        """FTS5 query for free text: every word must match, the last one as a prefix"""
+        terms = re.findall(r'\w+', query or '')
+        if not terms:
+            return None
+        quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    @staticmethod
+    def _highlight(snippet: str) -> str:
+        # Escape the message text, then turn the match delimiters into <mark> tags
+        return html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+    def _index(self, conn: sqlite3.Connection, session_id: str, history: List[Dict], version: int):
+        row = conn.execute("SELECT seq FROM search_progress WHERE session_id = ?", (session_id,)).fetchone()
+        indexed = row[0] if row else 0
+        if indexed > version:
+            # History was cleared or replaced rather than appended to
+            self._drop(conn, session_id)
+            indexed = 0
+
+        conn.executemany(
+            "INSERT INTO message_search (content, session_id, seq) VALUES (?, ?, ?)",
+            [(message['content'], session_id, message.get(SEQ_KEY, i + 1))
+             for i, message in enumerate(history)
+             if message.get(SEQ_KEY, i + 1) > indexed
+             and message.get('role') in ('user', 'assistant') and message.get('content')]
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO search_progress (session_id, seq) VALUES (?, ?)",
+            (session_id, version)
+        )
+
+    @staticmethod
+    def _drop(conn: sqlite3.Connection, session_id: str):
+        conn.execute("DELETE FROM message_search WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM search_progress WHERE session_id = ?", (session_id,))
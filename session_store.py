@@ -0,0 +1,1066 @@
+"""
+Pluggable chat session storage: per-session JSONL logs or SQLite (WAL)
+"""
+
+import io
+import os
+import gzip
+import json
+import glob
+import time
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Collection, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    # Imported where a store is created: session_search itself imports SEQ_KEY from here
+    from session_search import SessionSearchIndex
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Key under which a message's sequence number is stored in the session history
+SEQ_KEY = 'seq'
+
+
+def assign_sequence(history: List[Dict]) -> List[Dict]:
+    """Number messages that predate sequence numbers (legacy sessions and imports)"""
+    last = 0
+    for message in history:
+        seq = message.get(SEQ_KEY)
+        if not isinstance(seq, int) or seq <= last:
+            message[SEQ_KEY] = last + 1
+        last = message[SEQ_KEY]
+    return history
+
+
+def session_sort_key(session_id: str) -> Tuple[str, str]:
+    """Listing order: creation timestamp (the start of the id), then id"""
+    return session_id.split('_')[0], session_id
+
+
+def session_title(custom_title: Optional[str], history: List[Dict]) -> str:
+    """Custom title if set, otherwise the start of the first user message"""
+    if custom_title:
+        return custom_title
+    first_msg = next((msg for msg in history if msg.get('role') == 'user'), None)
+    return first_msg['content'][:50] + '...' if first_msg else 'New Chat'
+
+
+class SessionStore(ABC):
+    """Interface implemented by session storage backends"""
+
+    name = 'base'
+    search_index: 'SessionSearchIndex'  # Set by each backend, kept current by save() and delete()
+
+    @abstractmethod
+    def load(self, session_id: str) -> List[Dict]:
+        """Full message history of a session ([] if unknown)"""
+
+    def load_tail(self, session_id: str, limit: int, before: Optional[int] = None) -> List[Dict]:
+        """The last `limit` messages of a session, or of those below sequence number `before`"""
+        history = assign_sequence(self.load(session_id))
+        if before is not None:
+            history = [message for message in history if message[SEQ_KEY] < before]
+        return history[-limit:] if limit > 0 else []
+
+    @abstractmethod
+    def save(self, session_id: str, history: List[Dict], replace: bool = False):
+        """
+        Persist a session's history
+
+        Only messages above the stored sequence numbers are written, unless
+        replace=True: then the history supersedes the stored one (after a
+        clear, whose new messages reuse the old sequence numbers).
+        """
+
+    def save_many(self, sessions: List[Tuple[str, List[Dict]]], replace: Collection[str] = ()):
+        """Persist several (session_id, history) pairs as one group commit where the backend allows"""
+        for session_id, history in sessions:
+            self.save(session_id, history, replace=session_id in replace)
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Remove a session and its metadata"""
+
+    @abstractmethod
+    def get_metadata(self, session_id: str) -> Dict[str, Any]:
+        """Session metadata (e.g. custom title)"""
+
+    @abstractmethod
+    def set_metadata(self, session_id: str, **values):
+        """Update session metadata"""
+
+    @abstractmethod
+    def replace_metadata(self, session_id: str, metadata: Dict[str, Any]):
+        """Make a session's metadata exactly `metadata`, dropping keys it does not have"""
+
+    def import_sessions(self, sessions: List[Tuple[str, List[Dict], Dict[str, Any]]],
+                        replace: Collection[str] = ()):
+        """
+        Write imported (session_id, history, metadata) records
+
+        Sessions in `replace` supersede their stored history and metadata;
+        each one's old data stays in place until its new data is written.
+        """
+        self.save_many([(session_id, history) for session_id, history, _ in sessions], replace=replace)
+        for session_id, _, metadata in sessions:
+            if metadata or session_id in replace:
+                self.replace_metadata(session_id, metadata)
+
+    @abstractmethod
+    def session_ids(self) -> List[str]:
+        """Ids of all stored sessions"""
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Sessions whose messages match a query, best first, with highlighted snippets"""
+        if not self.search_index.is_built():
+            self.rebuild_search_index()
+        return self.search_index.search(query, limit)
+
+    def rebuild_search_index(self):
+        """Re-index every session's messages for search"""
+        self.search_index.rebuild((session_id, self.load(session_id)) for session_id in self.session_ids())
+
+    @abstractmethod
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        """Session summaries for the sidebar, newest first"""
+
+    def list_sessions_page(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Up to `limit` summaries listed after session id `cursor`, and the cursor for the next page"""
+        sessions = self.list_sessions()
+        if cursor:
+            after = session_sort_key(cursor)
+            sessions = [session for session in sessions if session_sort_key(session['id']) < after]
+        page = sessions[:limit]
+        return page, page[-1]['id'] if len(sessions) > limit else None
+
+    def close(self):
+        """Flush anything still buffered (called on shutdown)"""
+
+
+class SessionIndex:
+    """
+    Summary of every file-backed session: id, timestamp, title, message_count, last_updated
+
+    Stored in .index/sessions.jsonl as an append-only log of entry updates,
+    so updating a session appends one line and listing sessions reads one
+    file (only the new lines, once loaded). The index also records the
+    session directory's mtime after each change the store itself made to
+    the set of files; a different mtime means a session file was added or
+    removed behind its back, and the index is rebuilt, as it is when missing.
+    """
+
+    def __init__(self, store: 'JSONFileStore'):
+        self.store = store
+        self.directory = os.path.join(store.directory, '.index')
+        self.path = os.path.join(self.directory, 'sessions.jsonl')
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._dir_mtime: Optional[int] = None  # Directory mtime (ns) the index accounts for
+        self._inode = None
+        self._offset = 0  # Bytes of the index file already applied to _entries
+        self._lines = 0
+        self._lock = threading.RLock()
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Current summaries, rebuilding or catching up with the file as needed"""
+        with self._lock:
+            if self.is_stale():
+                self.rebuild()
+            return list(self._entries.values())
+
+    def is_stale(self) -> bool:
+        """Whether session files were added or removed behind the index's back"""
+        return self.directory_state() is None
+
+    def directory_state(self) -> Optional[int]:
+        """
+        The session directory's mtime if the index accounts for it, else None
+
+        The store takes this before adding or removing session files and
+        passes it to record_directory() afterwards.
+        """
+        with self._lock:
+            if not os.path.exists(self.path):
+                return None
+            self._catch_up()
+            mtime = self._directory_mtime()
+            return mtime if mtime == self._dir_mtime else None
+
+    def record_directory(self, state: Optional[int]):
+        """Account for the store's own changes to the directory since directory_state()"""
+        if state is None:
+            return  # The index was already stale; the next listing rebuilds it
+        with self._lock:
+            mtime = self._directory_mtime()
+            if mtime != state:
+                self._append({'_dir_mtime': mtime})
+                self._dir_mtime = mtime
+
+    def update(self, session_id: str, history: List[Dict]):
+        """Record a session's new message count and derived title"""
+        with self._lock:
+            entry = self._current(session_id)
+            custom_title = entry.get('custom_title') if entry else None
+            self._write_entry(self._entry(session_id, history, custom_title))
+
+    def set_title(self, session_id: str, title: Optional[str]):
+        """Record a custom title, or with None go back to the derived one"""
+        with self._lock:
+            entry = self._current(session_id)
+            if entry is None or title is None:
+                entry = self._entry(session_id, self.store.load(session_id), None)
+            if title is not None:
+                entry = {**entry, 'title': title, 'custom_title': title}
+            self._write_entry({**entry, 'last_updated': time.time()})
+
+    def remove(self, session_id: str):
+        with self._lock:
+            self._current(session_id)
+            self._append({'id': session_id, 'deleted': True})
+            self._entries.pop(session_id, None)
+
+    def rebuild(self):
+        """Re-derive every summary, and the search index, from the session files"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            # Taken first, so files added during the scan make the index stale again
+            dir_mtime = self._directory_mtime()
+            entries = {}
+
+            def sessions():
+                for session_id in self.store.session_ids():
+                    try:
+                        custom_title = self.store.get_metadata(session_id).get('title')
+                        history = self.store.load(session_id)
+                    except Exception as e:
+                        logging.warning(f"Skipping session {session_id} while rebuilding the index: {e}")
+                        continue
+                    entry = self._entry(session_id, history, custom_title)
+                    entry['last_updated'] = self.store.modified_time(session_id) or entry['last_updated']
+                    entries[session_id] = entry
+                    yield session_id, history
+
+            # Both indexes are derived from the same files, so they go stale together
+            self.store.search_index.rebuild(sessions())
+            self._entries = entries
+            self._dir_mtime = dir_mtime
+            self._rewrite()
+            logging.info(f"Rebuilt session index ({len(entries)} sessions)")
+
+    @staticmethod
+    def _entry(session_id: str, history: List[Dict], custom_title: Optional[str]) -> Dict[str, Any]:
+        return {
+            'id': session_id,
+            'timestamp': session_id.split('_')[0],
+            'title': session_title(custom_title, history),
+            'custom_title': custom_title,
+            'message_count': len(history),
+            'last_updated': time.time()
+        }
+
+    def _current(self, session_id: str) -> Optional[Dict[str, Any]]:
+        # Caller holds the lock
+        if self._entries is None:
+            self.entries()
+        return self._entries.get(session_id)
+
+    def _write_entry(self, entry: Dict[str, Any]):
+        self._append(entry)
+        self._entries[entry['id']] = entry
+
+    def _directory_mtime(self) -> int:
+        return os.stat(self.store.directory).st_mtime_ns
+
+    def _catch_up(self):
+        # Apply lines appended since the last read (including by other processes)
+        stat = os.stat(self.path)
+        if self._entries is None or stat.st_ino != self._inode or stat.st_size < self._offset:
+            # First read, or the file was rewritten
+            self._entries, self._dir_mtime, self._inode = {}, None, stat.st_ino
+            self._offset, self._lines = 0, 0
+        if stat.st_size == self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            self._lines += 1
+            if '_dir_mtime' in record:
+                self._dir_mtime = record['_dir_mtime']
+            elif record.get('deleted'):
+                self._entries.pop(record['id'], None)
+            else:
+                self._entries[record['id']] = record
+        self._offset += len(complete)
+
+    def _append(self, record: Dict[str, Any]):
+        if not os.path.exists(self.path):
+            self.rebuild()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._lines += 1
+        # Superseded lines pile up; rewrite once they outnumber live entries
+        if self._lines > 2 * len(self._entries) + 100:
+            self._rewrite()
+
+    def _rewrite(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'_dir_mtime': self._dir_mtime}) + '\n')
+            f.writelines(json.dumps(entry, ensure_ascii=False) + '\n' for entry in self._entries.values())
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._inode, self._offset = stat.st_ino, stat.st_size
+        self._lines = len(self._entries) + 1
+
+
+# Control record in a JSONL session log: every message before it is discarded
+RESET_OP = 'reset'
+
+# Read size when scanning a log backwards from its end
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# Cold-storage tier of the JSON store: compressed logs in chat_sessions/archive/
+ARCHIVE_DIR = 'archive'
+ARCHIVE_SUFFIXES = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+
+class JSONFileStore(SessionStore):
+    """
+    One append-only chat_history_<id>.jsonl log per session, titles in chat_metadata_<id>.json
+
+    Each line is one message. Saving a session appends only the messages
+    newer than the last one in the log; clearing a session appends a reset
+    record instead of rewriting the file. Appends are fsynced in batches by
+    a background thread, which also compacts logs that carry records made
+    obsolete by a reset. Legacy chat_history_<id>.json files are still read
+    and are converted to a log on their next save. Sessions moved to the
+    compressed archive tier by archive() are read from there until their
+    next save brings them back.
+    """
+
+    name = 'json'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.fsync_interval = float(os.environ.get('SESSION_FSYNC_INTERVAL', 1.0))  # Seconds, 0 = every write
+        self.compact_interval = float(os.environ.get('SESSION_COMPACT_INTERVAL', 300))  # Seconds
+        self.compact_min_bytes = int(os.environ.get('SESSION_COMPACT_MIN_BYTES', 64 * 1024))
+
+        self._versions: Dict[str, int] = {}  # Sequence number of the newest message in each log
+        self._garbage: Dict[str, int] = {}  # Reset records (and the messages they discard) per log
+        self._dirty = set()  # Logs appended to since the last fsync
+        self._write_lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        from session_search import SessionSearchIndex
+        self.search_index = SessionSearchIndex(os.path.join(directory, '.index', 'search.db'))
+        self.index = SessionIndex(self)
+
+    def log_path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f'chat_history_{session_id}.jsonl')
+
+    def history_path(self, session_id: str) -> str:
+        # Legacy pretty-printed JSON format
+        return os.path.join(self.directory, f'chat_history_{session_id}.json')
+
+    def metadata_path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f'chat_metadata_{session_id}.json')
+
+    def archive_path(self, session_id: str, compression: str = 'gzip') -> str:
+        return os.path.join(self.directory, ARCHIVE_DIR, f'chat_history_{session_id}{ARCHIVE_SUFFIXES[compression]}')
+
+    def archived_path(self, session_id: str) -> Optional[str]:
+        """Path of a session's archived log, if it is in the cold tier"""
+        for compression in ARCHIVE_SUFFIXES:
+            path = self.archive_path(session_id, compression)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def load(self, session_id):
+        path = self.log_path(session_id)
+        if os.path.exists(path):
+            return self._read_log(session_id, path)
+        try:
+            with open(self.history_path(session_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            return []
+
+        archived = self.archived_path(session_id)
+        if archived is None:
+            return []
+        try:
+            with self._open_archive(archived) as f:
+                return self._parse_log(session_id, f, archived)
+        except Exception as e:
+            logging.error(f"Failed to read archived session {archived}: {e}")
+            return []
+
+    def load_tail(self, session_id, limit, before=None):
+        path = self.log_path(session_id)
+        if os.path.exists(path):
+            return self._read_tail(path, limit, before)
+        return super().load_tail(session_id, limit, before)
+
+    def save(self, session_id, history, replace=False):
+        version = history[-1].get(SEQ_KEY, len(history)) if history else 0
+        directory_state = None
+        with self._write_lock:
+            persisted = self._persisted_version(session_id)
+            if persisted is None:
+                # New session, a legacy JSON file or an archived session: start a fresh log
+                directory_state = self.index.directory_state()
+                self._start_log(session_id, history)
+            elif replace:
+                # Written beside the log and renamed over it, so the old history survives a failure
+                self._rewrite(session_id, history)
+                self._garbage[session_id] = 0
+            elif version < persisted:
+                # History was cleared or replaced rather than appended to
+                self._append(session_id, [{"_op": RESET_OP}] + history)
+                self._garbage[session_id] = self._garbage.get(session_id, 0) + 1
+            else:
+                new_messages = [m for i, m in enumerate(history) if m.get(SEQ_KEY, i + 1) > persisted]
+                if new_messages:
+                    self._append(session_id, new_messages)
+            self._versions[session_id] = version
+        self.index.update(session_id, history)
+        self.index.record_directory(directory_state)
+        self.search_index.update(session_id, history, replace=replace)
+
+    def save_many(self, sessions, replace=()):
+        # Appends are made durable together by one fsync pass instead of the periodic one
+        for session_id, history in sessions:
+            self.save(session_id, history, replace=session_id in replace)
+        self.sync()
+
+    def write_session(self, session_id: str, history: List[Dict], metadata: Optional[Dict[str, Any]] = None):
+        """
+        Write a session's complete log (and metadata) without maintaining the indexes
+
+        For bulk migrations, possibly from several processes: the session
+        index sees the directory change and is rebuilt on the next listing.
+        Legacy and archived copies are kept until discard_superseded() is
+        called, so a migration can read the log back and verify it first.
+        """
+        with self._write_lock:
+            self._rewrite(session_id, history)
+            self._versions[session_id] = history[-1].get(SEQ_KEY, len(history)) if history else 0
+        if metadata:
+            with open(self.metadata_path(session_id), 'w') as f:
+                json.dump(metadata, f, indent=2)
+
+    def discard_superseded(self, session_id: str):
+        """Remove the legacy and archived copies of a session whose log has been verified"""
+        with self._write_lock:
+            self._discard_superseded(session_id)
+
+    def delete(self, session_id):
+        directory_state = self.index.directory_state()
+        with self._write_lock:
+            self._versions.pop(session_id, None)
+            self._garbage.pop(session_id, None)
+            for path in (self.log_path(session_id), self.history_path(session_id), self.metadata_path(session_id),
+                         self.archived_path(session_id)):
+                if path and os.path.exists(path):
+                    os.remove(path)
+        self.index.remove(session_id)
+        self.index.record_directory(directory_state)
+        self.search_index.remove(session_id)
+
+    def get_metadata(self, session_id):
+        try:
+            with open(self.metadata_path(session_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def set_metadata(self, session_id, **values):
+        metadata = self.get_metadata(session_id)
+        metadata.update(values)
+        directory_state = self.index.directory_state()
+        with open(self.metadata_path(session_id), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        if 'title' in values:
+            self.index.set_title(session_id, values['title'])
+        self.index.record_directory(directory_state)
+
+    def replace_metadata(self, session_id, metadata):
+        directory_state = self.index.directory_state()
+        path = self.metadata_path(session_id)
+        if metadata:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            os.replace(tmp_path, path)
+        elif os.path.exists(path):
+            os.remove(path)
+        self.index.set_title(session_id, metadata.get('title'))
+        self.index.record_directory(directory_state)
+
+    def modified_time(self, session_id: str) -> Optional[float]:
+        """Modification time of a session's file, if it has one"""
+        for path in (self.log_path(session_id), self.history_path(session_id), self.archived_path(session_id)):
+            if path and os.path.exists(path):
+                return os.path.getmtime(path)
+        return None
+
+    def session_ids(self):
+        # Sessions with a log, legacy file or archive, and those with only metadata (like SQLite)
+        ids = set()
+        patterns = [os.path.join(self.directory, f'chat_history_*{suffix}') for suffix in ('.jsonl', '.json')]
+        patterns += [os.path.join(self.directory, ARCHIVE_DIR, f'chat_history_*{suffix}')
+                     for suffix in ARCHIVE_SUFFIXES.values()]
+        patterns.append(os.path.join(self.directory, 'chat_metadata_*.json'))
+        for pattern in patterns:
+            prefix, suffix = os.path.basename(pattern).split('*')
+            for path in glob.glob(pattern):
+                ids.add(os.path.basename(path)[len(prefix):-len(suffix)])
+        return list(ids)
+
+    def list_sessions(self):
+        sessions = [
+            {key: entry[key] for key in ('id', 'timestamp', 'title', 'message_count', 'last_updated')}
+            for entry in self.index.entries()
+        ]
+        return sorted(sessions, key=lambda x: session_sort_key(x['id']), reverse=True)
+
+    def sync(self):
+        """fsync every log appended to since the last sync"""
+        with self._write_lock:
+            dirty, self._dirty = self._dirty, set()
+        for path in dirty:
+            try:
+                # Without O_CREAT: a log archived meanwhile must not come back empty
+                fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logging.warning(f"Failed to fsync session log {path}: {e}")
+
+    def compact(self):
+        """Rewrite logs whose obsolete records are worth reclaiming"""
+        for session_id, garbage in list(self._garbage.items()):
+            path = self.log_path(session_id)
+            try:
+                if not garbage or os.path.getsize(path) < self.compact_min_bytes:
+                    continue
+                with self._write_lock:
+                    directory_state = self.index.directory_state()
+                    history = self._read_log(session_id, path)
+                    self._rewrite(session_id, history)
+                    self._garbage[session_id] = 0
+                    self.index.record_directory(directory_state)
+                logging.info(f"Compacted session log {path} ({len(history)} messages)")
+            except FileNotFoundError:
+                self._garbage.pop(session_id, None)
+            except Exception as e:
+                logging.error(f"Failed to compact session log {path}: {e}")
+
+    def archive(self, older_than: float, compression: str = 'gzip', dry_run: bool = False) -> Dict[str, Any]:
+        """Move sessions not written for `older_than` seconds into the compressed tier"""
+        if compression == 'zstd' and not ZSTD_AVAILABLE:
+            raise RuntimeError("zstd compression needs the zstandard package (pip install zstandard)")
+
+        report = {"scanned": 0, "eligible": 0, "archived": 0, "skipped": 0, "errors": 0,
+                  "bytes_before": 0, "bytes_after": 0}
+        cutoff = time.time() - older_than
+        directory_state = self.index.directory_state()
+        os.makedirs(os.path.join(self.directory, ARCHIVE_DIR), exist_ok=True)
+
+        for session_id in sorted(self.session_ids()):
+            source = next((path for path in (self.log_path(session_id), self.history_path(session_id))
+                           if os.path.exists(path)), None)
+            if source is None:
+                continue  # Already archived
+            report["scanned"] += 1
+            before = os.stat(source)
+            if before.st_mtime > cutoff:
+                continue
+            report["eligible"] += 1
+            if dry_run:
+                report["bytes_before"] += before.st_size
+                continue
+
+            try:
+                with self._write_lock:
+                    history = assign_sequence(self.load(session_id))
+                    path = self.archive_path(session_id, compression)
+                    self._write_archive(path, history, compression)
+                    # Another process wrote the session during the pass: leave it hot
+                    after = os.stat(source)
+                    if (after.st_mtime_ns, after.st_size) != (before.st_mtime_ns, before.st_size):
+                        os.remove(path)
+                        report["skipped"] += 1
+                        continue
+                    # Keep the last-write time, which listings and the next pass rely on
+                    os.utime(path, ns=(before.st_atime_ns, before.st_mtime_ns))
+                    os.remove(source)
+                    self._versions.pop(session_id, None)
+                    self._garbage.pop(session_id, None)
+                    self._dirty.discard(source)
+                report["archived"] += 1
+                report["bytes_before"] += before.st_size
+                report["bytes_after"] += os.path.getsize(path)
+            except Exception as e:
+                report["errors"] += 1
+                logging.error(f"Failed to archive session {session_id}: {e}")
+
+        # Session contents did not change, so an index that was current still is
+        self.index.record_directory(directory_state)
+        return report
+
+    def close(self):
+        """Stop the background worker and fsync pending appends"""
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join(timeout=5)
+        self.sync()
+
+    def _read_log(self, session_id: str, path: str) -> List[Dict]:
+        with open(path, 'r', encoding='utf-8') as f:
+            return self._parse_log(session_id, f, path)
+
+    def _parse_log(self, session_id: str, lines, path: str) -> List[Dict]:
+        history = []
+        resets = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn final line from a crash mid-append
+                logging.warning(f"Skipping unreadable line in {path}")
+                continue
+            if record.get('_op') == RESET_OP:
+                history = []
+                resets += 1
+            else:
+                history.append(record)
+        self._garbage[session_id] = resets
+        return history
+
+    @staticmethod
+    def _open_archive(path: str):
+        if path.endswith(ARCHIVE_SUFFIXES['zstd']):
+            if not ZSTD_AVAILABLE:
+                raise RuntimeError("zstandard is not installed")
+            return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')), encoding='utf-8')
+        return gzip.open(path, 'rt', encoding='utf-8')
+
+    @staticmethod
+    def _write_archive(path: str, history: List[Dict], compression: str):
+        data = ''.join(json.dumps(message, ensure_ascii=False) + '\n' for message in history).encode('utf-8')
+        if compression == 'zstd':
+            data = zstandard.ZstdCompressor(level=10).compress(data)
+        else:
+            data = gzip.compress(data, compresslevel=9)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _read_tail(self, path: str, limit: int, before: Optional[int] = None) -> List[Dict]:
+        """Parse only the last `limit` messages (below sequence number `before`), reading backwards"""
+        messages = []
+        if limit <= 0:
+            return messages
+        for record in self._records_backwards(path):
+            if record.get('_op') == RESET_OP:
+                break
+            if before is not None and record.get(SEQ_KEY, 0) >= before:
+                continue
+            messages.append(record)
+            if len(messages) >= limit:
+                break
+        messages.reverse()
+        return messages
+
+    @staticmethod
+    def _records_backwards(path: str):
+        """Records of a log from newest to oldest, read from the end in blocks"""
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            remainder = b''
+            while position > 0:
+                size = min(TAIL_BLOCK_SIZE, position)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + remainder).split(b'\n')
+                # Unless this block starts the file, its first line continues in the previous block
+                remainder = lines.pop(0) if position > 0 else b''
+                for line in reversed(lines):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+    def _persisted_version(self, session_id: str) -> Optional[int]:
+        # Caller holds the write lock; None means there is no log yet
+        if not os.path.exists(self.log_path(session_id)):
+            # Possibly archived by another process since it was last written
+            self._versions.pop(session_id, None)
+            return None
+        if session_id in self._versions:
+            return self._versions[session_id]
+        tail = self._read_tail(self.log_path(session_id), 1)
+        return tail[-1].get(SEQ_KEY, 0) if tail else 0
+
+    def _append(self, session_id: str, records: List[Dict]):
+        # One write call per save keeps a turn's lines together
+        path = self.log_path(session_id)
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(data)
+            if self.fsync_interval <= 0:
+                f.flush()
+                os.fsync(f.fileno())
+                return
+        self._dirty.add(path)
+        self._ensure_worker()
+
+    def _start_log(self, session_id: str, history: List[Dict]):
+        # Caller holds the write lock; the log supersedes legacy and archived copies
+        self._rewrite(session_id, history)
+        self._discard_superseded(session_id)
+
+    def _discard_superseded(self, session_id: str):
+        # Caller holds the write lock
+        for old_path in (self.history_path(session_id), self.archived_path(session_id)):
+            if old_path and os.path.exists(old_path):
+                os.remove(old_path)
+
+    def _rewrite(self, session_id: str, history: List[Dict]):
+        path = self.log_path(session_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(message, ensure_ascii=False) + '\n' for message in history)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._dirty.discard(path)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run_worker, name='session-log-sync', daemon=True)
+            self._worker.start()
+
+    def _run_worker(self):
+        last_compaction = time.time()
+        while not self._stop.wait(self.fsync_interval):
+            self.sync()
+            if time.time() - last_compaction >= self.compact_interval:
+                self.compact()
+                last_compaction = time.time()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions(created_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    extra TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at);
+
+CREATE TABLE IF NOT EXISTS session_metadata (
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (session_id, key)
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions, messages and metadata in one SQLite database in WAL mode
+
+    Saving a session inserts only the messages whose sequence number is
+    above the newest stored one, so a turn costs one or two row inserts
+    instead of rewriting the history. WAL mode, a busy timeout and
+    immediate write transactions make the database safe to share between
+    worker processes.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        self.path = path
+        self.busy_timeout = int(os.environ.get('SESSION_DB_BUSY_TIMEOUT', 5000))  # Milliseconds
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SQLITE_SCHEMA)
+        from session_search import SessionSearchIndex
+        self.search_index = SessionSearchIndex(path, self.busy_timeout)
+        logging.info(f"SQLite session store at: {path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections are not shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent writers
+        # wait on busy_timeout instead of failing mid-transaction
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def load(self, session_id):
+        rows = self._connection().execute(
+            "SELECT seq, role, content, extra FROM messages WHERE session_id = ? ORDER BY seq",
+            (session_id,)
+        ).fetchall()
+        return [self._row_message(*row) for row in rows]
+
+    @staticmethod
+    def _row_message(seq, role, content, extra):
+        message = {"role": role, "content": content}
+        if extra:
+            message.update(json.loads(extra))
+        message[SEQ_KEY] = seq
+        return message
+
+    def save(self, session_id, history, replace=False):
+        self.save_many([(session_id, history)], replace={session_id} if replace else ())
+
+    def save_many(self, sessions, replace=()):
+        # All sessions in one transaction: one commit (and WAL sync) for the batch
+        now = time.time()
+        with self._write() as conn:
+            for session_id, history in sessions:
+                self._save(conn, session_id, history, now, session_id in replace)
+        self.search_index.update_many(sessions, replace=replace)
+
+    def _save(self, conn: sqlite3.Connection, session_id: str, history: List[Dict], now: float,
+              replace: bool = False):
+        version = history[-1].get(SEQ_KEY, len(history)) if history else 0
+        stored = conn.execute(
+            "SELECT MAX(seq) FROM messages WHERE session_id = ?", (session_id,)
+        ).fetchone()[0] or 0
+
+        if replace or stored > version:
+            # History was cleared or replaced rather than appended to
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            stored = 0
+
+        conn.execute(
+            """INSERT INTO sessions (id, created_at, updated_at, message_count) VALUES (?, ?, ?, ?)
+               ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at,
+                                             message_count = excluded.message_count""",
+            (session_id, now, now, len(history))
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO messages (session_id, seq, role, content, extra, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [self._message_row(session_id, i, message, now)
+             for i, message in enumerate(history)
+             if message.get(SEQ_KEY, i + 1) > stored]
+        )
+
+    @staticmethod
+    def _message_row(session_id, index, message, now):
+        extra = {k: v for k, v in message.items() if k not in ('role', 'content', SEQ_KEY)}
+        return (
+            session_id,
+            message.get(SEQ_KEY, index + 1),
+            message.get('role', ''),
+            message.get('content') or '',
+            json.dumps(extra) if extra else None,
+            now
+        )
+
+    def load_tail(self, session_id, limit, before=None):
+        rows = self._connection().execute(
+            "SELECT seq, role, content, extra FROM messages WHERE session_id = ? AND (? IS NULL OR seq < ?) "
+            "ORDER BY seq DESC LIMIT ?",
+            (session_id, before, before, limit)
+        ).fetchall()
+        return [self._row_message(*row) for row in reversed(rows)]
+
+    def delete(self, session_id):
+        with self._write() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM session_metadata WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        self.search_index.remove(session_id)
+
+    def get_metadata(self, session_id):
+        rows = self._connection().execute(
+            "SELECT key, value FROM session_metadata WHERE session_id = ?", (session_id,)
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def set_metadata(self, session_id, **values):
+        now = time.time()
+        with self._write() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (id, created_at, updated_at) VALUES (?, ?, ?)",
+                (session_id, now, now)
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_metadata (session_id, key, value) VALUES (?, ?, ?)",
+                [(session_id, key, json.dumps(value)) for key, value in values.items()]
+            )
+
+    def replace_metadata(self, session_id, metadata):
+        with self._write() as conn:
+            self._replace_metadata(conn, session_id, metadata)
+
+    def import_sessions(self, sessions, replace=()):
+        # Histories and metadata of the whole batch in one transaction
+        now = time.time()
+        with self._write() as conn:
+            for session_id, history, metadata in sessions:
+                self._save(conn, session_id, history, now, session_id in replace)
+                if metadata or session_id in replace:
+                    self._replace_metadata(conn, session_id, metadata)
+        self.search_index.update_many([(session_id, history) for session_id, history, _ in sessions],
+                                      replace=replace)
+
+    @staticmethod
+    def _replace_metadata(conn: sqlite3.Connection, session_id: str, metadata: Dict[str, Any]):
+        now = time.time()
+        conn.execute(
+            "INSERT OR IGNORE INTO sessions (id, created_at, updated_at) VALUES (?, ?, ?)",
+            (session_id, now, now)
+        )
+        conn.execute("DELETE FROM session_metadata WHERE session_id = ?", (session_id,))
+        conn.executemany(
+            "INSERT INTO session_metadata (session_id, key, value) VALUES (?, ?, ?)",
+            [(session_id, key, json.dumps(value)) for key, value in metadata.items()]
+        )
+
+    def session_ids(self):
+        return [row[0] for row in self._connection().execute("SELECT id FROM sessions")]
+
+    def is_empty(self) -> bool:
+        return self._connection().execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is None
+
+    def list_sessions(self):
+        return self._summaries(None, -1)
+
+    def list_sessions_page(self, limit, cursor=None):
+        sessions = self._summaries(cursor, limit + 1)
+        page = sessions[:limit]
+        return page, page[-1]['id'] if len(sessions) > limit else None
+
+    def _summaries(self, cursor: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        # Sorted and limited in SQL; titles are looked up only for the rows returned.
+        # The timestamp is the part of the id before the first underscore (session_sort_key)
+        after = session_sort_key(cursor) if cursor else None
+        rows = self._connection().execute(
+            """SELECT s.id, s.message_count, s.updated_at,
+                      (SELECT value FROM session_metadata WHERE session_id = s.id AND key = 'title'),
+                      (SELECT content FROM messages WHERE session_id = s.id AND role = 'user'
+                       ORDER BY seq LIMIT 1)
+               FROM (SELECT id, message_count, updated_at,
+                            substr(id, 1, instr(id || '_', '_') - 1) AS timestamp
+                     FROM sessions) s
+               WHERE ? IS NULL OR (s.timestamp, s.id) < (?, ?)
+               ORDER BY s.timestamp DESC, s.id DESC
+               LIMIT ?""",
+            (cursor, after and after[0], after and after[1], limit)
+        ).fetchall()
+
+        sessions = []
+        for session_id, message_count, updated_at, title, first_user in rows:
+            history = [{"role": "user", "content": first_user}] if first_user is not None else []
+            sessions.append({
+                'id': session_id,
+                'timestamp': session_id.split('_')[0],
+                'title': session_title(json.loads(title) if title else None, history),
+                'message_count': message_count,
+                'last_updated': updated_at
+            })
+        return sessions
+
+
+def import_sessions(source: SessionStore, target: SessionStore) -> int:
+    """Copy every session (history and metadata) from one store to another"""
+    imported = 0
+    for session_id in source.session_ids():
+        try:
+            history = assign_sequence(source.load(session_id))
+            target.save(session_id, history)
+            metadata = source.get_metadata(session_id)
+            if metadata:
+                target.set_metadata(session_id, **metadata)
+            imported += 1
+        except Exception as e:
+            logging.error(f"Failed to import session {session_id}: {e}")
+    return imported
+
+
+def create_session_store(directory: str) -> SessionStore:
+    """Session store selected by SESSION_STORE (json or sqlite)"""
+    backend = os.environ.get('SESSION_STORE', 'json').lower()
+    if backend == 'sqlite':
+        store = SQLiteSessionStore(os.environ.get('SESSION_DB_PATH', os.path.join(directory, 'sessions.db')))
+        if store.is_empty():
+            # First start on SQLite: bring over existing JSON sessions
+            legacy = JSONFileStore(directory)
+            if legacy.session_ids():
+                count = import_sessions(legacy, store)
+                logging.info(f"Imported {count} JSON chat sessions into {store.path}")
+        return store
+
+    if backend != 'json':
+        logging.warning(f"Unknown SESSION_STORE '{backend}', using JSON files")
+    return JSONFileStore(directory)
@@ -0,0 +1,188 @@
+"""
+Bulk export and import of chat sessions as NDJSON, one session per line
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import logging
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from session_store import SessionStore, assign_sequence, session_sort_key
+
+IMPORT_BATCH_SIZE = int(os.environ.get('SESSION_IMPORT_BATCH', 100))  # Sessions per write
+IMPORT_MAX_ERRORS = 100  # Rejected lines listed in the final report
+
+# Session ids become file names in the JSON store
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+MESSAGE_ROLES = ('system', 'user', 'assistant')
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def export_lines(store: SessionStore, load: Callable[[str], List[Dict]]) -> Iterator[bytes]:
+    """One {"session_id", "history", "metadata"} line per session, newest first, loaded one at a time"""
+    for session_id in sorted(store.session_ids(), key=session_sort_key, reverse=True):
+        try:
+            record = {
+                'session_id': session_id,
+                'history': load(session_id),
+                'metadata': store.get_metadata(session_id)
+            }
+        except Exception as e:
+            logging.error(f"Skipping session {session_id} in export: {e}")
+            continue
+        yield (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Compress a byte stream into a gzip stream incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def read_lines(stream) -> Iterator[bytes]:
+    """Lines of an NDJSON upload, decompressing it on the fly if it is gzipped"""
+    head = stream.read(2)
+    if head == GZIP_MAGIC:
+        decompressor = zlib.decompressobj(31)
+        chunks = (decompressor.decompress(chunk) for chunk in _read_chunks(stream, head))
+    else:
+        chunks = _read_chunks(stream, head)
+
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        yield from lines
+    if pending:
+        yield pending
+
+
+def _read_chunks(stream, head: bytes, size: int = 64 * 1024) -> Iterator[bytes]:
+    yield head
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def validate_record(record: Any) -> Tuple[str, List[Dict], Dict[str, Any]]:
+    """(session_id, history, metadata) of an exported line; raises ValueError if it is malformed"""
+    if not isinstance(record, dict):
+        raise ValueError("line is not a JSON object")
+    session_id = record.get('session_id')
+    if not isinstance(session_id, str) or not SESSION_ID_PATTERN.match(session_id):
+        raise ValueError("missing or invalid session_id")
+    history = record.get('history')
+    if not isinstance(history, list):
+        raise ValueError("history must be a list")
+    for message in history:
+        if not isinstance(message, dict) or message.get('role') not in MESSAGE_ROLES:
+            raise ValueError("every message needs a role of system, user or assistant")
+        if not isinstance(message.get('content'), str):
+            raise ValueError("every message needs string content")
+    metadata = record.get('metadata') or {}
+    if not isinstance(metadata, dict):
+        raise ValueError("metadata must be an object")
+    return session_id, assign_sequence(history), metadata
+
+
+class SessionImporter:
+    """
+    Streaming import of NDJSON session lines into a session store
+
+    Lines are validated one at a time and written in batches through
+    save_many(), so memory use is bounded by the batch size rather than the
+    upload. A rejected line is reported and skipped; a batch the store
+    fails to write is reported and the import carries on. Sessions that
+    already exist are skipped unless replace=True, in which case each one
+    is only replaced once its imported version has been written: by one
+    transaction in SQLite, by writing beside the old log and renaming over
+    it in the JSON store.
+    """
+
+    def __init__(self, store: SessionStore, replace: bool = False,
+                 batch_size: int = IMPORT_BATCH_SIZE,
+                 on_write: Optional[Callable[[str], None]] = None):
+        self.store = store
+        self.replace = replace
+        self.batch_size = max(batch_size, 1)
+        self.on_write = on_write  # Called with each session id before it is written
+        self.counts = {"read": 0, "imported": 0, "skipped": 0, "invalid": 0, "failed": 0, "batches": 0}
+        self.errors: List[Dict[str, Any]] = []
+
+    def run(self, lines: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+        """Import the lines, yielding a progress report after each batch and a final summary"""
+        started = time.time()
+        existing = set(self.store.session_ids())
+        batch: List[Tuple[str, List[Dict], Dict[str, Any]]] = []
+
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            self.counts["read"] += 1
+            try:
+                session_id, history, metadata = validate_record(json.loads(line))
+            except ValueError as e:
+                self._reject(line_number, str(e))
+                continue
+
+            if session_id in existing and not self.replace:
+                self.counts["skipped"] += 1
+                continue
+            existing.add(session_id)
+            batch.append((session_id, history, metadata))
+
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+                yield self._report("progress", started)
+
+        if batch:
+            self._write(batch)
+        report = self._report("done", started)
+        report["errors"] = self.errors
+        logging.info(f"Imported {self.counts['imported']} sessions "
+                     f"({self.counts['skipped']} skipped, {self.counts['invalid']} invalid, "
+                     f"{self.counts['failed']} failed) in {report['elapsed']}s")
+        yield report
+
+    def _write(self, batch: List[Tuple[str, List[Dict], Dict[str, Any]]]):
+        self.counts["batches"] += 1
+        try:
+            if self.on_write is not None:
+                for session_id, _, _ in batch:
+                    self.on_write(session_id)
+            # Saving over a session only appends above its last sequence number, so replacements say so
+            replace = {session_id for session_id, _, _ in batch} if self.replace else ()
+            self.store.import_sessions(batch, replace=replace)
+        except Exception as e:
+            logging.error(f"Failed to import a batch of {len(batch)} sessions: {e}")
+            self.counts["failed"] += len(batch)
+            self._error(None, f"batch of {len(batch)} sessions starting at {batch[0][0]} failed: {e}")
+            return
+        self.counts["imported"] += len(batch)
+
+    def _reject(self, line_number: int, reason: str):
+        self.counts["invalid"] += 1
+        self._error(line_number, reason)
+
+    def _error(self, line_number: Optional[int], reason: str):
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line_number, "error": reason})
+
+    def _report(self, event: str, started: float) -> Dict[str, Any]:
+        elapsed = time.time() - started
+        return {
+            "event": event,
+            **self.counts,
+            "elapsed": round(elapsed, 3),
+            "sessions_per_second": round(self.counts["imported"] / elapsed, 1) if elapsed > 0 else 0.0
+        }
@@ -0,0 +1,227 @@
+"""
+Request coalescing for duplicate in-flight chat requests and per-session turn locks
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class FlightAbandoned(Exception):
+    """The leading request went away before producing a result"""
+
+
+class Flight:
+    """A single in-flight call whose result is shared by every request that joins it"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error: Optional[BaseException] = None
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []  # Coroutines in wait_async()
+        self._lock = threading.Lock()
+        self.completed_at: Optional[float] = None
+        self.followers = 0
+
+    def wait(self, timeout: Optional[float] = None) -> Any:
+        """Block until the leader finishes and return its result"""
+        if not self._done.wait(timeout):
+            raise TimeoutError("Timed out waiting for the in-flight request")
+        return self._outcome()
+
+    async def wait_async(self, timeout: Optional[float] = None) -> Any:
+        """wait() for coroutines: suspends the task instead of holding a thread"""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            if not self._done.is_set():
+                self._waiters.append(waiter)
+            else:
+                waiter[1].set()
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timed out waiting for the in-flight request") from None
+        finally:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        return self._outcome()
+
+    def is_done(self) -> bool:
+        return self._done.is_set()
+
+    def _outcome(self) -> Any:
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _finish(self, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            self._result = result
+            self._error = error
+            self.completed_at = time.time()
+            self._done.set()
+            waiters, self._waiters = self._waiters, []
+        # The leader may finish on a worker thread or another event loop
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # That loop has been closed
+
+
+class SingleFlight:
+    """
+    Coalesces identical requests that arrive while the first one is running
+
+    The first request for a key becomes the leader and does the work; later
+    requests join its flight and receive the same result. Results of
+    requests that carried an idempotency key are kept for a short window so
+    retries that arrive just after completion are answered too.
+    """
+
+    def __init__(self):
+        self.result_ttl = float(os.environ.get('SINGLE_FLIGHT_RESULT_TTL', 30))  # Seconds
+        self.wait_timeout = float(os.environ.get('SINGLE_FLIGHT_WAIT_TIMEOUT', 300))  # Seconds
+
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "leaders": 0,
+            "coalesced": 0,
+            "replayed": 0,
+            "abandoned": 0
+        }
+
+    @staticmethod
+    def make_key(session_id: str, message: str, idempotency_key: Optional[str] = None) -> str:
+        """Key identifying a duplicate request"""
+        payload = f"{session_id}\x00{message}\x00{idempotency_key or ''}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """Return (flight, is_leader) for a key"""
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self._stats["replayed" if flight.is_done() else "coalesced"] += 1
+                return flight, False
+
+            flight = self._flights[key] = Flight()
+            self._stats["leaders"] += 1
+            return flight, True
+
+    def complete(self, key: str, flight: Flight, result: Any, keep: bool = False):
+        """Publish the leader's result; keep=True retains it for late retries"""
+        with self._lock:
+            if not keep and self._flights.get(key) is flight:
+                del self._flights[key]
+        flight._finish(result=result)
+
+    def abandon(self, key: str, flight: Flight):
+        """The leader stopped without a result; waiting requests retry on their own"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            self._stats["abandoned"] += 1
+        flight._finish(error=FlightAbandoned())
+
+    def stats(self) -> Dict[str, Any]:
+        """Coalescing counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = sum(1 for flight in self._flights.values() if not flight.is_done())
+            stats["retained_results"] = len(self._flights) - stats["in_flight"]
+        return stats
+
+    def _prune(self, now: float):
+        # Caller holds the lock
+        expired = [
+            key for key, flight in self._flights.items()
+            if flight.is_done() and now - flight.completed_at > self.result_ttl
+        ]
+        for key in expired:
+            del self._flights[key]
+
+
+class SessionLocks:
+    """One lock per session so turns for the same session run one at a time"""
+
+    def __init__(self):
+        self._locks: Dict[str, threading.Lock] = {}
+        self._users: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, session_id: str, timeout: float = -1) -> bool:
+        """Acquire a session's lock (blocking by default)"""
+        with self._lock:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = self._locks[session_id] = threading.Lock()
+            self._users[session_id] = self._users.get(session_id, 0) + 1
+
+        acquired = lock.acquire(timeout=timeout)
+        if not acquired:
+            self._release_user(session_id)
+        return acquired
+
+    def release(self, session_id: str):
+        """Release a session's lock"""
+        self._locks[session_id].release()
+        self._release_user(session_id)
+
+    @contextmanager
+    def hold(self, session_id: str):
+        """Hold a session's lock for the duration of a block"""
+        self.acquire(session_id)
+        try:
+            yield
+        finally:
+            self.release(session_id)
+
+    def _release_user(self, session_id: str):
+        # Drop the lock once nobody holds or waits for it
+        with self._lock:
+            self._users[session_id] -= 1
+            if not self._users[session_id]:
+                del self._users[session_id]
+                del self._locks[session_id]
+
+
+class AsyncSessionLocks:
+    """SessionLocks for coroutines: waiting for a session's turn suspends the task, not a thread"""
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, session_id: str):
+        """Hold a session's lock for the duration of a block"""
+        # Only touched from the event loop, so the bookkeeping needs no lock
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        self._users[session_id] = self._users.get(session_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            # Drop the lock once nobody holds or waits for it
+            self._users[session_id] -= 1
+            if not self._users[session_id]:
+                del self._users[session_id]
+                del self._locks[session_id]
+
+
+# Global instances shared by the Flask and ASGI chat handlers
+chat_flights = SingleFlight()
+session_locks = SessionLocks()
+async_session_locks = AsyncSessionLocks()  # The ASGI app's /chat; Flask's /chat uses session_locks
@@ -122,38 +122,22 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
         }
     }
 
+    // Sessions and messages are fetched a page at a time
+    const SESSION_PAGE_SIZE = 50;
+    const MESSAGE_PAGE_SIZE = 50;
+    let sessionsCursor = null;
+
     async function loadSessions() {
         try {
-            const response = await fetch('/sessions');
-            const sessions = await response.json();
+            // Refresh as many sessions as are already shown, so "Load more" pages are kept
+            const shown = sessionsList.querySelectorAll('.session-item:not([data-search-only])').length;
+            const limit = Math.max(SESSION_PAGE_SIZE, shown);
+            const response = await fetch(`/sessions?limit=${limit}`);
+            const page = await response.json();
 
             sessionsList.innerHTML = '';
-            sessions.forEach(session => {
-                const sessionDiv = document.createElement('div');
-                sessionDiv.className = `session-item ${session.id === currentSessionId ? 'active' : ''}`;
-                sessionDiv.dataset.sessionId = session.id;
-                sessionDiv.dataset.sessionTitle = session.title.toLowerCase();
-                sessionDiv.dataset.sessionContent = (session.content || '').toLowerCase();
-                sessionDiv.dataset.messageCount = session.message_count;
-
-                sessionDiv.innerHTML = `
-                    <div class="session-content">
-                        <div class="session-title">${escapeHtml(session.title)}</div>
-                        <div class="session-info">${session.message_count} messages</div>
-                    </div>
-                    <div class="session-actions">
-                        <button class="session-action-btn edit" onclick="editSession('${session.id}', event)" title="Edit title">✏️</button>
-                        <button class="session-action-btn export" onclick="exportSession('${session.id}', event)" title="Export chat">💾</button>
-                        <button class="session-action-btn delete" onclick="deleteSession('${session.id}', event)" title="Delete chat">🗑️</button>
-                    </div>
-                `;
-
-                // Add click handler to the content area only
-                const contentArea = sessionDiv.querySelector('.session-content');
-                contentArea.addEventListener('click', () => loadSession(session.id));
-
-                sessionsList.appendChild(sessionDiv);
-            });
+            page.sessions.forEach(session => sessionsList.appendChild(renderSessionItem(session)));
+            updateMoreSessionsButton(page.next_cursor);
 
             // Apply current search filter if any
             filterSessions();
@@ -162,6 +146,105 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
         }
     }
 
+    async function loadMoreSessions() {
+        if (!sessionsCursor) return;
+        try {
+            const response = await fetch(`/sessions?limit=${SESSION_PAGE_SIZE}&cursor=${encodeURIComponent(sessionsCursor)}`);
+            const page = await response.json();
+            const button = sessionsList.querySelector('.load-more-sessions');
+            page.sessions.forEach(session => {
+                // A search may already have added this session
+                const existing = sessionsList.querySelector(`[data-session-id="${session.id}"]`);
+                if (existing) existing.remove();
+                sessionsList.insertBefore(renderSessionItem(session), button);
+            });
+            updateMoreSessionsButton(page.next_cursor);
+            filterSessions();
+        } catch (error) {
+            console.error('Error loading more sessions:', error);
+        }
+    }
+
+    function updateMoreSessionsButton(nextCursor) {
+        sessionsCursor = nextCursor;
+        let button = sessionsList.querySelector('.load-more-sessions');
+        if (!nextCursor) {
+            if (button) button.remove();
+            return;
+        }
+        if (!button) {
+            button = document.createElement('button');
+            button.className = 'load-more-sessions';
+            button.textContent = 'Load more';
+            button.addEventListener('click', loadMoreSessions);
+        }
+        sessionsList.appendChild(button);
+    }
+
+    function renderSessionItem(session) {
+        const sessionDiv = document.createElement('div');
+        sessionDiv.className = `session-item ${session.id === currentSessionId ? 'active' : ''}`;
+        sessionDiv.dataset.sessionId = session.id;
+        sessionDiv.dataset.sessionTitle = session.title.toLowerCase();
+        sessionDiv.dataset.messageCount = session.message_count;
+
+        sessionDiv.innerHTML = `
+            <div class="session-content">
+                <div class="session-title">${escapeHtml(session.title)}</div>
+                <div class="session-info">${session.message_count} messages</div>
+            </div>
+            <div class="session-actions">
+                <button class="session-action-btn edit" onclick="editSession('${session.id}', event)" title="Edit title">✏️</button>
+                <button class="session-action-btn export" onclick="exportSession('${session.id}', event)" title="Export chat">💾</button>
+                <button class="session-action-btn delete" onclick="deleteSession('${session.id}', event)" title="Delete chat">🗑️</button>
+            </div>
+        `;
+
+        // Add click handler to the content area only
+        const contentArea = sessionDiv.querySelector('.session-content');
+        contentArea.addEventListener('click', () => loadSession(session.id));
+
+        return sessionDiv;
+    }
+
+    // Message matches for the current search query, by session id (from /sessions/search)
+    let sessionSearchResults = {};
+    let sessionSearchTimer = null;
+
+    // Titles are filtered as you type; message text is searched on the server once typing pauses
+    function searchSessions() {
+        clearTimeout(sessionSearchTimer);
+        sessionSearchResults = {};
+        // Drop sessions that were only listed because they matched the previous query
+        sessionsList.querySelectorAll('.session-item[data-search-only]').forEach(item => item.remove());
+        filterSessions();
+
+        const query = sessionsSearchInput.value.trim();
+        if (!query) return;
+
+        sessionSearchTimer = setTimeout(async () => {
+            try {
+                const response = await fetch(`/sessions/search?q=${encodeURIComponent(query)}`);
+                const data = await response.json();
+                // Ignore results for a query the user has already changed
+                if (sessionsSearchInput.value.trim() !== query) return;
+                sessionSearchResults = {};
+                (data.results || []).forEach(result => {
+                    sessionSearchResults[result.id] = result;
+                    // Matches can be in sessions whose page has not been loaded yet
+                    if (!sessionsList.querySelector(`[data-session-id="${result.id}"]`)) {
+                        const item = renderSessionItem(result);
+                        item.dataset.searchOnly = 'true';
+                        sessionsList.insertBefore(item, sessionsList.querySelector('.load-more-sessions'));
+                    }
+                });
+                filterSessions();
+            } catch (error) {
+                console.error('Error searching sessions:', error);
+            }
+        }, 250);
+    }
+
     // Filter sessions based on search query
     function filterSessions() {
         const searchQuery = sessionsSearchInput.value.toLowerCase().trim();
@@ -170,11 +253,11 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
 
         sessionItems.forEach(item => {
             const title = item.dataset.sessionTitle || '';
-            const content = item.dataset.sessionContent || '';
+            const searchResult = searchQuery ? sessionSearchResults[item.dataset.sessionId] : null;
 
             // Search in both title and message content
             const matchesTitle = title.includes(searchQuery);
-            const matchesContent = content.includes(searchQuery);
+            const matchesContent = Boolean(searchResult);
             const matches = matchesTitle || matchesContent;
 
             if (matches) {
@@ -186,8 +269,9 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
                 if (sessionInfo) {
                     const messageCount = item.dataset.messageCount || '0';
                     if (matchesContent && !matchesTitle && searchQuery) {
-                        // Show that match was found in messages
-                        sessionInfo.innerHTML = `${messageCount} messages <span class="match-indicator">• Match in messages</span>`;
+                        // Show that match was found in messages (the snippet is escaped server-side)
+                        sessionInfo.innerHTML = `${messageCount} messages <span class="match-indicator">• Match in messages</span>
+                            <div class="session-snippet">${searchResult.snippet}</div>`;
                     } else {
                         // Normal display
                         sessionInfo.textContent = `${messageCount} messages`;
@@ -230,16 +314,18 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
 
     async function loadSession(sessionId) {
         try {
-            const response = await fetch(`/sessions/${sessionId}`);
-            const history = await response.json();
+            // Only the newest messages; earlier ones are loaded on request
+            const response = await fetch(`/sessions/${sessionId}?limit=${MESSAGE_PAGE_SIZE}`);
+            const page = await response.json();
             currentSessionId = sessionId;
 
             chatMessages.innerHTML = '';
-            history.forEach(msg => {
+            page.messages.forEach(msg => {
                 if (msg.role !== 'system') {
                     appendMessage(msg.content, msg.role === 'user');
                 }
             });
+            updateEarlierMessagesButton(page);
 
             await loadSessions();
         } catch (error) {
@@ -247,6 +333,49 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
         }
     }
 
+    // Button above the oldest message shown, while the session has earlier ones
+    function updateEarlierMessagesButton(page) {
+        let button = chatMessages.querySelector('.load-earlier-messages');
+        if (!page.has_more || !page.messages.length) {
+            if (button) button.remove();
+            return;
+        }
+        if (!button) {
+            button = document.createElement('button');
+            button.className = 'load-earlier-messages';
+            button.textContent = 'Load earlier messages';
+            button.addEventListener('click', () => loadEarlierMessages(currentSessionId));
+        }
+        button.dataset.before = page.messages[0].seq;
+        chatMessages.prepend(button);
+    }
+
+    async function loadEarlierMessages(sessionId) {
+        const button = chatMessages.querySelector('.load-earlier-messages');
+        if (!button) return;
+        button.disabled = true;
+        try {
+            const response = await fetch(`/sessions/${sessionId}?before=${button.dataset.before}&limit=${MESSAGE_PAGE_SIZE}`);
+            const page = await response.json();
+            if (sessionId !== currentSessionId) return;
+
+            // Keep the messages in view in place while older ones are inserted above them
+            const offsetFromBottom = chatMessages.scrollHeight - chatMessages.scrollTop;
+            const anchor = button.nextSibling;
+            page.messages.forEach(msg => {
+                if (msg.role !== 'system') {
+                    chatMessages.insertBefore(appendMessage(msg.content, msg.role === 'user'), anchor);
+                }
+            });
+            updateEarlierMessagesButton(page);
+            chatMessages.scrollTop = chatMessages.scrollHeight - offsetFromBottom;
+        } catch (error) {
+            console.error('Error loading earlier messages:', error);
+        } finally {
+            button.disabled = false;
+        }
+    }
+
     // Edit session title
     window.editSession = async function(sessionId, event) {
         event.stopPropagation(); // Prevent loading the session
@@ -542,6 +671,7 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
         
         chatMessages.appendChild(container);
         chatMessages.scrollTop = chatMessages.scrollHeight;
+        return container;
     }
 
     // Show loading animation
@@ -1086,8 +1216,11 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
             if (response.ok) {
                 const data = await response.json();
                 console.log('File uploaded:', data);
+                // Indexing runs as a background job
+                const job = await waitForJob(data.job_id);
+                console.log('File processed:', job);
                 await loadKnowledgeBases();
-                return true;
+                return job !== null && job.status === 'succeeded';
             }
             return false;
         } catch (error) {
@@ -1096,6 +1229,16 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
         }
     }
 
+    async function waitForJob(jobId, interval = 1000) {
+        while (true) {
+            const response = await fetch(`/jobs/${jobId}`);
+            if (!response.ok) return null;
+            const job = await response.json();
+            if (job.status === 'succeeded' || job.status === 'failed') return job;
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    }
+
     // Knowledge Base Management Modal
     const kbModal = document.getElementById('kb-modal');
     const manageKBButton = document.getElementById('manage-kb-button');
@@ -1165,6 +1308,7 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
             let successCount = 0;
 
             for (let i = 0; i < files.length; i++) {
+                uploadStatus.innerHTML = `Uploading and indexing ${files[i].name} (${i + 1} of ${files.length})...`;
                 const success = await uploadFileToKB(files[i], kbName);
                 if (success) successCount++;
             }
@@ -1430,13 +1574,13 @@ Remember: Your goal is to provide the MOST HELPFUL, ACCURATE, and COMPREHENSIVE
 
     // Sessions search functionality
     sessionsSearchInput.addEventListener('input', () => {
-        filterSessions();
+        searchSessions();
     });
 
     // Clear search button
     clearSearchButton.addEventListener('click', () => {
         sessionsSearchInput.value = '';
-        filterSessions();
+        searchSessions();
         sessionsSearchInput.focus();
     });
 
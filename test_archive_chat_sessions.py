@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for moving old chat sessions into the compressed archive tier
+"""
+
+import os
+import time
+
+import archive_chat_sessions
+from session_store import JSONFileStore, SEQ_KEY
+
+DAY = 86400
+
+
+def messages(*texts):
+    return [{"role": "user", "content": text, SEQ_KEY: seq} for seq, text in enumerate(texts, 1)]
+
+
+def contents(history):
+    return [message["content"] for message in history]
+
+
+def age(path, days):
+    then = time.time() - days * DAY
+    os.utime(path, (then, then))
+
+
+def old_session(tmp_path):
+    """A store holding one session last written 40 days ago"""
+    store = JSONFileStore(str(tmp_path))
+    store.save("20240101_000000", messages("question", "answer"))
+    store.close()
+    age(store.log_path("20240101_000000"), 40)
+    return JSONFileStore(str(tmp_path))
+
+
+def test_archived_session_is_still_read_and_listed(tmp_path):
+    store = old_session(tmp_path)
+    report = store.archive(30 * DAY)
+
+    assert report["archived"] == 1 and report["bytes_after"] > 0
+    assert not os.path.exists(store.log_path("20240101_000000"))
+    assert store.archived_path("20240101_000000").endswith('.jsonl.gz')
+    assert contents(store.load("20240101_000000")) == ["question", "answer"]
+    assert contents(store.load_tail("20240101_000000", 1)) == ["answer"]
+    assert [session["id"] for session in store.list_sessions()] == ["20240101_000000"]
+
+
+def test_next_save_moves_the_session_out_of_the_archive(tmp_path):
+    store = old_session(tmp_path)
+    store.archive(30 * DAY)
+
+    history = store.load("20240101_000000") + messages("question", "answer", "follow-up")[2:]
+    store.save("20240101_000000", history)
+    assert store.archived_path("20240101_000000") is None
+    assert contents(JSONFileStore(str(tmp_path)).load("20240101_000000")) == ["question", "answer", "follow-up"]
+
+
+def test_recent_sessions_and_dry_runs_are_left_alone(tmp_path):
+    store = old_session(tmp_path)
+    store.save("20240102_000000", messages("recent"))
+
+    report = store.archive(30 * DAY, dry_run=True)
+    assert report["eligible"] == 1 and report["archived"] == 0
+    assert store.archived_path("20240101_000000") is None
+
+    report = store.archive(30 * DAY)
+    assert report["scanned"] == 2 and report["archived"] == 1
+    assert store.archived_path("20240102_000000") is None
+
+
+def test_session_written_during_the_pass_is_skipped(tmp_path, monkeypatch):
+    store = old_session(tmp_path)
+    write_archive = JSONFileStore._write_archive
+
+    def write_then_append(path, history, compression):
+        write_archive(path, history, compression)
+        # Another process appends to the log while it is being archived
+        with open(store.log_path("20240101_000000"), 'a') as f:
+            f.write('{"role": "user", "content": "late", "seq": 3}\n')
+    monkeypatch.setattr(JSONFileStore, '_write_archive', staticmethod(write_then_append))
+    report = store.archive(30 * DAY)
+
+    assert report["skipped"] == 1 and report["archived"] == 0
+    assert store.archived_path("20240101_000000") is None
+    assert contents(store.load("20240101_000000")) == ["question", "answer", "late"]
+
+
+def test_script_reports_and_archives(tmp_path, capsys):
+    old_session(tmp_path).close()
+    assert archive_chat_sessions.main(['--dir', str(tmp_path), '--days', '30']) == 0
+    assert "Sessions archived" in capsys.readouterr().out
+    assert JSONFileStore(str(tmp_path)).archived_path("20240101_000000") is not None
+    assert archive_chat_sessions.main(['--dir', str(tmp_path / 'missing')]) == 1
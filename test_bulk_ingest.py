@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for unpacking bulk upload archives and the knowledge base folder check
+"""
+
+import io
+import os
+import stat
+import tarfile
+import zipfile
+
+import pytest
+
+from bulk_ingest import BulkIngestError, extract_archive
+from file_handler import FileHandler
+
+
+def allowed(name):
+    return name.endswith('.txt')
+
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return str(path)
+
+
+def make_tar(path, members):
+    with tarfile.open(path, 'w') as archive:
+        for info, data in members:
+            archive.addfile(info, io.BytesIO(data) if data is not None else None)
+    return str(path)
+
+
+def tar_file(name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    return info, data
+
+
+def tar_entry(name, kind, linkname=''):
+    info = tarfile.TarInfo(name)
+    info.type = kind
+    info.linkname = linkname
+    return info, None
+
+
+def written(destination):
+    return sorted(str(path.relative_to(destination)) for path in destination.rglob('*') if path.is_file())
+
+
+def test_zip_members_outside_destination_are_skipped(tmp_path):
+    archive = make_zip(tmp_path / 'a.zip', [
+        ('docs/a.txt', b'a'),
+        ('/etc/passwd.txt', b'x'),
+        ('../escape.txt', b'x'),
+        ('docs/../../escape.txt', b'x'),
+        ('..\\windows.txt', b'x'),
+        ('.hidden/b.txt', b'x'),
+        ('__MACOSX/docs/a.txt', b'x'),
+        ('image.png', b'x'),
+    ])
+    destination = tmp_path / 'kb'
+    files, skipped = extract_archive(archive, destination, allowed, 100)
+
+    assert files == [('docs/a.txt', str(destination / 'docs' / 'a.txt'))]
+    assert skipped == 7
+    assert written(destination) == ['docs/a.txt']
+    assert not (tmp_path / 'escape.txt').exists()
+
+
+def test_tar_links_and_devices_are_never_written(tmp_path):
+    archive = make_tar(tmp_path / 'a.tar', [
+        tar_file('a.txt', b'a'),
+        tar_file('/abs.txt', b'x'),
+        tar_file('../up.txt', b'x'),
+        tar_entry('link.txt', tarfile.SYMTYPE, '/etc/passwd'),
+        tar_entry('hard.txt', tarfile.LNKTYPE, 'a.txt'),
+        tar_entry('dev.txt', tarfile.CHRTYPE),
+        tar_entry('fifo.txt', tarfile.FIFOTYPE),
+    ])
+    destination = tmp_path / 'kb'
+    files, skipped = extract_archive(archive, destination, allowed, 100)
+
+    assert [name for name, _ in files] == ['a.txt'] and skipped == 6
+    assert written(destination) == ['a.txt']
+    assert not any(path.is_symlink() for path in destination.rglob('*'))
+
+
+def test_zip_symlink_entry_is_written_as_a_plain_file(tmp_path):
+    info = zipfile.ZipInfo('link.txt')
+    info.external_attr = (stat.S_IFLNK | 0o777) << 16
+    with zipfile.ZipFile(tmp_path / 'a.zip', 'w') as archive:
+        archive.writestr(info, '/etc/passwd')
+    destination = tmp_path / 'kb'
+    extract_archive(str(tmp_path / 'a.zip'), destination, allowed, 100)
+
+    assert not (destination / 'link.txt').is_symlink()
+    assert (destination / 'link.txt').read_text() == '/etc/passwd'
+
+
+def test_file_size_and_count_caps(tmp_path):
+    archive = make_zip(tmp_path / 'a.zip', [('small.txt', b'x' * 10), ('big.txt', b'x' * 11)])
+    files, skipped = extract_archive(archive, tmp_path / 'kb', allowed, 10)
+    assert [name for name, _ in files] == ['small.txt'] and skipped == 1
+
+    archive = make_zip(tmp_path / 'b.zip', [(f'{i}.txt', b'x') for i in range(4)])
+    with pytest.raises(BulkIngestError, match='limit is 3'):
+        extract_archive(archive, tmp_path / 'kb2', allowed, 10, max_files=3)
+    # Rejected before anything is unpacked
+    assert not (tmp_path / 'kb2').exists()
+
+
+def test_not_an_archive(tmp_path):
+    (tmp_path / 'a.txt').write_text('plain')
+    with pytest.raises(BulkIngestError, match='not a zip or tar'):
+        extract_archive(str(tmp_path / 'a.txt'), tmp_path / 'kb', allowed, 10)
+
+
+@pytest.mark.parametrize('kb_name', ['..', '.', '', '/etc', 'a/../..', '../uploads2'])
+def test_knowledge_base_folder_rejects_names_outside_uploads(tmp_path, kb_name):
+    assert FileHandler(str(tmp_path / 'uploads')).knowledge_base_folder(kb_name) is None
+
+
+def test_knowledge_base_folder(tmp_path):
+    handler = FileHandler(str(tmp_path / 'uploads'))
+    assert handler.knowledge_base_folder('My KB') == (tmp_path / 'uploads' / 'My KB').resolve()
+    assert not os.path.exists(tmp_path / 'uploads' / 'My KB')
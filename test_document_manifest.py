@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for the document manifest and the chunk diff of a new document version
+"""
+
+import threading
+
+import pytest
+
+from document_manifest import DocumentManifest
+from rag_service import RAGService
+
+
+def entry(document_id, chunk_hashes, version=1):
+    return {
+        'document_id': document_id,
+        'file_name': f'{document_id}.txt',
+        'content_hash': f'content-{version}',
+        'version': version,
+        'chunk_count': len(chunk_hashes),
+        'size': 100,
+        'indexed_at': 1.0,
+        'chunk_hashes': chunk_hashes
+    }
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    monkeypatch.setenv('RAG_ENABLED', 'false')
+    service = RAGService()
+    service.manifest = DocumentManifest(str(tmp_path))
+    return service
+
+
+def test_put_get_and_replace_version(tmp_path):
+    manifest = DocumentManifest(str(tmp_path))
+    manifest.put('kb', entry('b', ['h1', 'h2', 'h3']))
+    manifest.put('kb', entry('a', ['h9']))
+    manifest.put('kb', entry('b', ['h3', 'h1'], version=2))
+
+    assert manifest.get('kb', 'b') == entry('b', ['h3', 'h1'], version=2)
+    assert manifest.get('other', 'b') is None
+    assert [document['document_id'] for document in manifest.documents('kb')] == ['a', 'b']
+    assert 'chunk_hashes' not in manifest.documents('kb')[0]
+
+    # Survives a restart
+    assert DocumentManifest(str(tmp_path)).get('kb', 'b')['chunk_hashes'] == ['h3', 'h1']
+
+    manifest.remove('kb', 'a')
+    manifest.drop('kb')
+    assert manifest.documents('kb') == []
+
+
+def test_in_memory_manifest_is_shared_between_threads():
+    manifest = DocumentManifest(None)
+    thread = threading.Thread(target=manifest.put, args=('kb', entry('d', ['x'])))
+    thread.start()
+    thread.join()
+    assert manifest.get('kb', 'd')['chunk_hashes'] == ['x']
+    assert DocumentManifest(None).get('kb', 'd') is None
+
+
+def test_diff_of_first_version_embeds_each_distinct_chunk(service):
+    plan = service.diff_chunks('kb', 'doc.txt', 'c1', ['one', 'two', 'one'])
+    assert plan['previous'] is None
+    hashes = [service.chunk_hash(chunk) for chunk in ['one', 'two']]
+    assert plan['new_chunks'] == [(hashes[0], 0), (hashes[1], 1)]
+    assert plan['removed'] == []
+
+
+def test_diff_keeps_unchanged_chunks_and_removes_dropped_ones(service):
+    first = service.diff_chunks('kb', 'doc.txt', 'c1', ['one', 'two', 'three'])
+    service.manifest.put('kb', entry(first['document_id'], first['chunk_hashes']))
+
+    plan = service.diff_chunks('kb', 'doc.txt', 'c2', ['one', 'three', 'four'])
+    assert plan['previous']['chunk_hashes'] == first['chunk_hashes']
+    assert plan['new_chunks'] == [(service.chunk_hash('four'), 2)]
+    assert plan['removed'] == [service.chunk_hash('two')]
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for the embedding cache: keying, batching and the disk tier
+"""
+
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache, normalize_text, text_hash
+
+
+class Encoder:
+    """Deterministic stand-in for the model, recording what it was asked to encode"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return np.array([[len(text), sum(map(ord, text)) % 97] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'embeddings.db')
+    monkeypatch.setenv('EMBEDDING_CACHE_PATH', path)
+    monkeypatch.setenv('EMBEDDING_CACHE_ENABLED', 'true')
+    return path
+
+
+def test_key_ignores_whitespace_runs_and_unicode_form():
+    assert normalize_text("  hello \n\t world ") == "hello world"
+    assert text_hash("café  au lait") == text_hash("café au\nlait")
+    assert text_hash("hello world") != text_hash("Hello world")
+
+
+def test_each_distinct_text_is_encoded_once(db_path):
+    cache, encode = EmbeddingCache('model-a'), Encoder()
+    vectors = cache.embed(["one", "two", "one ", "one"], encode)
+
+    assert encode.calls == [["one", "two"]]
+    assert vectors.shape == (4, 2)
+    assert np.array_equal(vectors[0], vectors[2]) and np.array_equal(vectors[0], vectors[3])
+
+    cache.embed(["two", "three"], encode)
+    assert encode.calls[1] == ["three"]
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 5
+
+
+def test_disk_tier_survives_restart_for_the_same_model(db_path):
+    EmbeddingCache('model-a').embed(["one", "two"], Encoder())
+
+    encode = Encoder()
+    cache = EmbeddingCache('model-a')
+    vectors = cache.embed(["one", "two"], encode)
+    assert encode.calls == [] and cache.stats()["disk_hits"] == 2
+    assert np.array_equal(vectors, Encoder()(["one", "two"]))
+
+
+def test_model_change_drops_cached_vectors(db_path):
+    EmbeddingCache('model-a').embed(["one"], Encoder())
+
+    encode = Encoder()
+    EmbeddingCache('model-b').embed(["one"], encode)
+    assert encode.calls == [["one"]]
+
+    # Switching back finds nothing of model-a left
+    encode = Encoder()
+    EmbeddingCache('model-a').embed(["one"], encode)
+    assert encode.calls == [["one"]]
+
+
+def test_memory_tier_is_bounded(db_path, monkeypatch):
+    monkeypatch.setenv('EMBEDDING_CACHE_MAX_ENTRIES', '2')
+    monkeypatch.setenv('EMBEDDING_CACHE_PATH', '')
+    cache, encode = EmbeddingCache('model-a'), Encoder()
+    cache.embed(["a", "b", "c"], encode)
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+
+    cache.embed(["a"], encode)
+    assert encode.calls[-1] == ["a"]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Tests for the persistent ingestion job queue: claiming, leases and recovery
+"""
+
+import json
+import sqlite3
+import time
+
+import pytest
+
+import ingestion_jobs
+from ingestion_jobs import IngestionJobQueue
+
+
+class FakeRAG:
+    def add_document(self, kb_name, file_path, metadata=None, document_name=None, progress=None):
+        progress('embedding', {'chunks': 2, 'chunks_embedded': 2})
+        return {'file_name': document_name, 'chunk_count': 2, 'embedded': 2, 'status': 'added'}
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion_jobs, 'POLL_INTERVAL', 0.02)
+    monkeypatch.setenv('INGESTION_JOBS_DB', str(tmp_path / 'jobs.db'))
+    monkeypatch.setenv('INGESTION_WORKERS', '1')
+    monkeypatch.setenv('INGESTION_LEASE', '0.3')
+    return str(tmp_path / 'jobs.db')
+
+
+def idle_queue():
+    """A queue whose worker has stopped, so the tests drive _claim() themselves"""
+    queue = IngestionJobQueue(FakeRAG())
+    queue.close()
+    for thread in queue._threads:
+        thread.join()
+    return queue
+
+
+def insert(path, job_id, status='queued', kind='file', kb_name='kb', document='a.txt', owner=None,
+           heartbeat_at=None, attempts=0, created_at=1.0):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO jobs (id, kind, kb_name, document, status, stage, payload, attempts, created_at, owner, "
+        "heartbeat_at) VALUES (?, ?, ?, ?, ?, ?, '{}', ?, ?, ?, ?)",
+        (job_id, kind, kb_name, document, status, status, attempts, created_at, owner, heartbeat_at)
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_file_job_runs_to_completion(path):
+    queue = IngestionJobQueue(FakeRAG())
+    job_id = queue.submit('file', 'kb', {'file_path': '/nowhere/a.txt', 'document_name': 'a.txt'}, document='a.txt')
+    for _ in range(200):
+        job = queue.get(job_id)
+        if job['status'] == 'succeeded':
+            break
+        time.sleep(0.01)
+    queue.close()
+
+    assert job['status'] == 'succeeded' and job['stage'] == 'done'
+    assert job['result']['chunk_count'] == 2 and job['progress']['chunks_embedded'] == 2
+    assert job['attempts'] == 1 and job['owner'] is None
+
+
+def test_claim_records_owner_and_lease(path):
+    queue = idle_queue()
+    insert(path, 'j1')
+    before = time.time()
+    assert queue._claim()['id'] == 'j1'
+
+    job = queue.get('j1')
+    assert job['status'] == 'running' and job['owner'] == queue.owner
+    assert job['heartbeat_at'] >= before and job['attempts'] == 1
+
+
+def test_jobs_of_a_live_owner_are_left_alone(path):
+    idle_queue()
+    insert(path, 'live', status='running', owner='other:1:abc', heartbeat_at=time.time() + 60, attempts=1)
+    queue = idle_queue()
+    job = queue.get('live')
+    assert job['status'] == 'running' and job['owner'] == 'other:1:abc'
+
+
+def test_expired_lease_is_requeued_and_claimed_again(path):
+    queue = idle_queue()
+    insert(path, 'dead', status='running', owner='other:1:abc', heartbeat_at=time.time() - 5, attempts=1)
+    claimed = queue._claim()
+    assert claimed['id'] == 'dead'
+    job = queue.get('dead')
+    assert job['owner'] == queue.owner and job['attempts'] == 2
+
+
+def test_expired_lease_past_max_attempts_fails(path):
+    queue = idle_queue()
+    insert(path, 'dead', status='running', owner='other:1:abc', heartbeat_at=time.time() - 5,
+           attempts=queue.max_attempts)
+    assert queue._claim() is None
+    job = queue.get('dead')
+    assert job['status'] == 'failed' and job['errors'] == ['interrupted too many times']
+
+
+def test_claim_skips_jobs_conflicting_with_running_ones(path):
+    queue = idle_queue()
+    insert(path, 'bulk', status='running', kind='bulk', document=None, owner='other:1:abc',
+           heartbeat_at=time.time() + 60)
+    insert(path, 'same-kb', created_at=1.0)
+    insert(path, 'other-kb', kb_name='kb2', created_at=2.0)
+    assert queue._claim()['id'] == 'other-kb'
+    assert queue._claim() is None
+
+
+def test_finish_after_takeover_is_not_recorded(path):
+    queue = idle_queue()
+    insert(path, 'j1')
+    queue._claim()
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE jobs SET owner = 'other:1:abc' WHERE id = 'j1'")
+    conn.commit()
+    conn.close()
+
+    queue._finish('j1', 'failed', None, ['stale run'])
+    job = queue.get('j1')
+    assert job['status'] == 'running' and job['owner'] == 'other:1:abc'
+    assert json.dumps(job['errors']) == '[]'
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests for converting legacy chat sessions in place
+"""
+
+import json
+
+import migrate_chat_sessions as migrate
+from session_store import JSONFileStore
+
+LEGACY = [{"role": "user", "content": "question"}, {"role": "assistant", "content": "answer"}]
+
+
+def convert(directory):
+    spec = ('json', str(directory))
+    return migrate.convert_sessions(spec, spec, str(directory / '.migration.jsonl'))
+
+
+def test_legacy_file_removed_only_after_verified_log(tmp_path):
+    (tmp_path / 'chat_history_s1.json').write_text(json.dumps(LEGACY))
+    stats = convert(tmp_path)
+
+    assert stats['migrated'] == 1 and not stats['failed']
+    assert not (tmp_path / 'chat_history_s1.json').exists()
+    assert [message['content'] for message in JSONFileStore(str(tmp_path)).load('s1')] == ['question', 'answer']
+
+
+def test_failed_verification_keeps_legacy_file(tmp_path, monkeypatch):
+    (tmp_path / 'chat_history_s1.json').write_text(json.dumps(LEGACY))
+    monkeypatch.setattr(JSONFileStore, 'load', lambda self, session_id: [dict(LEGACY[0])])
+    stats = convert(tmp_path)
+
+    assert stats['failed'] == 1
+    assert json.loads((tmp_path / 'chat_history_s1.json').read_text()) == LEGACY
+    assert not (tmp_path / 'chat_history_s1.jsonl').exists()
+
+    # The next run converts it from the legacy file again
+    monkeypatch.undo()
+    assert convert(tmp_path)['migrated'] == 1
+    assert not (tmp_path / 'chat_history_s1.json').exists()
+
+
+def test_log_of_interrupted_run_is_not_trusted(tmp_path):
+    (tmp_path / 'chat_history_s1.json').write_text(json.dumps(LEGACY))
+    (tmp_path / 'chat_history_s1.jsonl').write_text(json.dumps(LEGACY[0]) + '\n')
+    assert convert(tmp_path)['migrated'] == 1
+    assert len(JSONFileStore(str(tmp_path)).load('s1')) == 2
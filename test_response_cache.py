@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Tests for the response cache key and its on-disk tier
+"""
+
+import os
+import time
+from datetime import datetime
+
+from prompt_builder import PromptBuilder, without_time_of_day
+from response_cache import ResponseCache
+
+PARAMS = {"model": "m", "temperature": 0, "max_tokens": 100}
+
+
+def test_prompt_without_time_of_day_keeps_the_date():
+    builder = PromptBuilder()
+    builder.include_time = True
+    morning = builder.build("Base", "kb text", now=datetime(2026, 10, 17, 9, 5))
+    evening = builder.build("Base", "kb text", now=datetime(2026, 10, 17, 21, 40))
+    next_day = builder.build("Base", "kb text", now=datetime(2026, 10, 18, 9, 5))
+
+    assert morning != evening
+    assert without_time_of_day(morning) == without_time_of_day(evening)
+    assert without_time_of_day(morning) != without_time_of_day(next_day)
+    assert "Current time" not in without_time_of_day(morning)
+    assert "kb text" in without_time_of_day(morning)
+
+
+def test_date_only_prompt_is_unchanged():
+    builder = PromptBuilder()
+    builder.include_time = False
+    prompt = builder.build("Base", now=datetime(2026, 10, 17, 9, 5))
+    assert without_time_of_day(prompt) == prompt
+
+
+def test_disk_tier_prunes_expired_then_oldest(tmp_path, monkeypatch):
+    monkeypatch.setenv('RESPONSE_CACHE_DIR', str(tmp_path))
+    monkeypatch.setenv('RESPONSE_CACHE_DISK_MAX_ENTRIES', '10')
+    cache = ResponseCache()
+    keys = [ResponseCache.make_key([{"role": "user", "content": str(i)}], PARAMS) for i in range(11)]
+    for i, key in enumerate(keys[:10]):
+        cache.put(key, f"answer {i}")
+        path = cache._disk_path(key)
+        os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+    assert cache.stats()["disk_entries"] == 10
+
+    cache.put(keys[10], "answer 10")
+    remaining = sorted(path.name for path in tmp_path.glob('*/*.json'))
+    assert len(remaining) == 9
+    assert f"{keys[0]}.json" not in remaining and f"{keys[10]}.json" in remaining
+    assert cache.stats()["disk_pruned"] == 2
+
+    cache.clear()
+    assert cache.get(keys[10])["content"] == "answer 10"
+    assert cache.get(keys[0]) is None
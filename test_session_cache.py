@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Tests for the bounded cache of active conversation histories
+"""
+
+import pytest
+
+from session_cache import SessionCache, history_size
+
+
+class Writer:
+    def __init__(self):
+        self.writes = []
+        self.fail = False
+
+    def __call__(self, session_id, history, replace=False):
+        if self.fail:
+            raise OSError("store unavailable")
+        self.writes.append((session_id, list(history), replace))
+
+
+@pytest.fixture
+def writer():
+    return Writer()
+
+
+def cache_of(writer, monkeypatch, entries=3, size=0):
+    monkeypatch.setenv('SESSION_CACHE_MAX_ENTRIES', str(entries))
+    monkeypatch.setenv('SESSION_CACHE_MAX_BYTES', str(size))
+    return SessionCache(writer)
+
+
+def history(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_least_recently_used_is_evicted(writer, monkeypatch):
+    cache = cache_of(writer, monkeypatch, entries=2)
+    cache.put("a", history("a"))
+    cache.put("b", history("b"))
+    cache.get("a")
+    cache.put("c", history("c"))
+
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.stats()["evictions"] == 1 and writer.writes == []
+
+
+def test_byte_budget_keeps_the_newest_entry(writer, monkeypatch):
+    big = history("x" * 1000)
+    cache = cache_of(writer, monkeypatch, entries=0, size=history_size(big) + 10)
+    cache.put("a", history("a"))
+    cache.put("big", big)
+    assert "a" not in cache and "big" in cache
+
+    cache.put("huge", history("y" * 5000))
+    assert list(cache._entries) == ["huge"]
+    assert cache.stats()["resident_bytes"] == history_size(cache.peek("huge"))
+
+
+def test_dirty_entry_is_written_back_before_eviction(writer, monkeypatch):
+    cache = cache_of(writer, monkeypatch, entries=1)
+    cache.put("a", history("a"), dirty=True)
+    cache.put("b", history("b"))
+
+    assert writer.writes == [("a", history("a"), False)]
+    assert "a" not in cache and cache.stats()["writebacks"] == 1
+
+
+def test_failed_write_back_keeps_entry_resident(writer, monkeypatch):
+    cache = cache_of(writer, monkeypatch, entries=1)
+    cache.put("a", history("a"), dirty=True)
+    writer.fail = True
+    cache.put("b", history("b"))
+    assert "a" in cache and cache.stats()["writeback_errors"] == 1
+
+    writer.fail = False
+    assert cache.flush() == 1
+    assert writer.writes == [("a", history("a"), False)] and cache.stats()["dirty"] == 0
+
+
+def test_replace_is_kept_until_written_back(writer, monkeypatch):
+    cache = cache_of(writer, monkeypatch)
+    cache.put("a", history("cleared"), dirty=True, replace=True)
+    # A later turn on the cleared session must still supersede the stored history
+    cache.put("a", history("cleared") + history("next"), dirty=True)
+    cache.flush()
+    assert writer.writes == [("a", history("cleared") + history("next"), True)]
+
+
+def test_mark_clean_only_for_the_written_history(writer, monkeypatch):
+    cache = cache_of(writer, monkeypatch)
+    written = history("a")
+    cache.put("a", written, dirty=True)
+    newer = written + history("b")
+    cache.put("a", newer, dirty=True)
+    cache.mark_clean("a", written)
+    assert cache.stats()["dirty"] == 1
+
+    cache.mark_clean("a", newer)
+    assert cache.flush() == 0
+
+
+def test_get_or_load_counts_hits_and_misses(writer, monkeypatch):
+    cache = cache_of(writer, monkeypatch)
+    loads = []
+    loader = lambda session_id: loads.append(session_id) or history(session_id)
+    assert cache.get_or_load("a", loader) == history("a")
+    assert cache.get_or_load("a", loader) == history("a")
+    assert loads == ["a"]
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["hit_rate"] == 0.5
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for full-text search over chat sessions
+"""
+
+import json
+
+import pytest
+
+from session_search import SessionSearchIndex
+from session_store import JSONFileStore, SEQ_KEY
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SessionSearchIndex(str(tmp_path / 'search.db'))
+
+
+def messages(*texts):
+    return [{"role": "user" if seq % 2 else "assistant", "content": text, SEQ_KEY: seq}
+            for seq, text in enumerate(texts, 1)]
+
+
+def ids(results):
+    return [result["id"] for result in results]
+
+
+def test_match_expression_quotes_terms_and_prefixes_the_last():
+    assert SessionSearchIndex.match_expression('sqlite "wal" mod') == '"sqlite" "wal" "mod"*'
+    assert SessionSearchIndex.match_expression('  ?! ') is None
+
+
+def test_best_match_ranks_first_with_one_entry_per_session(index):
+    index.update("passing", messages("we talked about the weather", "and a little about python"))
+    index.update("focused", messages("python python python packaging", "python wheels"))
+
+    results = index.search("python")
+    assert ids(results) == ["focused", "passing"]
+    assert [result["matches"] for result in results] == [2, 1]
+    assert results[0]["seq"] == 1
+
+
+def test_many_matches_in_one_session_do_not_crowd_out_others(index):
+    index.update("chatty", messages(*["deploy the service"] * 50))
+    index.update("s1", messages("how do I deploy"))
+    index.update("s2", messages("deploy failed", "unrelated"))
+
+    results = index.search("deploy", limit=3)
+    assert sorted(ids(results)) == ["chatty", "s1", "s2"]
+    assert next(result for result in results if result["id"] == "chatty")["matches"] == 50
+    assert len(index.search("deploy", limit=2)) == 2
+
+
+def test_snippet_escapes_message_text(index):
+    index.update("s1", messages("try <script>alert('x')</script> in the template"))
+    snippet = index.search("template")[0]["snippet"]
+    assert "<script>" not in snippet and "&lt;script&gt;" in snippet
+    assert "<mark>template</mark>" in snippet
+
+
+def test_appends_are_indexed_and_a_clear_reindexes(index):
+    index.update("s1", messages("first topic"))
+    index.update("s1", messages("first topic", "second topic"))
+    assert index.search("second")[0]["matches"] == 1
+
+    # A shorter history replaced the stored one
+    index.update("s1", messages("brand new"))
+    assert index.search("topic") == []
+    assert ids(index.search("brand")) == ["s1"]
+
+    # replace=True re-indexes even when the new history is as long as the old one
+    index.update("s1", messages("other words"), replace=True)
+    assert index.search("brand") == [] and ids(index.search("other")) == ["s1"]
+
+
+def test_only_user_and_assistant_text_is_indexed(index):
+    index.update("s1", [{"role": "system", "content": "hidden prompt", SEQ_KEY: 1},
+                        {"role": "user", "content": "visible", SEQ_KEY: 2}])
+    assert index.search("hidden") == [] and ids(index.search("visible")) == ["s1"]
+
+
+def test_store_search_builds_the_index_from_existing_sessions(tmp_path):
+    (tmp_path / "chat_history_20240101_000000.json").write_text(json.dumps(messages("kubernetes question")))
+    store = JSONFileStore(str(tmp_path))
+    assert not store.search_index.is_built()
+
+    assert ids(store.search("kubernetes")) == ["20240101_000000"]
+    store.delete("20240101_000000")
+    assert store.search("kubernetes") == []
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Tests for the session storage backends
+"""
+
+import json
+
+import pytest
+
+from session_store import JSONFileStore, SQLiteSessionStore, SessionStore, SEQ_KEY, create_session_store
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'json':
+        store = JSONFileStore(str(tmp_path))
+    else:
+        store = SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+    yield store
+    store.close()
+
+
+def messages(*texts, start=1):
+    return [{"role": "user", "content": text, SEQ_KEY: seq} for seq, text in enumerate(texts, start)]
+
+
+def contents(history):
+    return [message["content"] for message in history]
+
+
+def test_backend_missing_a_method_cannot_be_created():
+    class Partial(SessionStore):
+        def load(self, session_id):
+            return []
+
+    with pytest.raises(TypeError, match="replace_metadata"):
+        Partial()
+
+
+def test_metadata_update_and_replace(store):
+    store.save("s1", messages("a"))
+    store.set_metadata("s1", title="T", pinned=True)
+    store.set_metadata("s1", pinned=False)
+    assert store.get_metadata("s1") == {"title": "T", "pinned": False}
+
+    store.replace_metadata("s1", {"title": "New"})
+    assert store.get_metadata("s1") == {"title": "New"}
+    assert store.list_sessions()[0]["title"] == "New"
+
+    store.delete("s1")
+    assert store.load("s1") == [] and store.get_metadata("s1") == {}
+    assert store.session_ids() == []
+
+
+def log_records(store, session_id):
+    with open(store.log_path(session_id)) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_save_appends_only_new_messages(tmp_path):
+    store = JSONFileStore(str(tmp_path))
+    store.save("s1", messages("a", "b"))
+    store.save("s1", messages("a", "b", "c"))
+    assert contents(log_records(store, "s1")) == ["a", "b", "c"]
+
+    # A fresh store reads the version from the end of the log
+    store = JSONFileStore(str(tmp_path))
+    store.save("s1", messages("a", "b", "c", "d"))
+    assert contents(log_records(store, "s1")) == ["a", "b", "c", "d"]
+
+
+def test_shorter_history_appends_a_reset(tmp_path):
+    store = JSONFileStore(str(tmp_path))
+    store.compact_min_bytes = 0
+    store.save("s1", messages("a", "b", "c"))
+    store.save("s1", messages("x"))
+
+    records = log_records(store, "s1")
+    assert len(records) == 5 and records[3] == {"_op": "reset"}
+    assert contents(store.load("s1")) == ["x"]
+    assert contents(store.load_tail("s1", 10)) == ["x"]
+
+    store.save("s1", messages("x", "y"))
+    assert contents(JSONFileStore(str(tmp_path)).load("s1")) == ["x", "y"]
+    store.compact()
+    assert contents(log_records(store, "s1")) == ["x", "y"]
+
+
+def test_replace_rewrites_the_log(tmp_path):
+    store = JSONFileStore(str(tmp_path))
+    store.save("s1", messages("a", "b"))
+    store.save("s1", messages("x", "y"), replace=True)
+    assert contents(log_records(store, "s1")) == ["x", "y"]
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    store = JSONFileStore(str(tmp_path))
+    store.save("s1", messages("a", "b"))
+    with open(store.log_path("s1"), "a") as f:
+        f.write('{"role": "user", "cont')
+    assert contents(JSONFileStore(str(tmp_path)).load("s1")) == ["a", "b"]
+
+
+def test_legacy_json_is_read_and_converted_on_save(tmp_path):
+    legacy = [{"role": "user", "content": "old"}, {"role": "assistant", "content": "reply"}]
+    (tmp_path / "chat_history_s1.json").write_text(json.dumps(legacy))
+    store = JSONFileStore(str(tmp_path))
+    assert store.load("s1") == legacy
+    assert contents(store.load_tail("s1", 1)) == ["reply"]
+
+    store.save("s1", messages("old", "reply", "new"))
+    assert not (tmp_path / "chat_history_s1.json").exists()
+    assert contents(log_records(store, "s1")) == ["old", "reply", "new"]
+
+
+def test_sqlite_save_appends_and_resets(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    store.save("s1", messages("a", "b"))
+    store.save("s1", messages("a", "b", "c"))
+    assert contents(store.load("s1")) == ["a", "b", "c"]
+    store.save("s1", messages("x"))
+    assert contents(store.load("s1")) == ["x"]
+    assert [message[SEQ_KEY] for message in store.load_tail("s1", 5)] == [1]
+
+
+def test_sqlite_store_imports_legacy_json_sessions(tmp_path, monkeypatch):
+    (tmp_path / "chat_history_s1.json").write_text(json.dumps([{"role": "user", "content": "old"}]))
+    (tmp_path / "chat_metadata_s1.json").write_text(json.dumps({"title": "Old"}))
+    monkeypatch.setenv("SESSION_STORE", "sqlite")
+    monkeypatch.delenv("SESSION_DB_PATH", raising=False)
+    store = create_session_store(str(tmp_path))
+
+    assert isinstance(store, SQLiteSessionStore)
+    assert contents(store.load("s1")) == ["old"]
+    assert store.get_metadata("s1") == {"title": "Old"}
+
+
+def listed_ids(store):
+    return [session["id"] for session in store.list_sessions()]
+
+
+def test_index_follows_the_store_own_changes(tmp_path):
+    store = JSONFileStore(str(tmp_path))
+    store.save("20240101_000000", messages("first question"))
+    store.save("20240102_000000", messages("second"))
+    store.set_metadata("20240102_000000", title="Named")
+    store.delete("20240101_000000")
+
+    assert not store.index.is_stale()
+    assert store.list_sessions()[0]["title"] == "Named"
+    assert listed_ids(store) == ["20240102_000000"]
+
+
+def test_index_rebuilds_after_files_change_behind_its_back(tmp_path):
+    store = JSONFileStore(str(tmp_path))
+    store.save("20240101_000000", messages("a"))
+    assert listed_ids(store) == ["20240101_000000"]
+
+    (tmp_path / "chat_history_20240102_000000.json").write_text(json.dumps([{"role": "user", "content": "b"}]))
+    assert store.index.is_stale()
+    assert listed_ids(store) == ["20240102_000000", "20240101_000000"]
+    assert not store.index.is_stale()
+
+    (tmp_path / "chat_history_20240101_000000.jsonl").unlink()
+    assert listed_ids(store) == ["20240102_000000"]
+
+
+def test_index_catches_up_with_another_store_instance(tmp_path):
+    first, second = JSONFileStore(str(tmp_path)), JSONFileStore(str(tmp_path))
+    first.save("20240101_000000", messages("a"))
+    assert listed_ids(second) == ["20240101_000000"]
+
+    first.save("20240101_000000", messages("a", "b"))
+    first.set_metadata("20240101_000000", title="Renamed")
+    assert not second.index.is_stale()
+    session = second.list_sessions()[0]
+    assert session["title"] == "Renamed" and session["message_count"] == 2
+
+
+def test_pages_cover_every_session_once(store):
+    ids = ["20240101_a", "20240101_b", "20240102_000000", "20240103_000000", "20240104_000000"]
+    for session_id in ids:
+        store.save(session_id, messages(session_id))
+
+    pages, cursor = [], None
+    while True:
+        page, cursor = store.list_sessions_page(2, cursor)
+        pages.append([session["id"] for session in page])
+        if cursor is None:
+            break
+    assert pages == [["20240104_000000", "20240103_000000"], ["20240102_000000", "20240101_b"], ["20240101_a"]]
+    assert store.list_sessions_page(5) == (store.list_sessions(), None)
+
+
+def test_load_tail_pages_backwards_by_sequence(store):
+    store.save("s1", messages(*"abcdef"))
+    assert contents(store.load_tail("s1", 2)) == ["e", "f"]
+    assert contents(store.load_tail("s1", 2, before=5)) == ["c", "d"]
+    assert contents(store.load_tail("s1", 10, before=2)) == ["a"]
+    assert store.load_tail("s1", 0) == []
+
+
+def test_cleared_and_metadata_only_sessions_are_listed(store):
+    store.save("20240101_000000", messages("a", "b"))
+    store.save("20240101_000000", [], replace=True)
+    store.set_metadata("20240102_000000", title="Renamed before chatting")
+    store.save("20240103_000000", messages("hello"))
+
+    sessions = store.list_sessions()
+    assert [session["id"] for session in sessions] == ["20240103_000000", "20240102_000000", "20240101_000000"]
+    assert [session["message_count"] for session in sessions] == [1, 0, 0]
+    assert [session["title"] for session in sessions][1:] == ["Renamed before chatting", "New Chat"]
+    assert sorted(store.session_ids()) == ["20240101_000000", "20240102_000000", "20240103_000000"]
+    if isinstance(store, JSONFileStore):
+        # The same listing when the index is rebuilt from the files
+        summary = lambda listing: [(s["id"], s["title"], s["message_count"]) for s in listing]
+        store.index.rebuild()
+        assert summary(store.list_sessions()) == summary(sessions)
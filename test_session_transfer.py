@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for NDJSON session export and import
+"""
+
+import io
+import json
+
+import pytest
+
+from session_store import JSONFileStore, SQLiteSessionStore, SEQ_KEY
+from session_transfer import SessionImporter, export_lines, gzip_chunks, read_lines, validate_record
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'json':
+        store = JSONFileStore(str(tmp_path))
+    else:
+        store = SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+    yield store
+    store.close()
+
+
+def line(session_id, *texts, **metadata):
+    history = [{"role": "user", "content": text} for text in texts]
+    return json.dumps({"session_id": session_id, "history": history, "metadata": metadata}).encode()
+
+
+def run(store, lines, **options):
+    *progress, final = SessionImporter(store, **options).run(lines)
+    return final
+
+
+def contents(store, session_id):
+    return [message["content"] for message in store.load(session_id)]
+
+
+@pytest.mark.parametrize("record, reason", [
+    ([], "JSON object"),
+    ({"session_id": "../etc", "history": []}, "session_id"),
+    ({"session_id": "s1", "history": {}}, "list"),
+    ({"session_id": "s1", "history": [{"role": "tool", "content": "x"}]}, "role"),
+    ({"session_id": "s1", "history": [{"role": "user", "content": 1}]}, "string content"),
+    ({"session_id": "s1", "history": [], "metadata": "title"}, "metadata"),
+])
+def test_validate_record_rejects_malformed_lines(record, reason):
+    with pytest.raises(ValueError, match=reason):
+        validate_record(record)
+
+
+def test_validate_record_numbers_messages():
+    _, history, metadata = validate_record(json.loads(line("s1", "a", "b")))
+    assert [message[SEQ_KEY] for message in history] == [1, 2]
+    assert metadata == {}
+
+
+def test_import_skips_invalid_lines_and_existing_sessions(store):
+    store.save("s1", [{"role": "user", "content": "kept", SEQ_KEY: 1}])
+    final = run(store, [line("s1", "imported"), b"not json", b"", line("s2", "new", title="T")])
+
+    assert final["imported"] == 1 and final["skipped"] == 1 and final["invalid"] == 1
+    assert final["errors"][0]["line"] == 2
+    assert contents(store, "s1") == ["kept"]
+    assert contents(store, "s2") == ["new"]
+    assert store.get_metadata("s2") == {"title": "T"}
+
+
+def test_replace_supersedes_history_and_metadata(store):
+    store.save("s1", [{"role": "user", "content": text, SEQ_KEY: seq} for seq, text in enumerate("abc", 1)])
+    store.set_metadata("s1", title="Old", pinned=True)
+    final = run(store, [line("s1", "x", title="New")], replace=True)
+
+    assert final["imported"] == 1
+    assert contents(store, "s1") == ["x"]
+    assert store.get_metadata("s1") == {"title": "New"}
+
+
+def test_failed_replace_keeps_stored_sessions(store, monkeypatch):
+    store.save("s1", [{"role": "user", "content": "stored", SEQ_KEY: 1}])
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    # Fails while writing the new data: whatever was stored must still be there
+    monkeypatch.setattr(store, "_rewrite" if isinstance(store, JSONFileStore) else "_replace_metadata", fail)
+    final = run(store, [line("s1", "replacement", title="New")], replace=True)
+
+    assert final["failed"] == 1 and final["imported"] == 0
+    assert contents(store, "s1") == ["stored"]
+
+
+def test_export_round_trips_through_gzip(store, tmp_path):
+    store.save("20240101_000000", [{"role": "user", "content": "hello", SEQ_KEY: 1}])
+    store.set_metadata("20240101_000000", title="Greeting")
+    exported = b"".join(gzip_chunks(export_lines(store, store.load)))
+
+    target = SQLiteSessionStore(str(tmp_path / "target.db"))
+    final = run(target, read_lines(io.BytesIO(exported)))
+    assert final["imported"] == 1
+    assert contents(target, "20240101_000000") == ["hello"]
+    assert target.get_metadata("20240101_000000") == {"title": "Greeting"}
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for request coalescing and per-session turn locks
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from single_flight import AsyncSessionLocks, FlightAbandoned, SingleFlight
+
+
+def test_async_follower_gets_result_from_thread_leader():
+    flights = SingleFlight()
+
+    async def follow():
+        flight, leader = flights.join('k')
+        assert not leader
+        return await flight.wait_async(5)
+
+    flight, leader = flights.join('k')
+    assert leader
+    threading.Timer(0.05, flights.complete, args=('k', flight, 'answer')).start()
+    assert asyncio.run(follow()) == 'answer'
+
+
+def test_async_follower_sees_abandon_and_timeout():
+    flights = SingleFlight()
+    flight, _ = flights.join('k')
+
+    async def follow(timeout):
+        return await flights.join('k')[0].wait_async(timeout)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(follow(0.01))
+    assert not flight._waiters
+
+    flights.abandon('k', flight)
+    with pytest.raises(FlightAbandoned):
+        asyncio.run(flight.wait_async(1))
+
+
+def test_async_session_locks_serialize_one_session():
+    locks = AsyncSessionLocks()
+    order = []
+
+    async def turn(session_id, name):
+        async with locks.hold(session_id):
+            order.append((name, 'start'))
+            await asyncio.sleep(0.01)
+            order.append((name, 'end'))
+
+    async def main():
+        await asyncio.gather(turn('s1', 'a'), turn('s1', 'b'), turn('s2', 'c'))
+
+    asyncio.run(main())
+    s1 = [step for step in order if step[0] != 'c']
+    assert s1 in ([('a', 'start'), ('a', 'end'), ('b', 'start'), ('b', 'end')],
+                  [('b', 'start'), ('b', 'end'), ('a', 'start'), ('a', 'end')])
+    assert order.index(('c', 'start')) < order.index(('a', 'end'))
+    assert not locks._locks and not locks._users
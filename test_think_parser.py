@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Tests for the incremental <think> tag parser
+"""
+
+import random
+
+from think_parser import ThinkStreamParser, split_thinking, THINKING, ANSWER
+
+SAMPLES = [
+    "<think>Let me reason about this.</think>\n\nThe answer is 42.",
+    "No reasoning here, just an answer.",
+    "<think>step 1\nstep 2</think>Answer with a < sign and </thin text.",
+    "Intro <think>first</think> middle <think>second</think> end",
+    "<think></think>Empty thinking block",
+    "a<b<th<thin<think>x</th</thi</think>y<",
+]
+
+
+def run_chunks(chunks, start_in_thinking=False):
+    """Feed chunks through a parser and collect text per channel"""
+    parser = ThinkStreamParser(start_in_thinking=start_in_thinking)
+    collected = {THINKING: [], ANSWER: []}
+    for chunk in chunks:
+        for channel, text in parser.feed(chunk):
+            collected[channel].append(text)
+    for channel, text in parser.flush():
+        collected[channel].append(text)
+    return parser, ''.join(collected[THINKING]), ''.join(collected[ANSWER])
+
+
+def reference_split(content):
+    """Whole-buffer split used as the oracle for chunked parsing"""
+    return run_chunks([content])
+
+
+def test_basic_split():
+    thinking, answer = split_thinking(SAMPLES[0])
+    assert thinking == "Let me reason about this."
+    assert answer == "The answer is 42."
+
+
+def test_no_tags_is_all_answer():
+    parser, thinking, answer = run_chunks([SAMPLES[1]])
+    assert thinking == ''
+    assert answer == SAMPLES[1]
+    assert parser.thinking == ''
+
+
+def test_every_two_way_split_point():
+    for content in SAMPLES:
+        _, expected_thinking, expected_answer = reference_split(content)
+        for i in range(len(content) + 1):
+            _, thinking, answer = run_chunks([content[:i], content[i:]])
+            assert (thinking, answer) == (expected_thinking, expected_answer), (content, i)
+
+
+def test_single_character_chunks():
+    for content in SAMPLES:
+        _, expected_thinking, expected_answer = reference_split(content)
+        _, thinking, answer = run_chunks(list(content))
+        assert (thinking, answer) == (expected_thinking, expected_answer), content
+
+
+def test_random_chunkings():
+    rng = random.Random(1234)
+    for content in SAMPLES:
+        _, expected_thinking, expected_answer = reference_split(content)
+        for _ in range(200):
+            chunks, pos = [], 0
+            while pos < len(content):
+                size = rng.randint(0, 9)
+                chunks.append(content[pos:pos + size])
+                pos += size
+            _, thinking, answer = run_chunks(chunks)
+            assert (thinking, answer) == (expected_thinking, expected_answer), chunks
+
+
+def test_tags_never_leak_into_channels():
+    content = "<think>plan</think>done"
+    for i in range(1, len(content)):
+        for j in range(i, len(content)):
+            _, thinking, answer = run_chunks([content[:i], content[i:j], content[j:]])
+            assert '<' not in thinking + answer
+            assert (thinking, answer) == ("plan", "done")
+
+
+def test_partial_tag_at_end_of_stream_is_literal():
+    parser, thinking, answer = run_chunks(["answer ends with <thi"])
+    assert answer == "answer ends with <thi"
+    assert parser.answer == "answer ends with <thi"
+
+
+def test_held_back_prefix_is_bounded():
+    parser = ThinkStreamParser()
+    segments = parser.feed("x" * 1000 + "</thin")
+    assert segments == [(ANSWER, "x" * 1000)]
+    assert len(parser._pending) == len("</thin")
+
+
+def test_multiple_blocks_are_joined():
+    thinking, answer = split_thinking(SAMPLES[3])
+    assert thinking == "firstsecond"
+    assert answer == "Intro  middle  end"
+
+
+def test_implicit_opening_tag():
+    # Thinking models whose template already opened the block only emit </think>
+    content = "reasoning goes here</think>\n\nFinal answer."
+    for i in range(len(content) + 1):
+        parser, thinking, answer = run_chunks([content[:i], content[i:]], start_in_thinking=True)
+        assert thinking == "reasoning goes here"
+        assert answer.strip() == "Final answer."
+        assert parser.thinking == "reasoning goes here"
+        assert parser.answer == "Final answer."
+
+
+def test_implicit_opening_tag_with_explicit_tag():
+    thinking, answer = split_thinking("<think>why</think>because", start_in_thinking=True)
+    assert (thinking, answer) == ("why", "because")
+
+
+def test_implicit_opening_tag_never_closed_falls_back_to_answer():
+    thinking, answer = split_thinking("model skipped reasoning entirely", start_in_thinking=True)
+    assert thinking == ''
+    assert answer == "model skipped reasoning entirely"
+
+
+if __name__ == '__main__':
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n{len(tests)} tests passed")
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Tests for the history token budget and history selection
+"""
+
+from token_budget import TokenCounter, history_tokens, reply_tokens, select_history
+
+
+def test_reply_reserve_is_capped_at_half_the_window():
+    assert reply_tokens(8192, 8192) == 4096
+    assert reply_tokens(65536, 8192) == 8192
+    # An unlisted model at the default settings: max_tokens equals the window
+    assert history_tokens(8192, 500, 8192, 256) == 8192 - 500 - 4096 - 256
+    assert history_tokens(65536, 500, 8192, 256) == 65536 - 500 - 8192 - 256
+    assert history_tokens(8192, 9000, 1024) == 0
+
+
+def test_select_history_keeps_newest_messages_within_budget():
+    counter = TokenCounter()
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": "x" * 40} for i in range(6)]
+    per_message = counter.message_tokens(dict(history[0]))
+
+    window = select_history(history, per_message * 3, counter)
+    # Three would fit, but the window must not open on an assistant reply
+    assert window == history[4:]
+    assert select_history(history, 0, counter) == history[-1:]
+    assert select_history(history, 10 ** 6, counter, max_messages=4) == history[2:]
+
+
+def test_message_counts_are_not_stored_on_messages():
+    counter = TokenCounter()
+    message = {"role": "user", "content": "hello there"}
+    tokens = counter.message_tokens(message)
+    assert message == {"role": "user", "content": "hello there"}
+    assert counter.message_tokens({"role": "assistant", "content": "hello there"}) == tokens
+    assert counter.message_tokens({"role": "user", "content": "hello there, again"}) > tokens
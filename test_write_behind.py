@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for the write-behind session queue
+"""
+
+import pytest
+
+from session_store import JSONFileStore, SQLiteSessionStore, SEQ_KEY
+from write_behind import WriteBehindQueue
+
+
+def turn(*texts):
+    return [{"role": "user", "content": text, SEQ_KEY: seq} for seq, text in enumerate(texts, 1)]
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'json':
+        store = JSONFileStore(str(tmp_path))
+    else:
+        store = SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+    yield store
+    store.close()
+
+
+class RecordingStore:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def save_many(self, sessions, replace=()):
+        if self.fail:
+            raise OSError("disk full")
+        self.calls.append(([(session_id, list(history)) for session_id, history in sessions], set(replace)))
+
+
+def test_merged_saves_write_once():
+    recorder = RecordingStore()
+    queue = WriteBehindQueue(recorder.save_many)
+    history = turn("a")
+    queue.submit('s1', history)
+    history.extend(turn("a", "b")[1:])
+    queue.submit('s1', history)
+    queue.submit('s2', turn("x"))
+
+    assert queue.flush() == 2
+    assert queue.flush() == 0
+    [(sessions, replace)] = recorder.calls
+    assert dict(sessions) == {'s1': turn("a", "b"), 's2': turn("x")}
+    assert replace == set()
+
+
+def test_clear_merged_with_next_turn_still_replaces():
+    recorder = RecordingStore()
+    queue = WriteBehindQueue(recorder.save_many)
+    queue.submit('s1', [], replace=True)
+    queue.submit('s1', turn("new"))
+    queue.flush()
+    assert recorder.calls == [([('s1', turn("new"))], {'s1'})]
+
+
+def test_failed_clear_keeps_replacing_after_newer_save():
+    recorder = RecordingStore(fail=True)
+    queue = WriteBehindQueue(recorder.save_many)
+    queue.submit('s1', [], replace=True)
+    queue.flush()
+    assert queue.stats()["errors"] == 1 and queue.stats()["pending"] == 1
+
+    recorder.fail = False
+    queue.submit('s1', turn("new"))
+    queue.flush()
+    assert recorder.calls == [([('s1', turn("new"))], {'s1'})]
+
+
+def test_write_now_takes_over_queued_clear():
+    recorder = RecordingStore()
+    queue = WriteBehindQueue(recorder.save_many)
+    queue.submit('s1', [], replace=True)
+    queue.write_now('s1', turn("new"))
+    assert recorder.calls == [([('s1', turn("new"))], {'s1'})]
+    assert queue.flush() == 0
+
+
+def test_clear_then_new_turn_reaches_store(store):
+    store.rebuild_search_index()  # Index saves incrementally from here on
+    store.save('s1', turn("old question", "old answer"))
+    queue = WriteBehindQueue(store.save_many)
+    queue.submit('s1', [], replace=True)
+    queue.submit('s1', turn("new question", "new answer"))
+    queue.flush()
+
+    assert store.load('s1') == turn("new question", "new answer")
+    assert [hit['id'] for hit in store.search('new')] == ['s1']
+    assert store.search('old') == []
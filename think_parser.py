@@ -0,0 +1,127 @@
+"""
+Incremental parser that splits streamed model output into thinking and answer channels
+"""
+
+from typing import List, Tuple
+
+THINK_OPEN_TAG = '<think>'
+THINK_CLOSE_TAG = '</think>'
+
+THINKING = 'thinking'
+ANSWER = 'answer'
+
+_TAGS = (THINK_OPEN_TAG, THINK_CLOSE_TAG)
+_MAX_PARTIAL = max(len(tag) for tag in _TAGS) - 1
+
+
+class ThinkStreamParser:
+    """
+    Stateful splitter for <think>...</think> reasoning in a token stream
+
+    Chunks are scanned once: only a possible partial tag (at most a few
+    characters) is carried over to the next chunk, so the accumulated output
+    is never rescanned. An opening tag switches to the thinking channel and
+    a closing tag switches back to the answer channel; redundant tags are
+    dropped rather than shown to the user.
+    """
+
+    def __init__(self, start_in_thinking: bool = False):
+        # Some thinking models put the opening tag in the prompt template and
+        # only ever emit the closing tag, so the stream starts mid-thought
+        self.start_in_thinking = start_in_thinking
+        self.in_thinking = start_in_thinking
+        self.saw_close_tag = False
+        self._pending = ''
+        self._thinking_parts: List[str] = []
+        self._answer_parts: List[str] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """Consume a chunk and return (channel, text) segments ready to emit"""
+        if not chunk:
+            return []
+
+        text = self._pending + chunk
+        self._pending = ''
+        segments: List[Tuple[str, str]] = []
+        pos = 0
+
+        while True:
+            open_idx = text.find(THINK_OPEN_TAG, pos)
+            close_idx = text.find(THINK_CLOSE_TAG, pos)
+            if open_idx == -1 and close_idx == -1:
+                break
+
+            # Take whichever tag comes first
+            if close_idx == -1 or (open_idx != -1 and open_idx < close_idx):
+                tag_idx, tag = open_idx, THINK_OPEN_TAG
+            else:
+                tag_idx, tag = close_idx, THINK_CLOSE_TAG
+
+            self._emit(segments, text[pos:tag_idx])
+            if tag == THINK_OPEN_TAG:
+                self.in_thinking = True
+            else:
+                self.in_thinking = False
+                self.saw_close_tag = True
+            pos = tag_idx + len(tag)
+
+        # Hold back a trailing fragment that could be the start of a tag
+        hold = self._partial_tag_length(text, pos)
+        end = len(text) - hold
+        self._emit(segments, text[pos:end])
+        self._pending = text[end:]
+        return segments
+
+    def flush(self) -> List[Tuple[str, str]]:
+        """Emit any held-back text once the stream has ended"""
+        segments: List[Tuple[str, str]] = []
+        pending, self._pending = self._pending, ''
+        self._emit(segments, pending)
+        return segments
+
+    @property
+    def thinking(self) -> str:
+        """All thinking text seen so far"""
+        if self._implicit_thinking_unclosed():
+            return ''
+        return ''.join(self._thinking_parts).strip()
+
+    @property
+    def answer(self) -> str:
+        """All answer text seen so far"""
+        if self._implicit_thinking_unclosed():
+            # The model never left the implicit thinking block, so what it
+            # produced is the answer after all
+            return ''.join(self._thinking_parts + self._answer_parts).strip()
+        return ''.join(self._answer_parts).strip()
+
+    def _implicit_thinking_unclosed(self) -> bool:
+        return self.start_in_thinking and not self.saw_close_tag
+
+    def _emit(self, segments: List[Tuple[str, str]], text: str):
+        if not text:
+            return
+        channel = THINKING if self.in_thinking else ANSWER
+        (self._thinking_parts if self.in_thinking else self._answer_parts).append(text)
+        if segments and segments[-1][0] == channel:
+            segments[-1] = (channel, segments[-1][1] + text)
+        else:
+            segments.append((channel, text))
+
+    @staticmethod
+    def _partial_tag_length(text: str, start: int) -> int:
+        """Length of the longest suffix of text[start:] that is a proper prefix of a tag"""
+        longest = min(_MAX_PARTIAL, len(text) - start)
+        for length in range(longest, 0, -1):
+            suffix = text[len(text) - length:]
+            if any(tag.startswith(suffix) for tag in _TAGS):
+                return length
+        return 0
+
+
+def split_thinking(content: str, start_in_thinking: bool = False) -> Tuple[str, str]:
+    """Split a complete response into (thinking, answer)"""
+    parser = ThinkStreamParser(start_in_thinking=start_in_thinking)
+    parser.feed(content)
+    parser.flush()
+    return parser.thinking, parser.answer
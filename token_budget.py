@@ -0,0 +1,125 @@
+"""
+Token counting and token-budget-based conversation history selection
+"""
+
+import os
+import math
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Fallback estimate when no tokenizer is installed
+CHARS_PER_TOKEN = float(os.environ.get('CHARS_PER_TOKEN', 4))
+
+# Role markers and separators the chat template adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Message token counts remembered, keyed by content hash (LRU)
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get('TOKEN_COUNT_CACHE_SIZE', 100000))
+
+
+class TokenCounter:
+    """
+    Counts tokens with tiktoken when available, otherwise by character estimate
+
+    Message counts are remembered by content hash rather than stored on the
+    message, so they stay out of the session data and are never reused by
+    a counter with a different tokenizer.
+    """
+
+    def __init__(self):
+        self._counts: 'OrderedDict[bytes, int]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.encoding = None
+        if TIKTOKEN_AVAILABLE:
+            try:
+                # Cerebras models use their own tokenizers; cl100k is a close, slightly
+                # conservative stand-in for budgeting purposes
+                self.encoding = tiktoken.get_encoding(os.environ.get('TOKENIZER_ENCODING', 'cl100k_base'))
+            except Exception as e:
+                logging.warning(f"Failed to load tiktoken encoding, estimating tokens from length: {e}")
+
+    def count(self, text: Optional[str]) -> int:
+        """Count tokens in a piece of text"""
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def message_tokens(self, message: Dict) -> int:
+        """Token count for a history message, computed once per distinct content"""
+        content = message.get('content') or ''
+        key = hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+        with self._lock:
+            tokens = self._counts.get(key)
+            if tokens is not None:
+                self._counts.move_to_end(key)
+                return tokens
+        tokens = self.count(content) + MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            self._counts[key] = tokens
+            while len(self._counts) > TOKEN_COUNT_CACHE_SIZE:
+                self._counts.popitem(last=False)
+        return tokens
+
+
+def reply_tokens(context_window: int, max_tokens: int) -> int:
+    """
+    Tokens reserved for the reply, which is also the max_tokens to request
+
+    At most half the window, so a max_tokens as large as the window (an
+    unlisted model at the default settings) still leaves room for recent
+    turns and the request never exceeds the window.
+    """
+    return min(max_tokens, context_window // 2)
+
+
+def history_tokens(context_window: int, prompt_tokens: int, max_tokens: int, margin: int = 0) -> int:
+    """Tokens left for conversation history in a model's context window"""
+    reserved = prompt_tokens + reply_tokens(context_window, max_tokens) + margin
+    return max(0, context_window - reserved)
+
+
+def select_history(history: List[Dict], budget: int, counter: 'TokenCounter',
+                   max_messages: int = 0) -> List[Dict]:
+    """
+    Pick the most recent messages that fit in the token budget
+
+    Walks the history from newest to oldest and stops at the first message
+    that no longer fits, so the oldest turns are dropped first. The newest
+    message is always kept. max_messages (0 = unlimited) caps the count as
+    well.
+    """
+    selected = []
+    used = 0
+    for message in reversed(history):
+        if max_messages and len(selected) >= max_messages:
+            break
+        tokens = counter.message_tokens(message)
+        if selected and used + tokens > budget:
+            break
+        selected.append(message)
+        used += tokens
+    selected.reverse()
+
+    # Don't open the window mid-exchange with an orphaned assistant reply
+    while len(selected) > 1 and selected[0].get('role') == 'assistant':
+        used -= counter.message_tokens(selected.pop(0))
+
+    dropped = len(history) - len(selected)
+    if dropped:
+        logging.info(f"History budget: kept {len(selected)} messages ({used} tokens), dropped {dropped} oldest")
+    return selected
+
+
+# Global token counter instance
+token_counter = TokenCounter()
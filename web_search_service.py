@@ -3,6 +3,7 @@ Web Search Service with Exa (primary) and Brave Search (fallback)
 """
 
 import os
+import asyncio
 import logging
 from typing import List, Dict, Any, Optional
 import requests
@@ -15,6 +16,22 @@ except ImportError:
     EXA_AVAILABLE = False
     logging.warning("exa-py not installed. Exa search will be disabled.")
 
+# Async clients used by the ASGI serving path (asgi_app.py)
+try:
+    from exa_py import AsyncExa
+    ASYNC_EXA_AVAILABLE = True
+except ImportError:
+    ASYNC_EXA_AVAILABLE = False
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+# Brave Search API endpoint
+BRAVE_SEARCH_URL = "https://api.search.brave.com/res/v1/web/search"
+
 class WebSearchService:
     """Web search service with Exa as primary and Brave as fallback"""
     
@@ -45,6 +62,10 @@ class WebSearchService:
             except Exception as e:
                 logging.error(f"Failed to initialize Exa: {e}")
                 self.exa_client = None
+
+        # Async clients are created lazily on first use from the event loop
+        self.async_exa_client = None
+        self.async_http_client = None
         
         # Log availability
         if self.is_available():
@@ -83,73 +104,79 @@ class WebSearchService:
             request_count = min(num_results * self.diversity_multiplier, 20)  # Cap at 20 for API limits
 
             # Use search_and_contents to get both results and full text
-            result = self.exa_client.search_and_contents(
-                query,
-                type="auto",  # Let Exa decide between neural and keyword
-                num_results=request_count,
-                text=True if self.include_text else False,
-                use_autoprompt=True,  # Let Exa optimize the query
-                # Add parameters for better diversity
-                start_published_date=None,  # No date restriction for broader results
-                category=None,  # No category restriction
-            )
+            result = self.exa_client.search_and_contents(query, **self._exa_search_kwargs(request_count))
 
-            # Format and deduplicate results by domain
-            formatted_results = []
-            seen_domains = []  # Track domains in order to count duplicates
-            domain_stats = {}  # Track statistics per domain
-
-            for item in result.results:
-                # Extract domain from URL for diversity checking
-                try:
-                    from urllib.parse import urlparse
-                    domain = urlparse(item.url).netloc
-                    # Remove 'www.' prefix for better matching
-                    domain = domain.replace('www.', '')
-                except:
-                    domain = item.url
-
-                # Skip if we already have too many results from this domain (for diversity)
-                # Allow configurable results per domain for high-quality sources
-                domain_count = sum(1 for d in seen_domains if d == domain)
-                if domain_count >= self.max_per_domain:
-                    logging.debug(f"Skipping duplicate domain: {domain} (already have {domain_count} results)")
-                    continue
+            return self._format_exa_results(result, num_results)
 
-                formatted_result = {
-                    'title': item.title,
-                    'url': item.url,
-                    'snippet': item.text[:500] if hasattr(item, 'text') and item.text else '',
-                    'text': item.text[:self.text_length] if hasattr(item, 'text') and item.text else '',
-                    'score': item.score if hasattr(item, 'score') else None,
-                    'published_date': item.published_date if hasattr(item, 'published_date') else None,
-                    'author': item.author if hasattr(item, 'author') else None,
-                    'source': 'exa',
-                    'domain': domain
-                }
-                formatted_results.append(formatted_result)
-                seen_domains.append(domain)
+        except Exception as e:
+            logging.error(f"Exa search failed: {e}")
+            return None
+    
+    def _exa_search_kwargs(self, request_count: int) -> Dict[str, Any]:
+        return dict(
+            type="auto",  # Let Exa decide between neural and keyword
+            num_results=request_count,
+            text=True if self.include_text else False,
+            use_autoprompt=True,  # Let Exa optimize the query
+            # Add parameters for better diversity
+            start_published_date=None,  # No date restriction for broader results
+            category=None,  # No category restriction
+        )
 
-                # Track domain statistics
-                domain_stats[domain] = domain_stats.get(domain, 0) + 1
+    def _format_exa_results(self, result, num_results: int) -> List[Dict[str, Any]]:
+        """Format Exa results, keeping at most max_per_domain results per domain"""
+        # Format and deduplicate results by domain
+        formatted_results = []
+        seen_domains = []  # Track domains in order to count duplicates
+        domain_stats = {}  # Track statistics per domain
 
-                # Stop once we have enough diverse results
-                if len(formatted_results) >= num_results:
-                    break
+        for item in result.results:
+            # Extract domain from URL for diversity checking
+            try:
+                from urllib.parse import urlparse
+                domain = urlparse(item.url).netloc
+                # Remove 'www.' prefix for better matching
+                domain = domain.replace('www.', '')
+            except:
+                domain = item.url
 
-            # Log diversity statistics
-            unique_domains = len(set(seen_domains))
-            logging.info(f"Exa returned {len(formatted_results)} diverse results from {unique_domains} different sources")
-            if domain_stats:
-                top_domains = sorted(domain_stats.items(), key=lambda x: x[1], reverse=True)[:3]
-                logging.info(f"Top sources: {', '.join([f'{d}({c})' for d, c in top_domains])}")
+            # Skip if we already have too many results from this domain (for diversity)
+            # Allow configurable results per domain for high-quality sources
+            domain_count = sum(1 for d in seen_domains if d == domain)
+            if domain_count >= self.max_per_domain:
+                logging.debug(f"Skipping duplicate domain: {domain} (already have {domain_count} results)")
+                continue
 
-            return formatted_results
+            formatted_result = {
+                'title': item.title,
+                'url': item.url,
+                'snippet': item.text[:500] if hasattr(item, 'text') and item.text else '',
+                'text': item.text[:self.text_length] if hasattr(item, 'text') and item.text else '',
+                'score': item.score if hasattr(item, 'score') else None,
+                'published_date': item.published_date if hasattr(item, 'published_date') else None,
+                'author': item.author if hasattr(item, 'author') else None,
+                'source': 'exa',
+                'domain': domain
+            }
+            formatted_results.append(formatted_result)
+            seen_domains.append(domain)
+
+            # Track domain statistics
+            domain_stats[domain] = domain_stats.get(domain, 0) + 1
+
+            # Stop once we have enough diverse results
+            if len(formatted_results) >= num_results:
+                break
+
+        # Log diversity statistics
+        unique_domains = len(set(seen_domains))
+        logging.info(f"Exa returned {len(formatted_results)} diverse results from {unique_domains} different sources")
+        if domain_stats:
+            top_domains = sorted(domain_stats.items(), key=lambda x: x[1], reverse=True)[:3]
+            logging.info(f"Top sources: {', '.join([f'{d}({c})' for d, c in top_domains])}")
+
+        return formatted_results
 
-        except Exception as e:
-            logging.error(f"Exa search failed: {e}")
-            return None
-    
     def search_with_brave(self, query: str, num_results: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
         """Search using Brave Search API"""
         if not self.brave_api_key or not self.brave_enabled:
@@ -160,41 +187,15 @@ class WebSearchService:
         try:
             logging.info(f"Searching with Brave: '{query}'")
             
-            # Brave Search API endpoint
-            url = "https://api.search.brave.com/res/v1/web/search"
-            headers = {
-                "Accept": "application/json",
-                "Accept-Encoding": "gzip",
-                "X-Subscription-Token": self.brave_api_key
-            }
-            params = {
-                "q": query,
-                "count": num_results,
-                "text_decorations": False,
-                "search_lang": "en"
-            }
-            
-            response = requests.get(url, headers=headers, params=params, timeout=10)
+            response = requests.get(
+                BRAVE_SEARCH_URL,
+                headers=self._brave_headers(),
+                params=self._brave_params(query, num_results),
+                timeout=10
+            )
             response.raise_for_status()
             
-            data = response.json()
-            
-            # Format results
-            formatted_results = []
-            if 'web' in data and 'results' in data['web']:
-                for item in data['web']['results']:
-                    formatted_result = {
-                        'title': item.get('title', ''),
-                        'url': item.get('url', ''),
-                        'snippet': item.get('description', ''),
-                        'text': item.get('description', '')[:self.text_length],
-                        'score': None,
-                        'published_date': item.get('age', None),
-                        'author': None,
-                        'source': 'brave'
-                    }
-                    formatted_results.append(formatted_result)
-            
+            formatted_results = self._format_brave_results(response.json())
             logging.info(f"Brave returned {len(formatted_results)} results")
             return formatted_results
             
@@ -202,6 +203,39 @@ class WebSearchService:
             logging.error(f"Brave search failed: {e}")
             return None
     
+    def _brave_headers(self) -> Dict[str, str]:
+        return {
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip",
+            "X-Subscription-Token": self.brave_api_key
+        }
+
+    def _brave_params(self, query: str, num_results: int) -> Dict[str, Any]:
+        return {
+            "q": query,
+            "count": num_results,
+            "text_decorations": False,
+            "search_lang": "en"
+        }
+
+    def _format_brave_results(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Format a Brave Search API response"""
+        formatted_results = []
+        if 'web' in data and 'results' in data['web']:
+            for item in data['web']['results']:
+                formatted_result = {
+                    'title': item.get('title', ''),
+                    'url': item.get('url', ''),
+                    'snippet': item.get('description', ''),
+                    'text': item.get('description', '')[:self.text_length],
+                    'score': None,
+                    'published_date': item.get('age', None),
+                    'author': None,
+                    'source': 'brave'
+                }
+                formatted_results.append(formatted_result)
+        return formatted_results
+
     def search(self, query: str, num_results: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Search with Exa as primary, Brave as fallback
@@ -226,6 +260,94 @@ class WebSearchService:
         
         return results
     
+    # ------------------------------------------------------------------
+    # Async variants used by the ASGI serving path
+    # ------------------------------------------------------------------
+
+    def _get_async_exa(self):
+        if self.async_exa_client is None and ASYNC_EXA_AVAILABLE and self.exa_client:
+            try:
+                self.async_exa_client = AsyncExa(self.exa_api_key)
+            except Exception as e:
+                logging.error(f"Failed to initialize async Exa client: {e}")
+        return self.async_exa_client
+
+    def _get_async_http(self):
+        if self.async_http_client is None and HTTPX_AVAILABLE:
+            self.async_http_client = httpx.AsyncClient(timeout=10)
+        return self.async_http_client
+
+    async def async_search_with_exa(self, query: str, num_results: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """Async Exa search; falls back to a worker thread if the async SDK is unavailable"""
+        if not self.exa_client:
+            return None
+
+        async_exa = self._get_async_exa()
+        if async_exa is None:
+            return await asyncio.to_thread(self.search_with_exa, query, num_results)
+
+        num_results = num_results or self.max_results
+
+        try:
+            logging.info(f"Searching with Exa (async): '{query}'")
+            request_count = min(num_results * self.diversity_multiplier, 20)  # Cap at 20 for API limits
+            result = await async_exa.search_and_contents(query, **self._exa_search_kwargs(request_count))
+            return self._format_exa_results(result, num_results)
+        except Exception as e:
+            logging.error(f"Exa search failed: {e}")
+            return None
+
+    async def async_search_with_brave(self, query: str, num_results: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """Async Brave search; falls back to a worker thread if httpx is unavailable"""
+        if not self.brave_api_key or not self.brave_enabled:
+            return None
+
+        http = self._get_async_http()
+        if http is None:
+            return await asyncio.to_thread(self.search_with_brave, query, num_results)
+
+        num_results = num_results or self.max_results
+
+        try:
+            logging.info(f"Searching with Brave (async): '{query}'")
+            response = await http.get(
+                BRAVE_SEARCH_URL,
+                headers=self._brave_headers(),
+                params=self._brave_params(query, num_results)
+            )
+            response.raise_for_status()
+
+            formatted_results = self._format_brave_results(response.json())
+            logging.info(f"Brave returned {len(formatted_results)} results")
+            return formatted_results
+        except Exception as e:
+            logging.error(f"Brave search failed: {e}")
+            return None
+
+    async def async_search(self, query: str, num_results: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Async counterpart of search(): Exa first, Brave as fallback"""
+        if not self.is_available():
+            logging.warning("Web search not available")
+            return []
+
+        results = await self.async_search_with_exa(query, num_results)
+
+        if results is None:
+            logging.info("Falling back to Brave search")
+            results = await self.async_search_with_brave(query, num_results)
+
+        if results is None:
+            logging.error("All search providers failed")
+            return []
+
+        return results
+
+    async def aclose(self):
+        """Close async HTTP clients"""
+        if self.async_http_client is not None:
+            await self.async_http_client.aclose()
+            self.async_http_client = None
+
     def get_answer_from_exa(self, query: str) -> Optional[str]:
         """Get a direct answer from Exa (streaming)"""
         if not self.exa_client:
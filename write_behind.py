@@ -0,0 +1,175 @@
+"""
+Write-behind persistence: sessions are saved by a background writer in batches
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class WriteBehindQueue:
+    """
+    Optional queue that takes session saves off the request path
+
+    A save records the session as pending and returns. A background thread
+    flushes pending sessions at least once per durability window, or sooner
+    when a full batch is waiting, handing each batch to the store as one
+    group commit. Saving a session that is already pending replaces the
+    queued history, so a burst of turns costs one write. A save that
+    replaces the history (a clear) stays marked as a replacement when later
+    saves are merged into it, so the store never mistakes the new messages
+    for ones it already has. Writes are serialized, so a session is never
+    written out of order.
+    """
+
+    def __init__(self,
+                 save_many: Callable[..., None],
+                 on_written: Optional[Callable[[str, List[Dict]], None]] = None):
+        self.save_many = save_many
+        self.on_written = on_written
+        self.enabled = os.environ.get('SESSION_WRITE_BEHIND', 'false').lower() == 'true'
+        self.window = float(os.environ.get('SESSION_WRITE_BEHIND_WINDOW', 1.0))  # Seconds
+        self.batch_size = int(os.environ.get('SESSION_WRITE_BEHIND_BATCH', 64))  # Sessions per flush
+
+        # session_id -> (live history, snapshot taken when it was queued, replaces the stored history)
+        self._pending: Dict[str, Tuple[List[Dict], List[Dict], bool]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Held while writing
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._stats = {
+            "submitted": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "written": 0,
+            "errors": 0,
+            "max_batch": 0
+        }
+
+        if self.enabled:
+            self._worker = threading.Thread(target=self._run, name='session-write-behind', daemon=True)
+            self._worker.start()
+            logging.info(f"Session write-behind enabled (durability window: {self.window}s)")
+
+    def submit(self, session_id: str, history: List[Dict], replace: bool = False):
+        """Queue a session save, replacing any queued save of the same session"""
+        with self._lock:
+            queued = self._pending.get(session_id)
+            if queued is not None:
+                self._stats["coalesced"] += 1
+                replace = replace or queued[2]
+            # Snapshot the list: the live history keeps growing while it waits
+            self._pending[session_id] = (history, list(history), replace)
+            self._stats["submitted"] += 1
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def write_now(self, session_id: str, history: List[Dict], replace: bool = False):
+        """Write a session immediately, superseding its queued save"""
+        with self._flush_lock:
+            with self._lock:
+                queued = self._pending.pop(session_id, None)
+            replace = replace or bool(queued and queued[2])
+            try:
+                self.save_many([(session_id, history)], replace={session_id} if replace else ())
+            except BaseException:
+                if queued is not None:
+                    with self._lock:
+                        self._requeue(session_id, queued)
+                raise
+            with self._lock:
+                self._stats["written"] += 1
+
+    def discard(self, session_id: str):
+        """Forget a queued save (the session was deleted)"""
+        with self._flush_lock:
+            with self._lock:
+                self._pending.pop(session_id, None)
+
+    def flush(self) -> int:
+        """Write every pending session now; returns how many were written"""
+        written = 0
+        while True:
+            count = self._flush_batch()
+            if count <= 0:
+                return written
+            written += count
+
+    def close(self):
+        """Stop the background writer and flush what is still pending"""
+        self._stop.set()
+        self._wake.set()
+        if self._worker is not None:
+            self._worker.join(timeout=5)
+        flushed = self.flush()
+        if flushed:
+            logging.info(f"Flushed {flushed} pending session(s) on shutdown")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        stats["enabled"] = self.enabled
+        stats["window"] = self.window
+        return stats
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.window)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            # A failed batch stays pending until the next window
+            while self._flush_batch() > 0:
+                pass
+
+    def _flush_batch(self) -> int:
+        # Returns sessions written, 0 if nothing was pending, -1 if the batch failed
+        with self._flush_lock:
+            with self._lock:
+                session_ids = list(self._pending)[:self.batch_size]
+                batch = [(session_id, self._pending.pop(session_id)) for session_id in session_ids]
+            if not batch:
+                return 0
+
+            started = time.time()
+            try:
+                self.save_many(
+                    [(session_id, snapshot) for session_id, (_, snapshot, _) in batch],
+                    replace={session_id for session_id, (_, _, replace) in batch if replace}
+                )
+            except Exception as e:
+                logging.error(f"Write-behind flush of {len(batch)} session(s) failed: {e}")
+                with self._lock:
+                    self._stats["errors"] += 1
+                    for session_id, queued in batch:
+                        self._requeue(session_id, queued)
+                return -1
+
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["written"] += len(batch)
+                self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+                # Sessions saved again while this batch was written are still dirty
+                written = [(session_id, live) for session_id, (live, _, _) in batch if session_id not in self._pending]
+            logging.debug(f"Write-behind flushed {len(batch)} session(s) in {time.time() - started:.3f}s")
+
+        # Outside the flush lock: on_written may take the session cache lock,
+        # whose write-backs call write_now()
+        if self.on_written is not None:
+            for session_id, live in written:
+                self.on_written(session_id, live)
+        return len(batch)
+
+    def _requeue(self, session_id: str, queued: Tuple[List[Dict], List[Dict], bool]):
+        # Caller holds the lock. A newer save queued meanwhile wins, but still has
+        # to replace the stored history if the failed one did
+        newer = self._pending.get(session_id)
+        if newer is None:
+            self._pending[session_id] = queued
+        elif queued[2] and not newer[2]:
+            self._pending[session_id] = (newer[0], newer[1], True)